@@ -1,8 +1,9 @@
 # app.py — Render 部署就绪（支持 / 与 /api/* 双路径，SSE 稳定，健康检查）
 from flask import Flask, request, render_template_string, jsonify, Response
-from treys import Card, Evaluator
+from treys import Card
+from treys.lookup import LookupTable
 from flask_cors import CORS
-import os, re, json, random, time, uuid, threading
+import os, sys, re, json, random, time, uuid, threading, itertools, math, atexit, multiprocessing, bisect
 from datetime import datetime, timedelta
 
 # ================== 基础与 CORS ==================
@@ -11,9 +12,22 @@ CORS(app, resources={r"/*": {"origins": os.getenv("CORS_ORIGINS", "*")}}, suppor
 
 # ========= 可调参数（与你一致） =========
 DEFAULT_VILLAINS = 3
-TRIALS_FLOP, TRIALS_TURN, TRIALS_RIVER = 8000, 12000, 16000
+MAX_VILLAINS = 22  # 52 张牌减去手牌与 5 张公共牌，最多还能发 22 名对手
+TRIALS_PREFLOP, TRIALS_FLOP, TRIALS_TURN, TRIALS_RIVER = 8000, 8000, 12000, 16000
 EARLYSTOP_EPS = 0.012
+MC_STRATIFY = os.getenv("MC_STRATIFY", "1") == "1"  # 按第一张待发公共牌分层抽样（等量轮流分配）
 TIME_BUDGET_S = 0.25
+EQUITY_ENGINE = os.getenv("EQUITY_ENGINE", "numpy")  # numpy：批量向量化；python：逐次模拟；pool：多进程
+# 穷举耗时约 0.55ms + 0.12µs/组合，numpy 蒙特卡洛（带早停）一街约 4–7ms，两者在 ~24,000 组合处持平：
+# 河牌单挑（990）穷举，转牌单挑（45,540）默认走蒙特卡洛
+ENUM_MAX_COMBOS = int(os.getenv("ENUM_MAX_COMBOS", "20000"))  # 组合数不超过该值时改用穷举（精确胜率）
+# 需要下一张牌逐张胜率时穷举同一网格就顺带算出，比蒙特卡洛再单独扫一遍便宜（转牌单挑 ~10ms 对 ~16ms）
+ENUM_SWEEP_MAX_COMBOS = int(os.getenv("ENUM_SWEEP_MAX_COMBOS", "60000"))
+EQUITY_CACHE_SIZE = int(os.getenv("EQUITY_CACHE_SIZE", "4096"))
+EQUITY_CACHE_TTL = int(os.getenv("EQUITY_CACHE_TTL", "3600"))  # 秒
+NEXT_CARD_SWEEP = os.getenv("NEXT_CARD_SWEEP", "1") == "1"  # 翻牌/转牌附带下一张牌的逐张胜率
+NEXT_CARD_TRIALS = int(os.getenv("NEXT_CARD_TRIALS", "2000"))  # 逐张胜率蒙特卡洛的发牌局数（每局代入全部候选牌）
+NEXT_CARD_SWING = float(os.getenv("NEXT_CARD_SWING", "0.1"))  # 胜率升/降超过该值记为 outs/危险牌
 
 SIM_WEIGHT_PER_STREET = 0.85
 LLM_WEIGHT_PER_STREET = 0.15
@@ -24,6 +38,96 @@ try:
     DEFAULT_TEMP = float(os.getenv("LLM_TEMPERATURE", "0.2"))
 except:
     DEFAULT_TEMP = 0.2
+LLM_BASE_URL = os.getenv("OPENAI_BASE_URL") or None  # 兼容 OpenAI 协议的自建/代理服务
+LLM_TIMEOUT_S = float(os.getenv("LLM_TIMEOUT_S", "10"))   # 单次调用超时
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "1"))  # SDK 层对网络错误的重试
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "4"))  # 同时在途的建议请求数
+ADVICE_CACHE_SIZE = int(os.getenv("ADVICE_CACHE_SIZE", "2048"))
+ADVICE_CACHE_TTL = int(os.getenv("ADVICE_CACHE_TTL", "3600"))  # 秒
+LLM_STREAM = os.getenv("LLM_STREAM", "1") == "1"  # 流式取回建议，边生成边经 SSE 推给前端
+LLM_STREAM_FLUSH_S = float(os.getenv("LLM_STREAM_FLUSH_S", "0.08"))  # 草稿推送的最小间隔
+LLM_TASK_BUDGET_S = float(os.getenv("LLM_TASK_BUDGET_S", "20"))  # 单个任务所有街的建议总共最多等多久
+BREAKER_FAILS = int(os.getenv("LLM_BREAKER_FAILS", "3"))          # 连续失败/慢调用几次后熔断
+BREAKER_SLOW_S = float(os.getenv("LLM_BREAKER_SLOW_S", "8"))      # 超过该耗时的调用记为慢调用
+BREAKER_COOLDOWN_S = float(os.getenv("LLM_BREAKER_COOLDOWN_S", "30"))  # 熔断多久后放一个探测请求
+
+# ========= 指标（Prometheus 文本格式，/metrics） =========
+class Counter:
+    """按标签值分组的计数器；inc 只在锁内做一次字典加法。"""
+    kind = "counter"
+    def __init__(self, name, help_text, labels=()):
+        self.name, self.help, self.labels = name, help_text, labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, lv, v) for lv, v in self._values.items()]
+
+class Histogram(Counter):
+    """累积分桶直方图（_bucket/_sum/_count）；observe 为一次二分查找 + 锁内加法。"""
+    kind = "histogram"
+    def __init__(self, name, help_text, buckets, labels=()):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(label_values)
+            if row is None:
+                row = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            row[0][i] += 1
+            row[1] += value
+            row[2] += 1
+
+    def samples(self):
+        out = []
+        with self._lock:
+            rows = [(lv, list(r[0]), r[1], r[2]) for lv, r in self._values.items()]
+        for lv, counts, total, n in rows:
+            acc = 0
+            for le, c in zip(self.buckets + (float("inf"),), counts):
+                acc += c
+                out.append((self.name + "_bucket", lv + (("+Inf" if le == float("inf") else repr(le)),), acc))
+            out.append((self.name + "_sum", lv, total))
+            out.append((self.name + "_count", lv, n))
+        return out
+
+_LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+M_SIM_SECONDS = Histogram("poker_sim_seconds", "单街胜率计算耗时", _LATENCY_BUCKETS, ("street", "method"))
+M_MC_RATE = Histogram("poker_mc_trials_per_second", "蒙特卡洛每次调用的试验速率",
+                      (1e4, 3e4, 1e5, 3e5, 1e6, 3e6, 1e7), ("engine",))
+M_MC_TRIALS = Counter("poker_mc_trials_total", "蒙特卡洛累计试验数", ("engine",))
+M_LLM_SECONDS = Histogram("poker_llm_seconds", "单街建议耗时（含缓存命中与回退）", _LATENCY_BUCKETS, ("source",))
+M_LLM_FALLBACK = Counter("poker_llm_fallback_total", "建议回退到规则引擎的次数", ("reason",))
+M_QUEUE_WAIT = Histogram("poker_queue_wait_seconds", "任务排队等待时间", _LATENCY_BUCKETS)
+M_TASK_SECONDS = Histogram("poker_task_seconds", "任务从开始计算到结束的耗时", _LATENCY_BUCKETS)
+METRICS = [M_SIM_SECONDS, M_MC_RATE, M_MC_TRIALS, M_LLM_SECONDS, M_LLM_FALLBACK, M_QUEUE_WAIT, M_TASK_SECONDS]
+
+def _fmt_labels(names, values):
+    """标签值按文本格式转义反斜杠、双引号与换行。"""
+    if not names: return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in zip(names, values)) + "}"
+
+def render_metrics(gauges=()):
+    """gauges：抓取时现算的 (name, help, type, [(labels_dict, value)])。"""
+    lines = []
+    for m in METRICS:
+        lines += [f"# HELP {m.name} {m.help}", f"# TYPE {m.name} {m.kind}"]
+        names = m.labels + (("le",) if m.kind == "histogram" else ())
+        for name, lv, v in m.samples():
+            lines.append(f"{name}{_fmt_labels(names[:len(lv)], lv)} {v}")
+    for name, help_text, kind, rows in gauges:
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        for labels, v in rows:
+            lines.append(f"{name}{_fmt_labels(tuple(labels), tuple(labels.values()))} {v}")
+    return "\n".join(lines) + "\n"
 
 # ========= 牌面解析 =========
 SUIT_MAP = {'s':'s','♠':'s','黑桃':'s','h':'h','♥':'h','红桃':'h',
@@ -32,103 +136,1209 @@ RANK_MAP = {'A':'A','a':'A','K':'K','k':'K','Q':'Q','q':'Q','J':'J','j':'J',
             'T':'T','t':'T','10':'T','１０':'T','9':'9','９':'9','8':'8','８':'8',
             '7':'7','７':'7','6':'6','６':'6','5':'5','５':'5','4':'4','４':'4',
             '3':'3','３':'3','2':'2','２':'2'}
-SEP_REGEX = re.compile(r'[,\u3001/\s]+')
+_SEP_TRANS = str.maketrans({",": " ", "\u3001": " ", "/": " "})  # 分隔符：逗号、顿号、斜杠与任意空白，换成空格后 str.split()
+
+def _build_token_table():
+    """
+    全部合法写法 → (标准写法, treys 整数)：点数在前或花色在前，字母不分大小写，
+    含全角数字与 ♠♥♦♣/中文花色名，共几百个 key；解析时一次字典查找，不再逐个试正则。
+    """
+    ranks = {**RANK_MAP, **{k.upper(): v for k, v in RANK_MAP.items()}}
+    suits = {**SUIT_MAP, **{k.upper(): v for k, v in SUIT_MAP.items()}}
+    table = {}
+    for r, rv in ranks.items():
+        for s, sv in suits.items():
+            hit = (rv + sv, Card.new(rv + sv))
+            table[r + s] = table[s + r] = hit
+    return table
+
+_TOKEN_TABLE = _build_token_table()
+
+def _lookup_token(tok):
+    """单张牌的表查找；牌面中间夹空白（如“A ♠”）时去掉空白再查。"""
+    hit = _TOKEN_TABLE.get(tok)
+    if hit is None:
+        t = "".join(tok.split())
+        if not t: raise ValueError("空牌面")
+        hit = _TOKEN_TABLE.get(t)
+        if hit is None: raise ValueError(f"无法识别的牌面：{tok}")
+    return hit
 
 def normalize_token(tok: str) -> str:
-    t = tok.strip()
-    if not t: raise ValueError("空牌面")
-    m = re.match(r'^(A|K|Q|J|10|T|[2-9]|１０|９|８|７|６|５|４|３|２)\s*(s|h|d|c|♠|♥|♦|♣|黑桃|红桃|方片|方块|梅花)$', t, re.IGNORECASE)
-    if m: r,s = m.group(1), m.group(2); return RANK_MAP[r]+SUIT_MAP[s]
-    m2 = re.match(r'^(黑桃|红桃|方片|方块|梅花|♠|♥|♦|♣|s|h|d|c)\s*(A|K|Q|J|10|T|[2-9]|１０|９|８|７|６|５|４|３|２)$', t, re.IGNORECASE)
-    if m2: s,r = m2.group(1), m2.group(2); return RANK_MAP[r]+SUIT_MAP[s]
-    t2 = t
-    for sym,letter in [('♠','s'),('♥','h'),('♦','d'),('♣','c')]: t2 = t2.replace(sym,letter)
-    t2 = t2.replace(' ','')
-    m3 = re.match(r'^(A|K|Q|J|T|10|[2-9]|１０|９|８|７|６|５|４|３|２)(s|h|d|c)$', t2, re.IGNORECASE)
-    if m3: r,s = m3.group(1), m3.group(2); return RANK_MAP[r]+SUIT_MAP[s]
-    raise ValueError(f"无法识别的牌面：{tok}")
+    return _lookup_token(tok)[0]
 
 def parse_cards(line: str, min_n: int, max_n: int):
-    tokens = [x for x in SEP_REGEX.split(line.strip()) if x] if line else []
+    tokens = line.translate(_SEP_TRANS).split() if line else []
     if not (min_n <= len(tokens) <= max_n): raise ValueError(f"牌数量应在 {min_n}–{max_n} 张，当前 {len(tokens)} 张。")
-    std = [normalize_token(t) for t in tokens]
+    hits = [_lookup_token(t) for t in tokens]
+    std = [h[0] for h in hits]
     if len(set(std)) != len(std): raise ValueError(f"存在重复牌：{std}")
-    return [Card.new(s) for s in std], std
+    return [h[1] for h in hits], std
+
+def parse_many(lines, min_n=1, max_n=7, return_exceptions=False):
+    """
+    批量解析（牌谱导入）：逐行调用 parse_cards，结果与报错文字都相同。
+    return_exceptions=True 时出错的行原位放 ValueError，不中断整批；否则遇到第一行错误即抛出。
+    """
+    out = []
+    for line in lines:
+        try:
+            out.append(parse_cards(line, min_n, max_n))
+        except ValueError as e:
+            if not return_exceptions: raise
+            out.append(e)
+    return out
 
 # ========= 快速蒙特卡洛 =========
-_EVAL = Evaluator()
 _FULL_DECK = [Card.new(r+s) for r in "23456789TJQKA" for s in "shdc"]
 
-def equity_mc_fast(hero, board, villains=1, trials=10000, seed=None, eps=EARLYSTOP_EPS, t_budget_s=TIME_BUDGET_S, progress_cb=None):
-    rng = random.Random(seed)
-    known = set(hero) | set(board)
-    avail = [c for c in _FULL_DECK if c not in known]
+def _build_rank_class():
+    """名次 → 牌型类别 0–9（皇家同花顺 … 高牌），与 Evaluator.get_rank_class 相同；只用 LookupTable 的分界常量，不建 treys 的查找表。"""
+    out, lo = bytearray(7463), 0
+    for hi, cls in sorted(LookupTable.MAX_TO_RANK_CLASS.items()):
+        out[lo:hi + 1] = bytes([cls]) * (hi + 1 - lo)
+        lo = hi + 1
+    return bytes(out)
+
+_RANK_CLASS = _build_rank_class()
+_CLASS_NAMES = LookupTable.RANK_CLASS_TO_STRING
+N_CLASSES = 10
+
+def equity_mc_fast(hero, board, villains=1, trials=10000, seed=None, eps=EARLYSTOP_EPS, t_budget_s=TIME_BUDGET_S, progress_cb=None, engine=None, ranges=None,
+                   prior=None, buckets=None, info=None, hist=False):
+    """
+    prior=(wins_equiv, n)：上一街里与本街实际发出的牌一致的样本，直接计入，只补足差额；
+    buckets：传入 new_buckets() 时，按下一张公共牌记录每局结果，供下一街作 prior（进程池模式不记录）。
+    info：传入 dict 时写回实际试验数 trials 与 95% 置信半宽 ci。
+    hist：同一遍模拟里另记牌型分布（见 new_dist），写回 info["dist"]；只含本次模拟的局，不含 prior。
+    """
+    engine = engine or EQUITY_ENGINE
+    if villains < 1:  # 没有对手：与原实现一致恒为 1.0，不进引擎（各引擎按 ≥1 名对手组批）
+        if info is not None: info.update(trials=0, ci=0.0)
+        return 1.0
+    if ranges is not None and np is None:
+        raise ValueError("对手范围需要安装 numpy")
+    t0 = time.perf_counter()
+    if engine == "pool":
+        tally = _equity_mc_pool(hero, board, villains, trials, seed, eps, t_budget_s, progress_cb, ranges, prior, hist)
+    elif ranges is not None or (engine == "numpy" and np is not None):
+        engine = "numpy"
+        tally = _equity_mc_numpy(hero, board, villains, trials, seed, eps, t_budget_s, progress_cb, ranges, prior, buckets,
+                                 hist=hist)
+    else:
+        engine = "python"
+        tally = _equity_mc_python(hero, board, villains, trials, seed, eps, t_budget_s, progress_cb, prior, buckets,
+                                  hist=hist)
+    # 每次调用记一笔（不进热循环）；prior 复用的样本不算本次模拟
+    simulated = tally.n - (prior[1] if prior else 0)
+    M_MC_TRIALS.inc(simulated, engine)
+    M_MC_RATE.observe(simulated / max(time.perf_counter() - t0, 1e-9), engine)
+    p, half_width = tally.estimate()
+    if info is not None:
+        info.update(trials=tally.n, ci=round(half_width, 4))
+        if tally.dist is not None: info["dist"] = tally.dist
+    return p
+
+class _Tally:
+    """
+    蒙特卡洛计数。每局得分 share ∈ {0, 1/k, 1}（k 为平分人数），除总和外还记平方和，
+    方差用样本方差而不是 p(1-p)：平局越多二项近似高估得越多，早停就越晚。
+    分层（strata>0）时另按第一张待发公共牌（牌下标）记三项，按等权分层公式估计，
+    层间差异（不同转/河牌对胜率的影响）不再计入误差。
+    dist：hist 模式下的牌型分布计数（new_dist），否则为 None。
+    """
+    __slots__ = ("wins", "sq", "n", "strata", "s_w", "s_sq", "s_n", "dist")
+
+    def __init__(self, prior=None, strata=0, hist=False):
+        w, n = prior or (0.0, 0)
+        self.wins, self.sq, self.n = w, w, n  # prior 没有平方和；share² ≤ share，用 wins 作上界偏保守
+        self.strata = strata
+        self.s_w, self.s_sq, self.s_n = [0.0] * 52, [0.0] * 52, [0] * 52
+        self.dist = new_dist() if hist else None
+
+    def merge(self, other):
+        self.wins += other.wins; self.sq += other.sq; self.n += other.n
+        self.strata = max(self.strata, other.strata)
+        for k in range(52):
+            self.s_w[k] += other.s_w[k]; self.s_sq[k] += other.s_sq[k]; self.s_n[k] += other.s_n[k]
+        if self.dist is not None and other.dist is not None:
+            merge_dist(self.dist, other.dist)
+
+    def estimate(self):
+        """(p, 95% 置信半宽)。每层都有 ≥2 个样本才用分层公式，否则按整体样本方差。"""
+        if self.strata:
+            ks = [k for k in range(52) if self.s_n[k]]
+            if len(ks) == self.strata and all(self.s_n[k] >= 2 for k in ks):
+                p = var = 0.0
+                for k in ks:
+                    nk, wk = self.s_n[k], self.s_w[k]
+                    p += wk / nk
+                    var += max(self.s_sq[k] - wk * wk / nk, 0.0) / (nk - 1) / nk
+                return p / self.strata, 1.96 * var ** 0.5 / self.strata
+        n = self.n
+        if n < 2:
+            return (self.wins / n if n else 0.5), 1.0
+        p = self.wins / n
+        return p, 1.96 * (max(self.sq - self.wins * p, 0.0) / (n - 1) / n) ** 0.5
+
+def new_dist():
+    """
+    牌型分布计数，长度固定：hero / villain 为 N_CLASSES 个牌型类别（_RANK_CLASS 的取值），
+    villain 记的是每局对手中最大的那手；outcome 为 [赢, 平, 输] 的局数。
+    """
+    return {"hero": [0] * N_CLASSES, "villain": [0] * N_CLASSES, "outcome": [0, 0, 0]}
+
+def merge_dist(dst, src):
+    for name in ("hero", "villain", "outcome"):
+        dst[name] = [a + b for a, b in zip(dst[name], src[name])]
+
+def new_buckets():
+    """按下一张公共牌（牌下标 0–51）分桶的样本计数。"""
+    return {"wins": [0.0] * 52, "n": [0] * 52}
+
+def bucket_prior(buckets, card):
+    """取出与实际发出的 card 一致的那一桶，作为下一街的 prior；没有样本返回 None。"""
+    k = _CARD_INDEX[card]
+    return (buckets["wins"][k], buckets["n"][k]) if buckets and buckets["n"][k] else None
+
+def _prior_done(tally, eps):
+    """prior 本身已满足早停精度时无需再补样本。"""
+    return tally.n > 0 and tally.estimate()[1] < eps
+
+def _equity_mc_python(hero, board, villains, trials, seed, eps, t_budget_s, progress_cb, prior=None, buckets=None, stratify=None,
+                      hist=False):
+    """
+    纯 Python 引擎；返回 _Tally。
+    牌用下标（rank*4+suit）表示，余牌放在预分配的 array 里原地做部分 Fisher–Yates：每局只交换前几张；
+    手牌/公共牌的 key 和与各花色点数掩码在循环外算好，每局只累加新发的牌、查一次表
+    （凑出同花时才按花色拼点数掩码），循环里不建列表/元组，也不再走 evaluate 的通用路径。
+    """
+    from array import array
+    rt = rank_table()
+    nonflush, flush, flush_suit = rt.nonflush, rt.flush, _RT_FLUSH_SUIT
+    key, rbit = _RT_KEY, _RT_RBIT
+    rnd = random.Random(seed).random
+    hero_idx = [_CARD_INDEX[c] for c in hero]
+    board_idx = [_CARD_INDEX[c] for c in board]
+    known = 0  # 已知牌的 52 位掩码
+    for c in hero_idx + board_idx: known |= 1 << c
+    avail = array("b", [i for i in range(52) if not known >> i & 1])
+    deck = array("b", avail)
+    m = len(deck)
+    pos = array("b", [0] * 52)  # 每张牌当前在 deck 里的位置（分层时用来把指定的牌挪到末尾）
+    for p, c in enumerate(deck): pos[c] = p
     need_public = 5 - len(board)
     need_opp = villains * 2
     need_total = need_public + need_opp
-
-    wins_equiv = 0.0
-    n = 0
+    if not need_public: buckets = None
+    # 分层：第一张公共牌按 avail 轮流指定（随机起点），其余牌从剩下的牌里随机发
+    if stratify is None: stratify = MC_STRATIFY and prior is None
+    stratify = stratify and need_public > 0
+    turn = int(rnd() * m)
+    lim, deal = (m - 1, need_total - 1) if stratify else (m, need_total)
+
+    # 循环不变量
+    board_key = sum(key[c] for c in board_idx)
+    hero_key = sum(key[c] for c in hero_idx)
+    board_sm = [0] * 4
+    for c in board_idx: board_sm[c & 3] |= rbit[c]
+    hero_sm = list(board_sm)
+    for c in hero_idx: hero_sm[c & 3] |= rbit[c]
+
+    tally = _Tally(prior, m if stratify else 0, hist)
+    s_w, s_sq, s_n = tally.s_w, tally.s_sq, tally.s_n
+    if _prior_done(tally, eps):
+        return tally
+    if hist:
+        rcls = _RANK_CLASS
+        h_cls, v_cls, outcome = tally.dist["hero"], tally.dist["villain"], tally.dist["outcome"]
     start = time.monotonic()
     BATCH = 400
+    c0 = -1
 
-    while n < trials:
+    while tally.n < trials:
         if time.monotonic() - start > t_budget_s:
             break
-        this = min(BATCH, trials - n)
+        this = min(BATCH, trials - tally.n)
+        wins_equiv = sq = 0.0
         for _ in range(this):
-            draw = rng.sample(avail, need_total)
-            opp = draw[:need_opp]; pub = draw[need_opp:]
-            vill = [(opp[i], opp[i+1]) for i in range(0, need_opp, 2)]
-            b = tuple(board) + tuple(pub)
-            my = _EVAL.evaluate(tuple(hero), b)
+            if stratify:
+                turn += 1
+                if turn == m: turn = 0
+                c0 = avail[turn]
+                p = pos[c0]; last = deck[lim]
+                deck[p] = last; pos[last] = p; deck[lim] = c0; pos[c0] = lim
+                for j in range(deal):
+                    r = j + int(rnd() * (lim - j))
+                    x = deck[r]; y = deck[j]
+                    deck[j] = x; pos[x] = j; deck[r] = y; pos[y] = r
+                pk = board_key + key[c0]
+            else:
+                for j in range(deal):
+                    r = j + int(rnd() * (m - j))
+                    x = deck[r]; deck[r] = deck[j]; deck[j] = x
+                pk = board_key
+            # deck[:need_opp] 是对手两两一组的底牌，deck[need_opp:deal]（加上分层牌 c0）是待发公共牌
+            for j in range(need_opp, deal): pk += key[deck[j]]
+
+            t = pk + hero_key
+            fs = flush_suit[t & 0xFFF]
+            if fs < 0:
+                my = nonflush[t >> 12]
+            else:
+                msk = hero_sm[fs]
+                if stratify and c0 & 3 == fs: msk |= rbit[c0]
+                for j in range(need_opp, deal):
+                    if deck[j] & 3 == fs: msk |= rbit[deck[j]]
+                my = flush[msk]
             best = 7463; ties = 0
-            for v1, v2 in vill:
-                s = _EVAL.evaluate((v1, v2), b)
+            for j in range(0, need_opp, 2):
+                v1 = deck[j]; v2 = deck[j + 1]
+                t = pk + key[v1] + key[v2]
+                fs = flush_suit[t & 0xFFF]
+                if fs < 0:
+                    s = nonflush[t >> 12]
+                else:
+                    msk = board_sm[fs]
+                    if v1 & 3 == fs: msk |= rbit[v1]
+                    if v2 & 3 == fs: msk |= rbit[v2]
+                    if stratify and c0 & 3 == fs: msk |= rbit[c0]
+                    for i in range(need_opp, deal):
+                        if deck[i] & 3 == fs: msk |= rbit[deck[i]]
+                    s = flush[msk]
                 if s < best: best = s; ties = 1
                 elif s == best: ties += 1
-            if my < best: wins_equiv += 1.0
-            elif my == best: wins_equiv += 1.0/(ties+1)
-        n += this
+            share = 1.0 if my < best else (1.0/(ties+1) if my == best else 0.0)
+            wins_equiv += share; sq += share * share
+            if hist:
+                h_cls[rcls[my]] += 1; v_cls[rcls[best]] += 1; outcome[(my >= best) + (my > best)] += 1
+            if stratify or buckets is not None:
+                k = c0 if stratify else deck[need_opp]
+                if stratify:
+                    s_w[k] += share; s_sq[k] += share * share; s_n[k] += 1
+                if buckets is not None:
+                    buckets["wins"][k] += share; buckets["n"][k] += 1
+        tally.wins += wins_equiv; tally.sq += sq; tally.n += this
+
+        half_width = tally.estimate()[1]
+
+        if progress_cb:
+            approx_pct = min(100, int(tally.n * 100 / trials))
+            progress_cb(approx_pct)
+
+        if half_width < eps:
+            break
+
+    return tally
+
+# ========= 7 张牌查表估值（文件 + mmap，多进程共享） =========
+# 每张牌一个打包整数：高位是点数加性 key（SpecialK 常数，任意 7 张之和唯一对应点数组合），
+# 低 12 位是花色 key（八进制计数 1/8/64/512，和 ≤ 7*512 不会进位）。
+# 估值 = 每张牌读一次 _RT_CARD 求和 → 非同花表读一次；只有凑出同花时才再拼一次点数掩码查同花表。
+RANK_TABLE_PATH = os.getenv("RANK_TABLE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "rank7.bin"))
+_RANK_KEYS = (0, 1, 5, 22, 98, 453, 2031, 8698, 22854, 83661, 262349, 636345, 1479181)
+_SUIT_KEYS = (1, 8, 64, 512)  # 与 _FULL_DECK 的 "shdc" 顺序一致
+_NO_HAND = 7463               # 比最差的高牌（7462）还差，用作“无同花”哨兵
+_RT_MAGIC = b"RK7T0001"
+_RT_NF7 = 4*_RANK_KEYS[12] + 3*_RANK_KEYS[11] + 1   # 7 张非同花表长度
+_RT_N6, _RT_N5 = 18395, 6175                          # 6/5 张点数组合数（稀疏存 key 与名次）
+_RT_CARD = {c: (_RANK_KEYS[i // 4] << 12) | _SUIT_KEYS[i % 4] for i, c in enumerate(_FULL_DECK)}
+_RT_SUIT_BIT = {c: 1 << (12 + i % 4) for i, c in enumerate(_FULL_DECK)}  # treys 牌整数中的花色位
+# 同样的打包 key / 点数位，按牌下标（rank*4+suit）索引，供纯 Python 引擎的热循环直接取用
+_RT_KEY = [(_RANK_KEYS[i // 4] << 12) | _SUIT_KEYS[i % 4] for i in range(52)]
+_RT_RBIT = [1 << (i // 4) for i in range(52)]
+# 花色 key 之和 → 满 5 张的花色下标（-1 表示无同花）
+_RT_FLUSH_SUIT = [-1] * 4096
+for _cnt in itertools.product(range(8), repeat=4):
+    if sum(_cnt) <= 7 and max(_cnt) >= 5:
+        _RT_FLUSH_SUIT[sum(k*n for k, n in zip(_SUIT_KEYS, _cnt))] = _cnt.index(max(_cnt))
+
+def _prime_product(ranks):
+    p = 1
+    for r in ranks: p *= Card.PRIMES[r]
+    return p
+
+def _rank_multisets(n):
+    for ranks in itertools.combinations_with_replacement(range(13), n):
+        if all(ranks.count(r) <= 4 for r in set(ranks)): yield ranks
+
+def build_rank_table(path=RANK_TABLE_PATH):
+    """
+    由 treys 的 5 张查找表推出 5/6/7 张牌的最好名次并写盘（先写临时文件再原子替换）。
+    布局：magic | nf6_keys u32 | nf5_keys u32 | nf7 u16 | flush u16 | nf6_ranks u16 | nf5_ranks u16
+    """
+    from array import array
+    lut = LookupTable()
+    nf7 = array("H", [_NO_HAND]) * _RT_NF7
+    for ranks in _rank_multisets(7):
+        nf7[sum(_RANK_KEYS[r] for r in ranks)] = min(lut.unsuited_lookup[_prime_product(c)] for c in itertools.combinations(ranks, 5))
+    flush = array("H", [_NO_HAND]) * (1 << 13)
+    for n in (5, 6, 7):
+        for ranks in itertools.combinations(range(13), n):
+            flush[sum(1 << r for r in ranks)] = min(lut.flush_lookup[_prime_product(c)] for c in itertools.combinations(ranks, 5))
+    sparse = {}
+    for n in (6, 5):
+        rows = sorted((sum(_RANK_KEYS[r] for r in ranks),
+                       min(lut.unsuited_lookup[_prime_product(c)] for c in itertools.combinations(ranks, 5)))
+                      for ranks in _rank_multisets(n))
+        sparse[n] = (array("I", [k for k, _ in rows]), array("H", [v for _, v in rows]))
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(_RT_MAGIC)
+        for part in (sparse[6][0], sparse[5][0], nf7, flush, sparse[6][1], sparse[5][1]):
+            part.tofile(f)
+    os.replace(tmp, path)
+
+class RankTable7:
+    """
+    treys.Evaluator 的替身：evaluate(hand, board) 返回与 treys 完全相同的名次（1 最强，7462 最弱），
+    表通过 mmap 只读映射，gunicorn 多个 worker 共享同一份物理页。
+    """
+    def __init__(self, path=RANK_TABLE_PATH):
+        import mmap
+        if not os.path.exists(path):
+            build_rank_table(path)
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:8] != _RT_MAGIC:
+            raise ValueError(f"牌力表格式不符：{path}")
+        mv = memoryview(self._mm)
+        off = 8
+        def take(fmt, size, count):
+            nonlocal off
+            part = mv[off:off + size*count].cast(fmt)
+            off += size*count
+            return part
+        nf6_keys, nf5_keys = take("I", 4, _RT_N6), take("I", 4, _RT_N5)
+        self.nonflush = take("H", 2, _RT_NF7)
+        self.flush = take("H", 2, 1 << 13)
+        nf6_ranks, nf5_ranks = take("H", 2, _RT_N6), take("H", 2, _RT_N5)
+        self._sparse = {6: dict(zip(nf6_keys.tolist(), nf6_ranks.tolist())),
+                        5: dict(zip(nf5_keys.tolist(), nf5_ranks.tolist()))}
+        self.path = path
+
+    def evaluate(self, hand, board):
+        cards = tuple(hand) + tuple(board)
+        total = 0
+        for c in cards: total += _RT_CARD[c]
+        fs = _RT_FLUSH_SUIT[total & 0xFFF]
+        if fs >= 0:  # 7 张以内凑出同花时不可能再有葫芦/四条，同花就是最好牌型
+            bit = 1 << (12 + fs); mask = 0
+            for c in cards:
+                if c & bit: mask |= c >> 16
+            return self.flush[mask & 0x1FFF]
+        if len(cards) == 7:
+            return self.nonflush[total >> 12]
+        return self._sparse[len(cards)][total >> 12]
+
+    def get_rank_class(self, hr):
+        return _RANK_CLASS[hr]
+
+    def class_to_string(self, class_int):
+        return _CLASS_NAMES[class_int]
+
+_RANK_TABLE = None
+_RANK_TABLE_LOCK = threading.Lock()
+
+def rank_table():
+    """进程内单例；首次调用时若表文件不存在会先生成（约 1–2 秒）。"""
+    global _RANK_TABLE
+    if _RANK_TABLE is None:
+        with _RANK_TABLE_LOCK:
+            if _RANK_TABLE is None:
+                _RANK_TABLE = RankTable7()
+    return _RANK_TABLE
+
+# ========= 向量化蒙特卡洛（NumPy 批量） =========
+try:
+    import numpy as np
+except ImportError:  # 没装 numpy 时 equity_mc_fast 自动走纯 Python 引擎
+    np = None
+
+NP_BATCH = 4096
+NP_MIN_BATCH = 256  # 接近早停精度时的最小批量
+# 牌索引 idx = rank*4 + suit，与 _FULL_DECK 顺序一致
+_CARD_INDEX = {c: i for i, c in enumerate(_FULL_DECK)}
+_NP_TABLES = None
+_NP_TABLES_LOCK = threading.Lock()
+
+def _np_tables():
+    """复用 rank_table() 的 mmap 页做批量查表，不另拷贝。"""
+    global _NP_TABLES
+    if _NP_TABLES is None:
+        with _NP_TABLES_LOCK:
+            if _NP_TABLES is None:
+                rt = rank_table()
+                card_sb = np.zeros((52, 4), dtype=np.int32)  # 每张牌在其花色列上的点数位
+                for i in range(52):
+                    card_sb[i, i % 4] = 1 << (i // 4)
+                _NP_TABLES = {
+                    "nonflush": np.frombuffer(rt.nonflush, dtype=np.uint16),
+                    "flush": np.frombuffer(rt.flush, dtype=np.uint16),
+                    "card_key": np.array([_RANK_KEYS[i // 4] for i in range(52)], dtype=np.int32),
+                    "card_sb": card_sb,
+                    "rank_class": np.frombuffer(_RANK_CLASS, dtype=np.uint8),
+                }
+    return _NP_TABLES
+
+def _np_rank(tables, key, sb):
+    """批量名次：key 为 rank_key 之和，sb 为最后一维长度 4 的各花色点数掩码。"""
+    return np.minimum(tables["nonflush"][key], tables["flush"][sb].min(axis=-1))
+
+def _equity_mc_numpy(hero, board, villains, trials, seed, eps, t_budget_s, progress_cb, ranges=None, prior=None, buckets=None,
+                     stratify=None, hist=False):
+    """
+    与 equity_mc_fast 同口径：一次发 NP_BATCH 局牌，整批查表比牌；早停/时间预算/进度回调不变。返回 _Tally。
+    ranges 为每名对手的 1326 维权重（None 表示随机），此时改用 _deal_ranged 发牌（不分层）。
+    """
+    T = _np_tables()
+    card_key, card_sb = T["card_key"], T["card_sb"]
+    rng = np.random.default_rng(seed)
+    hero_idx = [_CARD_INDEX[c] for c in hero]
+    board_idx = [_CARD_INDEX[c] for c in board]
+    known = set(hero_idx) | set(board_idx)
+    avail = np.array([i for i in range(52) if i not in known], dtype=np.int64)
+    need_public = 5 - len(board)
+    need_opp = villains * 2
+    need_total = need_public + need_opp
+    if ranges is not None:
+        known_list = sorted(known)
+        prepared = _prepare_ranges(ranges, known_list)
+
+    # 手牌/公共牌在整个模拟中不变，先把它们的 key 与花色掩码算好
+    board_key = int(card_key[board_idx].sum()) if board_idx else 0
+    board_sb = card_sb[board_idx].sum(axis=0) if board_idx else np.zeros(4, dtype=np.int32)
+    hero_key = int(card_key[hero_idx].sum())
+    hero_sb = card_sb[hero_idx].sum(axis=0)
+
+    if stratify is None: stratify = MC_STRATIFY and prior is None
+    stratify = stratify and need_public > 0 and ranges is None
+    turn = int(rng.integers(len(avail))) if stratify else 0
+    tally = _Tally(prior, len(avail) if stratify else 0, hist)
+    if _prior_done(tally, eps):
+        return tally
+    if hist:
+        h_cls = np.zeros(N_CLASSES, dtype=np.int64); v_cls = np.zeros(N_CLASSES, dtype=np.int64)
+        outcome = np.zeros(3, dtype=np.int64)
+    if need_public and buckets is not None:
+        b_wins = np.zeros(52); b_n = np.zeros(52, dtype=np.int64)
+    else:
+        buckets = None
+    start = time.monotonic()
+    this = NP_BATCH
 
-        p = wins_equiv / n
-        se = (p * (1 - p) / max(n, 1)) ** 0.5
-        half_width = 1.96 * se
+    while tally.n < trials:
+        if time.monotonic() - start > t_budget_s:
+            break
+        this = min(this, trials - tally.n)
+        got = this
+        if stratify:
+            # 第一张公共牌按 avail 轮流指定，该列的随机键置为 2（不会被选中），其余照常无放回发牌
+            col = (turn + np.arange(this)) % len(avail)
+            turn = (turn + this) % len(avail)
+            keys = rng.random((this, len(avail)))
+            keys[np.arange(this), col] = 2.0
+            pick = np.argpartition(keys, need_total - 2, axis=1)[:, :need_total - 1]
+            draw = avail[pick]
+            opp = draw[:, :need_opp]
+            pub = np.concatenate([avail[col][:, None], draw[:, need_opp:]], axis=1)
+            v1, v2 = opp[:, 0::2], opp[:, 1::2]
+        elif ranges is None:
+            # 每行随机键取最小的 need_total 个 → 无放回发牌
+            pick = np.argpartition(rng.random((this, len(avail))), need_total - 1, axis=1)[:, :need_total]
+            draw = avail[pick]
+            opp = draw[:, :need_opp]; pub = draw[:, need_opp:]
+            v1, v2 = opp[:, 0::2], opp[:, 1::2]
+        else:
+            v1, v2, pub, ok = _deal_ranged(rng, this, known_list, prepared, need_public)
+            if not ok.all():  # 被拒绝的行不计入（拒绝采样，见 _deal_ranged）
+                v1, v2, pub = v1[ok], v2[ok], pub[ok]
+                got = int(ok.sum())
+                if not got: continue
+        pub_key = board_key + card_key[pub].sum(axis=1)
+        pub_sb = board_sb + card_sb[pub].sum(axis=1)
+
+        my = _np_rank(T, pub_key + hero_key, pub_sb + hero_sb)
+        vr = _np_rank(T, pub_key[:, None] + card_key[v1] + card_key[v2],
+                      pub_sb[:, None, :] + card_sb[v1] + card_sb[v2])
+        best = vr.min(axis=1)
+        ties = (vr == best[:, None]).sum(axis=1)
+        share = (my < best) + (my == best) / (ties + 1)
+        tally.wins += float(share.sum()); tally.sq += float((share * share).sum()); tally.n += got
+        if hist:
+            h_cls += np.bincount(T["rank_class"][my], minlength=N_CLASSES)
+            v_cls += np.bincount(T["rank_class"][best], minlength=N_CLASSES)
+            outcome += np.bincount((my >= best).astype(np.int64) + (my > best), minlength=3)
+        if stratify or buckets is not None:
+            w_k = np.bincount(pub[:, 0], weights=share, minlength=52)
+            n_k = np.bincount(pub[:, 0], minlength=52)
+            if stratify:
+                sq_k = np.bincount(pub[:, 0], weights=share * share, minlength=52)
+                tally.s_w = (np.asarray(tally.s_w) + w_k).tolist()
+                tally.s_sq = (np.asarray(tally.s_sq) + sq_k).tolist()
+                tally.s_n = (np.asarray(tally.s_n) + n_k).tolist()
+            if buckets is not None:
+                b_wins += w_k; b_n += n_k
+
+        half_width = tally.estimate()[1]
 
         if progress_cb:
-            approx_pct = min(100, int(n * 100 / trials))
+            approx_pct = min(100, int(tally.n * 100 / trials))
             progress_cb(approx_pct)
 
         if half_width < eps:
             break
+        # 半宽 ∝ 1/√n：按当前方差估出还差多少局，下一批只发这么多（+10% 余量），不再整批 NP_BATCH 地过冲
+        if eps > 0:
+            this = min(NP_BATCH, max(NP_MIN_BATCH, int(tally.n * ((half_width / eps) ** 2 - 1) * 1.1)))
+
+    if buckets is not None:
+        buckets["wins"] = [a + b for a, b in zip(buckets["wins"], b_wins.tolist())]
+        buckets["n"] = [a + b for a, b in zip(buckets["n"], b_n.tolist())]
+    if hist:
+        tally.dist = {"hero": h_cls.tolist(), "villain": v_cls.tolist(), "outcome": outcome.tolist()}
+    return tally
+
+# ========= 对手范围（1326 组合权重） =========
+# 组合下标与两张牌下标一一对应（i<j），采样时按行做前缀和 + 一次均匀数，不拒绝、不重试
+_COMBOS = [(i, j) for i in range(52) for j in range(i + 1, 52)]
+_COMBO_ID = {c: k for k, c in enumerate(_COMBOS)}
+_COMBO_ARR = np.array(_COMBOS, dtype=np.int64) if np is not None else None
+_RANGE_RANKS = "23456789TJQKA"
+_RANGE_TOKEN_RE = re.compile(r'^([2-9TJQKA])([2-9TJQKA])([SO]?)(\+?)$')
+_RANGE_SPAN_RE = re.compile(r'^([2-9TJQKA])([2-9TJQKA])([SO]?)-([2-9TJQKA])([2-9TJQKA])([SO]?)$')
+_RANGE_COMBO_RE = re.compile(r'^([2-9TJQKA])([SHDC])([2-9TJQKA])([SHDC])$')
+
+def _combo_blocked(dead):
+    """与已知牌 dead（牌下标）冲突的组合掩码。"""
+    d = np.zeros(52, dtype=bool); d[list(dead)] = True
+    return d[_COMBO_ARR[:, 0]] | d[_COMBO_ARR[:, 1]]
+
+def _class_combos(r1, r2, kind):
+    """一类起手牌（r1≥r2，kind ∈ {'s','o',''}）的全部组合下标。"""
+    out = []
+    for s1 in range(4):
+        for s2 in range(4):
+            a, b = r1*4 + s1, r2*4 + s2
+            if a == b or (r1 == r2 and s1 > s2): continue
+            if r1 != r2 and ((kind == "S" and s1 != s2) or (kind == "O" and s1 == s2)): continue
+            out.append(_COMBO_ID[(min(a, b), max(a, b))])
+    return out
+
+def _range_token_combos(tok):
+    t = tok.upper()
+    m = _RANGE_COMBO_RE.match(t)
+    if m:
+        a = _RANGE_RANKS.index(m.group(1))*4 + "SHDC".index(m.group(2))
+        b = _RANGE_RANKS.index(m.group(3))*4 + "SHDC".index(m.group(4))
+        if a == b: raise ValueError(f"无法识别的范围：{tok}")
+        return [_COMBO_ID[(min(a, b), max(a, b))]]
+    m = _RANGE_TOKEN_RE.match(t)
+    if m:
+        r1, r2 = sorted((_RANGE_RANKS.index(m.group(1)), _RANGE_RANKS.index(m.group(2))), reverse=True)
+        kind, plus = m.group(3), m.group(4)
+        if r1 == r2:
+            if kind: raise ValueError(f"无法识别的范围：{tok}")
+            tops = range(r1, 13) if plus else [r1]          # 77+ = 77..AA
+            return [c for r in tops for c in _class_combos(r, r, "")]
+        kickers = range(r2, r1) if plus else [r2]           # ATs+ = ATs..AKs
+        return [c for k in kickers for c in _class_combos(r1, k, kind)]
+    m = _RANGE_SPAN_RE.match(t)
+    if m:
+        a1, a2, b1, b2 = (_RANGE_RANKS.index(m.group(i)) for i in (1, 2, 4, 5))
+        kind = m.group(3)
+        if a1 == a2 and b1 == b2 and m.group(6) == kind == "":           # 22-55
+            return [c for r in range(min(a1, b1), max(a1, b1) + 1) for c in _class_combos(r, r, "")]
+        if a1 == b1 and a1 > max(a2, b2) and m.group(6) == kind:          # A5s-A2s
+            return [c for k in range(min(a2, b2), max(a2, b2) + 1) for c in _class_combos(a1, k, kind)]
+    raise ValueError(f"无法识别的范围：{tok}")
+
+def parse_range(text):
+    """
+    解析单个对手的范围，返回长度 1326 的权重数组；空串/random 表示完全随机（返回 None）。
+    支持 "22+,ATs+,KQo"、"A5s-A2s"、"77-99"、具体组合 "AsKs"、权重后缀 "KQo:0.5"，
+    或直接给 JSON 数组形式的 1326 维权重矩阵。
+    """
+    text = (text or "").strip()
+    if not text or text.lower() in ("random", "any") or text in ("随机", "任意"):
+        return None
+    if text.startswith("["):
+        w = np.asarray(json.loads(text), dtype=np.float64)
+        if w.shape != (len(_COMBOS),) or (w < 0).any():
+            raise ValueError(f"权重矩阵应为 {len(_COMBOS)} 个非负数")
+    else:
+        w = np.zeros(len(_COMBOS))
+        for tok in re.split(r'[,，\s]+', text):
+            if not tok: continue
+            weight = 1.0
+            if ":" in tok:
+                tok, ws = tok.split(":", 1)
+                weight = float(ws)
+            w[_range_token_combos(tok)] = weight
+    if not w.any():
+        raise ValueError(f"范围为空：{text}")
+    return w
+
+def parse_ranges(text, villains):
+    """多个对手的范围用 ; 分隔，按顺序分配；未写到的对手视为随机。全部随机时返回 None。"""
+    if not (text or "").strip(): return None
+    if np is None: raise ValueError("对手范围需要安装 numpy")
+    parts = re.split(r'[;；|]', text)
+    if len(parts) > villains:
+        raise ValueError(f"范围个数（{len(parts)}）多于对手人数（{villains}）")
+    ranges = [parse_range(p) for p in parts] + [None] * (villains - len(parts))
+    return ranges if any(r is not None for r in ranges) else None
+
+def _prepare_ranges(ranges, dead):
+    """
+    每个范围只保留与已知牌不冲突、权重 > 0 的组合：返回 [(组合牌下标 (K,2), 累积权重 (K,)) 或 None]。
+    窄范围 K 很小，后面的逐行采样代价只和 K 成正比。
+    """
+    blocked = _combo_blocked(dead)
+    out = []
+    for w in ranges:
+        if w is None:
+            out.append(None); continue
+        live = np.nonzero((w > 0) & ~blocked)[0]
+        if not len(live):
+            raise ValueError("对手范围与已知牌冲突，没有可用组合")
+        out.append((_COMBO_ARR[live], w[live].cumsum()))
+    return out
+
+def _deal_ranged(rng, rows, known_idx, prepared, need_public):
+    """
+    按范围发牌（考虑卡牌移除）：有范围的对手依次在“剩余可用组合”上按权重抽一手，
+    之后随机对手与公共牌从剩余牌里一次性无放回抽取。返回 (v1, v2, pub, ok)，只有 ok=True 的行可用。
+    目标分布是 w1·w2·… 限于互不冲突的组合；依次抽取时后面的对手被前面的手牌挤掉了一部分权重，
+    实际抽到的概率多了 1/Z2(h1) 这样的因子，所以每个后续对手按 剩余权重 / 全部可用权重 接受该行
+    （拒绝采样），接受的行恰好服从联合分布；无解的行剩余权重为 0，必然被拒绝。
+    """
+    used = np.zeros((rows, 52), dtype=bool)
+    used[:, known_idx] = True
+    V = len(prepared)
+    v1 = np.empty((rows, V), dtype=np.int64); v2 = np.empty((rows, V), dtype=np.int64)
+    ok = np.ones(rows, dtype=bool)
+    ar = np.arange(rows)
+    first = True
+    for k, pr in enumerate(prepared):
+        if pr is None: continue
+        combos, cumw = pr
+        if first:
+            # 第一个有范围的对手只受已知牌影响（已在 _prepare_ranges 剔除），整批共用一条累积权重
+            pick = np.searchsorted(cumw, rng.random(rows) * cumw[-1], side="right")
+            first = False
+        else:
+            w = np.diff(cumw, prepend=0.0)
+            cum = np.where(used[:, combos[:, 0]] | used[:, combos[:, 1]], 0.0, w).cumsum(axis=1)
+            total = cum[:, -1]
+            ok &= rng.random(rows) * cumw[-1] < total
+            pick = (cum <= (rng.random(rows) * total)[:, None]).sum(axis=1)
+        pick = np.minimum(pick, len(combos) - 1)
+        v1[:, k], v2[:, k] = combos[pick, 0], combos[pick, 1]
+        used[ar, v1[:, k]] = True; used[ar, v2[:, k]] = True
+    free = [k for k, pr in enumerate(prepared) if pr is None]
+    need = 2*len(free) + need_public
+    if need:
+        # 已用的牌随机键 +1，排到最后，取最小的 need 个即为无放回抽取
+        draw = np.argpartition(rng.random((rows, 52)) + used, need - 1, axis=1)[:, :need]
+        for j, k in enumerate(free):
+            v1[:, k], v2[:, k] = draw[:, 2*j], draw[:, 2*j + 1]
+        pub = draw[:, 2*len(free):]
+    else:
+        pub = np.empty((rows, 0), dtype=np.int64)
+    return v1, v2, pub, ok
+
+# ========= 多进程蒙特卡洛（常驻进程池） =========
+EQUITY_PROCS = int(os.getenv("EQUITY_PROCS", "0")) or (os.cpu_count() or 1)
+POOL_CHUNK = int(os.getenv("POOL_CHUNK", "512"))  # 每轮每个进程的试验数上限；每轮结束做一次早停判断、报一次进度
+POOL_MIN_CHUNK = 64  # 接近早停精度时每个进程的最小段
+POOL_START_METHOD = os.getenv("POOL_START_METHOD", "spawn")  # gevent/多线程进程里 fork 不安全，默认 spawn
+_POOL = None
+_POOL_PID = None
+_POOL_LOCK = threading.Lock()
+
+def equity_pool():
+    """每个 gunicorn worker 进程只建一次进程池，之后所有任务复用；fork 出的新进程会自动重建。"""
+    global _POOL, _POOL_PID
+    if _POOL is None or _POOL_PID != os.getpid():
+        if multiprocessing.parent_process() is not None:  # 池子进程 spawn 时会重新 import 本模块，绝不能再套一层池
+            raise RuntimeError("equity_pool() 不能在进程池的子进程里调用")
+        with _POOL_LOCK:
+            if _POOL is None or _POOL_PID != os.getpid():
+                from concurrent.futures import ProcessPoolExecutor
+                _POOL = ProcessPoolExecutor(max_workers=EQUITY_PROCS,
+                                            mp_context=multiprocessing.get_context(POOL_START_METHOD))
+                _POOL_PID = os.getpid()
+                atexit.register(_POOL.shutdown, wait=False, cancel_futures=True)
+                for _ in range(EQUITY_PROCS):  # 提前拉起子进程并映射牌力表，首个任务不再付启动开销
+                    _POOL.submit(_pool_warm)
+    return _POOL
+
+def _pool_warm():
+    if np is not None: _np_tables()
+    else: rank_table()
+
+def _pool_chunk(hero, board, villains, trials, seed, t_budget_s, ranges=None, stratify=False, hist=False):
+    """进程池里执行的一段：跑满 trials 次（或耗尽剩余预算），不早停，只回传 _Tally。"""
+    if np is not None:
+        return _equity_mc_numpy(hero, board, villains, trials, seed, 0.0, t_budget_s, None, ranges, stratify=stratify, hist=hist)
+    return _equity_mc_python(hero, board, villains, trials, seed, 0.0, t_budget_s, None, stratify=stratify, hist=hist)
+
+def _equity_mc_pool(hero, board, villains, trials, seed, eps, t_budget_s, progress_cb, ranges=None, prior=None, hist=False):
+    """
+    把试验按轮切给 EQUITY_PROCS 个进程，每段用独立的种子流，结果按计数合并；
+    每轮合并后按同一置信区间判断早停，时间预算按剩余量下发给各段。返回 _Tally。
+    """
+    pool = equity_pool()
+    streams = random.Random(seed)  # 派生各段种子：同一 seed 可复现，段与段互不相关
+    hero, board = list(hero), list(board)
+    stratify = MC_STRATIFY and prior is None and ranges is None  # 各段各自轮流分层，合并后层计数仍均衡
+    tally = _Tally(prior, hist=hist)
+    if _prior_done(tally, eps):
+        return tally
+    start = time.monotonic()
+    this = EQUITY_PROCS * POOL_CHUNK
 
-    return wins_equiv / max(n, 1)
+    while tally.n < trials:
+        left = t_budget_s - (time.monotonic() - start)
+        if left <= 0:
+            break
+        this = min(trials - tally.n, this)
+        per, extra = divmod(this, EQUITY_PROCS)
+        futs = [pool.submit(_pool_chunk, hero, board, villains, per + (1 if i < extra else 0),
+                            streams.getrandbits(63), left, ranges, stratify, hist)
+                for i in range(EQUITY_PROCS) if per or i < extra]
+        for f in futs:
+            tally.merge(f.result())
+        if not tally.n:
+            break
+
+        half_width = tally.estimate()[1]
+
+        if progress_cb:
+            approx_pct = min(100, int(tally.n * 100 / trials))
+            progress_cb(approx_pct)
+
+        if half_width < eps:
+            break
+        # 与 numpy 引擎同样按方差估出还差多少局，下一轮只切这么多，避免一轮就把 trials 全部跑完
+        if eps > 0:
+            this = min(EQUITY_PROCS * POOL_CHUNK,
+                       max(EQUITY_PROCS * POOL_MIN_CHUNK, int(tally.n * ((half_width / eps) ** 2 - 1) * 1.1)))
+
+    return tally
+
+# ========= 穷举（精确胜率） =========
+def exact_combos(board_len, villains):
+    """穷举需要比较的（发牌, 对手手牌）组合数；目前只支持单挑，其余返回 None。"""
+    if villains != 1 or board_len < 3: return None
+    n = 52 - 2 - board_len
+    need_public = 5 - board_len
+    return math.comb(n, need_public) * math.comb(n - need_public, 2)
+
+def equity_exact(hero, board, villains=1, ranges=None, buckets=None, dist=None):
+    """
+    单挑时枚举全部剩余公共牌 × 对手两张牌，结果无方差、可复现。
+    网格 R×P：R 为所有公共牌补全，P 为所有对手手牌，只比较二者不重叠的格子；
+    给了对手范围时每个格子按该手牌的范围权重计入。
+    buckets：传入 new_buckets() 时按下一张公共牌累加同一网格（补全里的每张牌都可能是下一张，各计一次）。
+    dist：传入 new_dist() 时按同一网格累加牌型分布（有范围时为权重和）。
+    """
+    if villains != 1: raise ValueError("穷举仅支持 1 名对手")
+    T = _np_tables()
+    card_key, card_sb = T["card_key"], T["card_sb"]
+    hero_idx = [_CARD_INDEX[c] for c in hero]
+    board_idx = [_CARD_INDEX[c] for c in board]
+    known = set(hero_idx) | set(board_idx)
+    avail = [i for i in range(52) if i not in known]
+    runouts = np.array(list(itertools.combinations(avail, 5 - len(board))), dtype=np.int64)
+    pairs = np.array(list(itertools.combinations(avail, 2)), dtype=np.int64)
+
+    pub_key = int(card_key[board_idx].sum()) + card_key[runouts].sum(axis=1)          # (R,)
+    pub_sb = card_sb[board_idx].sum(axis=0) + card_sb[runouts].sum(axis=1)            # (R,4)
+    my = _np_rank(T, pub_key + int(card_key[hero_idx].sum()), pub_sb + card_sb[hero_idx].sum(axis=0))
+    valid = ~(runouts[:, :, None, None] == pairs[None, None, :, :]).any(axis=(1, 3))
+    ri, pi = np.nonzero(valid)
+    vr = _np_rank(T, pub_key[ri] + card_key[pairs].sum(axis=1)[pi],
+                  pub_sb[ri] + card_sb[pairs].sum(axis=1)[pi])
+    w = ranges[0] if ranges is not None else None
+    pw = w[[_COMBO_ID[(int(a), int(b))] for a, b in pairs]][pi] if w is not None else None
+    if pw is not None and not pw.any():
+        raise ValueError("对手范围与已知牌冲突，没有可用组合")
+    if dist is not None:
+        rc = T["rank_class"]
+        for name, ranks in (("hero", my[ri]), ("villain", vr)):
+            dist[name] = (np.asarray(dist[name]) + np.bincount(rc[ranks], weights=pw, minlength=N_CLASSES)).tolist()
+        dist["outcome"] = (np.asarray(dist["outcome"]) +
+                           np.bincount((my[ri] >= vr).astype(np.int64) + (my[ri] > vr), weights=pw, minlength=3)).tolist()
+    if buckets is not None and 0 < len(board) < 5:
+        score = (my[ri] < vr) + 0.5 * (my[ri] == vr)
+        if pw is not None: score = score * pw
+        for col in runouts[ri].T:
+            buckets["wins"] = (np.asarray(buckets["wins"]) + np.bincount(col, weights=score, minlength=52)).tolist()
+            buckets["n"] = (np.asarray(buckets["n"]) + np.bincount(col, weights=pw, minlength=52)).tolist()
+    if w is None:
+        wins = (my[ri] < vr).sum()
+        ties = (my[ri] == vr).sum()
+        return (float(wins) + 0.5 * float(ties)) / len(ri)
+    return float((pw * ((my[ri] < vr) + 0.5 * (my[ri] == vr))).sum() / pw.sum())
+
+# ========= 下一张牌逐张胜率 =========
+def next_card_sweep(hero, board, villains=1, trials=NEXT_CARD_TRIALS, seed=None, ranges=None, t_budget_s=None):
+    """
+    翻牌/转牌时，下一张公共牌分别为每张可能的牌时的胜率；返回 new_buckets() 格式的分桶。
+    单挑且组合数不超过 ENUM_SWEEP_MAX_COMBOS 时穷举；否则每局只发一次对手手牌与其后的公共牌，
+    再把全部候选的下一张牌同批代入比牌：一张候选牌只统计没用到它的那些局（条件分布不变），
+    所有候选共用同一批发牌，张与张之间的差异基本不含抽样噪声。
+    t_budget_s 不为空时至少跑一批，之后超时即停，按已跑的局数返回。
+    """
+    if np is None or not 3 <= len(board) <= 4:
+        return None
+    buckets = new_buckets()
+    combos = exact_combos(len(board), villains)
+    if combos is not None and combos <= ENUM_SWEEP_MAX_COMBOS:
+        equity_exact(hero, board, villains, ranges, buckets=buckets)
+        return buckets
+    T = _np_tables()
+    card_key, card_sb = T["card_key"], T["card_sb"]
+    rng = np.random.default_rng(seed)
+    hero_idx = [_CARD_INDEX[c] for c in hero]
+    board_idx = [_CARD_INDEX[c] for c in board]
+    known = set(hero_idx) | set(board_idx)
+    avail = np.array([i for i in range(52) if i not in known], dtype=np.int64)
+    need_rest = 4 - len(board)  # 下一张之后还要发的公共牌
+    need_opp = villains * 2
+    if ranges is not None:
+        known_list = sorted(known)
+        prepared = _prepare_ranges(ranges, known_list)
+
+    board_key = int(card_key[board_idx].sum())
+    board_sb = card_sb[board_idx].sum(axis=0)
+    hero_key = int(card_key[hero_idx].sum())
+    hero_sb = card_sb[hero_idx].sum(axis=0)
+    cand_key, cand_sb = card_key[avail], card_sb[avail]                        # (A,), (A,4)
+    wins = np.zeros(len(avail)); n = np.zeros(len(avail))
+    rows = max(1, NP_BATCH // len(avail))  # 每批 rows×A 次代入，与 NP_BATCH 同量级
+    done = 0
+    start = time.monotonic()
+    while done < trials:
+        if done and t_budget_s is not None and time.monotonic() - start > t_budget_s:
+            break
+        this = min(rows, trials - done)
+        done += this
+        if ranges is None:
+            pick = np.argpartition(rng.random((this, len(avail))), need_opp + need_rest - 1, axis=1)[:, :need_opp + need_rest]
+            draw = avail[pick]
+            v1, v2, rest = draw[:, 0:need_opp:2], draw[:, 1:need_opp:2], draw[:, need_opp:]
+        else:
+            v1, v2, rest, ok = _deal_ranged(rng, this, known_list, prepared, need_rest)
+            v1, v2, rest = v1[ok], v2[ok], rest[ok]
+            if not len(rest): continue
+        dealt = np.concatenate([v1, v2, rest], axis=1)
+        live = ~(dealt[:, :, None] == avail[None, None, :]).any(axis=1)            # (rows,A) 候选牌没被发出
+        pub_key = (board_key + card_key[rest].sum(axis=1))[:, None] + cand_key     # (rows,A)
+        pub_sb = (board_sb + card_sb[rest].sum(axis=1))[:, None, :] + cand_sb      # (rows,A,4)
+        # 候选牌与已发的牌重复时掩码会进位越界，这些格子先置 0 再查表，结果不计入
+        my = _np_rank(T, np.where(live, pub_key + hero_key, 0), np.where(live[:, :, None], pub_sb + hero_sb, 0))
+        opp_key = pub_key[:, :, None] + (card_key[v1] + card_key[v2])[:, None, :]              # (rows,A,V)
+        opp_sb = pub_sb[:, :, None, :] + (card_sb[v1] + card_sb[v2])[:, None, :, :]            # (rows,A,V,4)
+        vr = _np_rank(T, np.where(live[:, :, None], opp_key, 0), np.where(live[:, :, None, None], opp_sb, 0))
+        best = vr.min(axis=2)
+        ties = (vr == best[:, :, None]).sum(axis=2)
+        share = (my < best) + (my == best) / (ties + 1)
+        wins += (share * live).sum(axis=0); n += live.sum(axis=0)
+    for k, w_k, n_k in zip(avail.tolist(), wins.tolist(), n.tolist()):
+        buckets["wins"][k], buckets["n"][k] = w_k, n_k
+    return buckets
+
+def next_card_rates(buckets):
+    """分桶 → 长度 52 的逐张胜率（没有样本的牌为 None）。"""
+    return [w / n if n else None for w, n in zip(buckets["wins"], buckets["n"])]
+
+def next_card_view(rates, equity):
+    """结果块里的 next_cards：每张牌的胜率与相对本街的变化，以及 outs / 危险牌（按变化幅度排序）。"""
+    if not rates:
+        return None
+    cards = [{"card": Card.int_to_str(_FULL_DECK[k]), "equity": round(e, 4), "delta": round(e - equity, 4)}
+             for k, e in enumerate(rates) if e is not None]
+    ranked = sorted(cards, key=lambda c: c["delta"])
+    return {
+        "cards": cards,
+        "outs": [c["card"] for c in reversed(ranked) if c["delta"] >= NEXT_CARD_SWING],
+        "scare": [c["card"] for c in ranked if c["delta"] <= -NEXT_CARD_SWING],
+    }
+
+# ========= 胜率缓存（花色同构归一） =========
+class TTLCache:
+    """线程安全的 LRU + TTL 缓存，带命中/未命中计数。"""
+    def __init__(self, maxsize, ttl):
+        from collections import OrderedDict
+        self.maxsize, self.ttl = maxsize, ttl
+        self._data = OrderedDict()   # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < now:
+                if item is not None: self._data.pop(key, None)
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {"size": len(self._data), "maxsize": self.maxsize, "ttl": self.ttl,
+                    "hits": self.hits, "misses": self.misses,
+                    "hit_rate": (self.hits / total) if total else None}
+
+_SUIT_PERMS = list(itertools.permutations(range(4)))
+
+def canonical_spot(hero, board):
+    """
+    花色同构归一：在 24 种花色置换里取字典序最小的 (手牌, 公共牌)；
+    A♠K♠ + Q♠J♠2♥ 与 A♥K♥ + Q♥J♥2♠ 得到同一个 key。公共牌按集合处理，与发牌顺序无关。
+    """
+    return _canonical(hero, board)[0]
+
+def _canonical(hero, board):
+    """(canonical_spot, 选中的花色置换 perm)；perm[原花色] = 归一后的花色。"""
+    h = [_CARD_INDEX[c] for c in hero]
+    b = [_CARD_INDEX[c] for c in board]
+    best = best_perm = None
+    for perm in _SUIT_PERMS:
+        cand = (tuple(sorted(i - i % 4 + perm[i % 4] for i in h)),
+                tuple(sorted(i - i % 4 + perm[i % 4] for i in b)))
+        if best is None or cand < best: best, best_perm = cand, perm
+    return best, best_perm
+
+def _permute_cards(vec, perm, inverse=False):
+    """按牌下标排列的 52 维数据换花色：正向把原牌面的数据搬到归一后的位置，inverse 搬回来。"""
+    out = [None] * 52
+    for i in range(52):
+        j = i - i % 4 + perm[i % 4]
+        if inverse: out[i] = vec[j]
+        else: out[j] = vec[i]
+    return out
+
+EQUITY_CACHE = TTLCache(EQUITY_CACHE_SIZE, EQUITY_CACHE_TTL)
+
+def equity_cache_key(hero, board, villains, ranges=None):
+    """带对手范围时范围本身可能区分花色，不做同构归一，改用原始牌面 + 范围摘要。"""
+    if ranges is None:
+        return canonical_spot(hero, board) + (villains,)
+    import hashlib
+    digest = tuple(None if w is None else hashlib.sha1(w.tobytes()).hexdigest() for w in ranges)
+    return (tuple(sorted(_CARD_INDEX[c] for c in hero)), tuple(sorted(_CARD_INDEX[c] for c in board)), villains, digest)
+
+# ========= 翻前胜率表（169 类起手牌 × 1–9 名随机对手） =========
+PREFLOP_TABLE_PATH = os.getenv("PREFLOP_TABLE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "preflop_equity.bin"))
+PREFLOP_MAX_VILLAINS = 9
+_PF_MAGIC = b"PFEQ0001"
+_PF_RANKS = "23456789TJQKA"
+_PF_TABLE = None
+_PF_TABLE_LOCK = threading.Lock()
+
+def preflop_class(hero):
+    """起手牌归类：返回 (标签如 'AKs'/'QJo'/'77', 0–168 下标)。下标按 13×13 矩阵：同花在上三角，杂色在下三角。"""
+    (r1, s1), (r2, s2) = sorted((divmod(_CARD_INDEX[c], 4) for c in hero), reverse=True)
+    if r1 == r2:
+        return _PF_RANKS[r1]*2, r1*13 + r1
+    if s1 == s2:
+        return _PF_RANKS[r1] + _PF_RANKS[r2] + "s", r1*13 + r2
+    return _PF_RANKS[r1] + _PF_RANKS[r2] + "o", r2*13 + r1
+
+def build_preflop_table(path=PREFLOP_TABLE_PATH, trials=200000, log=print):
+    """
+    离线生成：每类起手牌取一手代表牌，对 1–9 名随机对手各跑 trials 次（不早停），
+    胜率量化成 uint16（/65535）按 [下标][对手数-1] 写入，共 169×9×2 字节。
+    """
+    from array import array
+    table = array("H", [0]) * (169 * PREFLOP_MAX_VILLAINS)
+    for hi in range(13):
+        for lo in range(13):
+            if hi == lo:   hero = [Card.new(_PF_RANKS[hi]+"s"), Card.new(_PF_RANKS[lo]+"h")]
+            elif hi > lo:  hero = [Card.new(_PF_RANKS[hi]+"s"), Card.new(_PF_RANKS[lo]+"s")]
+            else:          continue
+            hands = [hero] if hi == lo else [hero, [hero[0], Card.new(_PF_RANKS[lo]+"h")]]
+            for h in hands:
+                label, idx = preflop_class(h)
+                for v in range(1, PREFLOP_MAX_VILLAINS + 1):
+                    eq = equity_mc_fast(h, [], v, trials, seed=idx*16 + v, eps=0.0, t_budget_s=float("inf"))
+                    table[idx*PREFLOP_MAX_VILLAINS + v - 1] = round(eq * 65535)
+                if log: log(f"{label}: " + " ".join(f"{table[idx*PREFLOP_MAX_VILLAINS + v]/65535:.3f}" for v in range(PREFLOP_MAX_VILLAINS)))
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(_PF_MAGIC)
+        table.tofile(f)
+    os.replace(tmp, path)
+
+def _preflop_table():
+    """首次用到时才读盘；文件不存在返回 None（调用方改走模拟）。"""
+    global _PF_TABLE
+    if _PF_TABLE is None:
+        with _PF_TABLE_LOCK:
+            if _PF_TABLE is None:
+                from array import array
+                if not os.path.exists(PREFLOP_TABLE_PATH):
+                    return None
+                with open(PREFLOP_TABLE_PATH, "rb") as f:
+                    if f.read(8) != _PF_MAGIC:
+                        raise ValueError(f"翻前胜率表格式不符：{PREFLOP_TABLE_PATH}")
+                    t = array("H"); t.frombytes(f.read())
+                _PF_TABLE = t
+    return _PF_TABLE
+
+def preflop_equity(hero, villains):
+    """查表得到翻前胜率；对手数超出 1–9 或表缺失时返回 None。"""
+    if not (1 <= villains <= PREFLOP_MAX_VILLAINS): return None
+    t = _preflop_table()
+    if t is None: return None
+    return t[preflop_class(hero)[1]*PREFLOP_MAX_VILLAINS + villains - 1] / 65535
 
 # ========= 牌型中文名 =========
-CLASS_ZH = {"High Card":"高牌","Pair":"一对","Two Pair":"两对","Three of a Kind":"三条",
+CLASS_ZH = {"Royal Flush":"皇家同花顺","High Card":"高牌","Pair":"一对","Two Pair":"两对","Three of a Kind":"三条",
             "Straight":"顺子","Flush":"同花","Full House":"葫芦","Four of a Kind":"四条",
             "Straight Flush":"同花顺"}
 def hand_class_zh(hero, board):
-    score = _EVAL.evaluate(hero, board)
-    rc = _EVAL.get_rank_class(score)
-    name_en = _EVAL.class_to_string(rc)
+    score = rank_table().evaluate(hero, board)
+    name_en = _CLASS_NAMES[_RANK_CLASS[score]]
     return CLASS_ZH.get(name_en, name_en), score
 
+def hand_dist_view(dist):
+    """
+    new_dist 计数 → 比例：{"win","tie","loss","hero":{牌型: 比例},"villain":{牌型: 比例}}，
+    牌型从大到小、略去为 0 的类别；没有样本返回 None。
+    """
+    n = sum(dist["outcome"]) if dist else 0
+    if not n:
+        return None
+    def shares(counts):
+        return {CLASS_ZH[_CLASS_NAMES[c]]: round(v / n, 4) for c, v in enumerate(counts) if v}
+    win, tie, loss = dist["outcome"]
+    return {"win": round(win / n, 4), "tie": round(tie / n, 4), "loss": round(loss / n, 4),
+            "hero": shares(dist["hero"]), "villain": shares(dist["villain"])}
+
 # ========= 棋面/赔率/SPR =========
+# 牌面纹理表：按花色同构归一后的公共牌做 key（翻牌共 1,755 种），特征只算一次，之后查表。
+# key 为四门花色各自的 13 位点数掩码排序后的元组，与花色置换无关，算起来只要一次遍历。
+# 顺子相关的判断全部落在 13 位点数掩码上：_STRAIGHT_WINDOWS 为 10 个五连张窗口（含 A2345），
+# _HAS_STRAIGHT[mask] 表示该点数集合里有顺子。
+_STD_INDEX = {r + s: i for i, (r, s) in enumerate(itertools.product("23456789TJQKA", "shdc"))}
+_STRAIGHT_WINDOWS = (0x100F,) + tuple(0x1F << k for k in range(9))
+_HAS_STRAIGHT = bytes(any(m & w == w for w in _STRAIGHT_WINDOWS) for m in range(1 << 13))
+_TEXTURE = None
+_TEXTURE_LOCK = threading.Lock()
+_EMPTY_FEATURES = {"flush_draw": False, "two_tone": False, "mono": False, "paired": False, "straight_draw": False,
+                   "flush_draw_live": False, "straight_draw_live": False, "max_suit": 0, "connectedness": 0, "straight_combos": 0, "flush_combos": 0, "board_pairs": 0,
+                   "trips": False, "nut_class": None, "high_card": None, "high_class": None}
+
+def _board_key(b):
+    """公共牌（牌下标）→ 花色同构类的 key：四门花色的点数掩码按大小排序。"""
+    m = [0, 0, 0, 0]
+    for i in b:
+        m[i & 3] |= 1 << (i >> 2)
+    m.sort()
+    return tuple(m)
+
+def _texture(b):
+    """
+    由公共牌下标算纹理特征：
+    flush_draw / two_tone / mono / paired / straight_draw 沿用原来的判定（规则建议、护栏和建议缓存都按它分桶，
+    flush_draw 恒为 False；straight_draw 只看 A 作小的点数间距）；
+    flush_draw_live / straight_draw_live 为后面还有牌要发、同花/顺子听牌仍可能成立；
+    connectedness 为任一五连张窗口里最多有几个不同点数；straight_combos / flush_combos 为
+    未知牌里能直接成顺/成同花的两张组合数；nut_class 为当前任意两张底牌能做到的最大牌型（坚果牌型）；
+    high_class 把最大一张分成 A / broadway（T–K）/ middle（7–9）/ low。
+    """
+    to_come = 5 - len(b)
+    cnt_r = [0] * 13; cnt_s = [0] * 4; suit_mask = [0] * 4
+    for i in b:
+        cnt_r[i >> 2] += 1; cnt_s[i & 3] += 1; suit_mask[i & 3] |= 1 << (i >> 2)
+    rmask = sum(1 << r for r in range(13) if cnt_r[r])
+    connected = max(bin(rmask & w).count("1") for w in _STRAIGHT_WINDOWS)
+    straight_combos = 0
+    for r1 in range(13):
+        for r2 in range(r1, 13):
+            if _HAS_STRAIGHT[rmask | 1 << r1 | 1 << r2]:
+                a1, a2 = 4 - cnt_r[r1], 4 - cnt_r[r2]
+                straight_combos += a1 * (a1 - 1) // 2 if r1 == r2 else a1 * a2
+    max_suit = max(cnt_s)
+    s = cnt_s.index(max_suit)
+    unseen = 52 - len(b); left = 13 - max_suit
+    flush_combos = (math.comb(left, 2) if max_suit == 3 else
+                    math.comb(unseen, 2) - math.comb(unseen - left, 2) if max_suit == 4 else
+                    math.comb(unseen, 2) if max_suit == 5 else 0)
+    sf = max_suit >= 3 and any(bin(suit_mask[s] & w).count("1") >= 3 for w in _STRAIGHT_WINDOWS)
+    top = max(i >> 2 for i in b)
+    max_r = max(cnt_r)
+    idxs = sorted(0 if r == 12 else r + 1 for r in range(13) if cnt_r[r])  # 原判定的 "A23456789TJQKA" 下标
+    return {
+        "flush_draw": False,
+        "two_tone": max_suit == 2,
+        "mono": max_suit >= 3,
+        "paired": max_r >= 2,
+        "straight_draw": (len(idxs) >= 3 and any(idxs[k + 2] - idxs[k] <= 3 for k in range(len(idxs) - 2))
+                          or len(idxs) == 2 and idxs[1] - idxs[0] == 1),
+        "flush_draw_live": bool(to_come) and max_suit >= 2,
+        "straight_draw_live": bool(to_come) and connected >= 2,
+        "max_suit": max_suit,
+        "connectedness": connected,
+        "straight_combos": straight_combos,
+        "flush_combos": flush_combos,
+        "board_pairs": sum(1 for c in cnt_r if c >= 2),
+        "trips": max_r >= 3,
+        "nut_class": ("同花顺" if sf else "四条" if max_r >= 2 else "同花" if max_suit >= 3 else
+                      "顺子" if straight_combos else "三条"),
+        "high_card": "23456789TJQKA"[top],
+        "high_class": "A" if top == 12 else "broadway" if top >= 8 else "middle" if top >= 5 else "low",
+    }
+
+def texture_table():
+    """
+    进程内单例：首次调用时把全部 1,755 种（花色同构）翻牌的特征算好；
+    转牌/河牌（16,432 / 134,459 种）在第一次出现时按同样的 key 补进表里，之后都是一次字典查找。
+    """
+    global _TEXTURE
+    if _TEXTURE is None:
+        with _TEXTURE_LOCK:
+            if _TEXTURE is None:
+                table = {}
+                # 每个点数组合只需枚举“按出现顺序编号”的花色模式（000/001/010/011/012），其余都与之同构
+                for ranks in itertools.combinations_with_replacement(range(13), 3):
+                    for suits in ((0, 0, 0), (0, 0, 1), (0, 1, 0), (0, 1, 1), (0, 1, 2)):
+                        b = [r * 4 + s for r, s in zip(ranks, suits)]
+                        if len(set(b)) < 3: continue
+                        key = _board_key(b)
+                        if key not in table: table[key] = _texture(b)
+                _TEXTURE = table
+    return _TEXTURE
+
+def board_texture(board_idx):
+    """公共牌（牌下标）→ 纹理特征（副本）；翻前返回全空的特征。"""
+    if not board_idx:
+        return dict(_EMPTY_FEATURES)
+    table = texture_table()
+    key = _board_key(board_idx)
+    feats = table.get(key)
+    if feats is None:
+        feats = table.setdefault(key, _texture(board_idx))
+    return dict(feats)
+
 def board_features(board_std):
-    feats = {"flush_draw":False,"two_tone":False,"mono":False,"paired":False,"straight_draw":False}
-    if not board_std: return feats
-    suits = [b[1] for b in board_std]
-    cnt = {s: suits.count(s) for s in "shdc"}
-    if max(cnt.values())>=3: feats["mono"] = True
-    elif max(cnt.values())==2: feats["two_tone"] = True
-    ranks = [b[0] for b in board_std]
-    feats["paired"] = any(ranks.count(r)>=2 for r in set(ranks))
-    order = "A23456789TJQKA"
-    idxs = sorted(set(order.index(r) for r in ranks if r in order))
-    if len(idxs)>=3 and any(idxs[i+2]-idxs[i]<=3 for i in range(len(idxs)-2)): feats["straight_draw"]=True
-    if len(idxs)==2 and idxs[1]-idxs[0]==1: feats["straight_draw"]=True
-    return feats
+    return board_texture([_STD_INDEX[c] for c in board_std])
 
 def pot_odds(call_amt, pot_amt):
     if not call_amt or not pot_amt: return None
@@ -139,7 +1349,7 @@ def spr(stack_bb, pot_bb):
     if stack_bb is None: return None
     return stack_bb / pot_bb
 
-def rule_advice_struct(equity, hand_name, opponents, feats, facing_bet=False, call_bb=0.0, pot_bb=0.0, spr_val=None):
+def rule_advice_struct(equity, hand_name, opponents, feats, facing_bet=False, call_bb=0.0, pot_bb=0.0, spr_val=None, dist=None):
     tight = min(0.10 + opponents*0.03, 0.25)
     strong = 0.65 - tight
     medium = 0.45 - tight
@@ -164,6 +1374,10 @@ def rule_advice_struct(equity, hand_name, opponents, feats, facing_bet=False, ca
     tips=[]
     if spr_val and spr_val<=3 and equity>=medium: tips.append("SPR低：可推进价值或施压")
     if spr_val and spr_val>=6 and equity<medium: tips.append("SPR高：边缘牌优先控池")
+    if dist:  # hand_dist_view 的输出
+        if dist["tie"] >= 0.15: tips.append("平分底池概率高：不宜扩池")
+        if equity < medium and sum(v for k, v in dist["villain"].items() if k not in ("一对", "高牌")) >= 0.5:
+            tips.append("对手常成两对以上：中等牌力谨慎")
     if feats.get("two_tone"): tips.append("两色面：留意同花听牌")
     if feats.get("mono"): tips.append("同花面：无同花更谨慎")
     if feats.get("paired"): tips.append("配对面：提防葫芦与三条")
@@ -221,18 +1435,216 @@ def business_rules_check(ctx: dict, adv: dict) -> str|None:
 
 def fallback_text(ctx):
     rb = rule_advice_struct(ctx["equity"], ctx["hand_class"], ctx["villains"], ctx["features"],
-                            ctx.get("facing_bet",False), ctx.get("call_bb") or 0, ctx.get("pot_bb") or 0, ctx.get("spr"))
+                            ctx.get("facing_bet",False), ctx.get("call_bb") or 0, ctx.get("pot_bb") or 0, ctx.get("spr"),
+                            ctx.get("hand_dist"))
     lines = [rb["summary"], rb["line"], "对手相对强弱："+rb["opponent_compare"]]
     if rb["tips"]: lines.append("要点："+"；".join(rb["tips"]))
     return "\n".join(lines)
 
-def try_llm_guarded(ctx: dict) -> dict:
+_LLM = {"client": None, "key": None, "executor": None, "pid": None}
+_LLM_LOCK = threading.Lock()
+
+def llm_client(api):
+    """
+    进程内复用一个 OpenAI 客户端（SDK 内部的 HTTP 连接池随之复用，省掉每次的 TCP/TLS 握手）；
+    API key / base_url 变了或 fork 到新进程时重建。
+    """
+    key = (api, LLM_BASE_URL, os.getpid())
+    if _LLM["key"] != key:
+        with _LLM_LOCK:
+            if _LLM["key"] != key:
+                from openai import OpenAI
+                _LLM["client"] = OpenAI(api_key=api, base_url=LLM_BASE_URL,
+                                        timeout=LLM_TIMEOUT_S, max_retries=LLM_MAX_RETRIES)
+                _LLM["key"] = key
+    return _LLM["client"]
+
+def llm_executor():
+    """建议请求的后台线程池：第 N 街的 LLM 调用与第 N+1 街的模拟并行。"""
+    if _LLM["pid"] != os.getpid():
+        with _LLM_LOCK:
+            if _LLM["pid"] != os.getpid():
+                from concurrent.futures import ThreadPoolExecutor
+                _LLM["executor"] = ThreadPoolExecutor(max_workers=LLM_CONCURRENCY, thread_name_prefix="llm")
+                _LLM["pid"] = os.getpid()
+    return _LLM["executor"]
+
+ADVICE_CACHE = TTLCache(ADVICE_CACHE_SIZE, ADVICE_CACHE_TTL)
+
+class CircuitBreaker:
+    """
+    closed → 连续 fails 次失败或慢调用 → open（直接走规则建议）→ cooldown 秒后 half_open，
+    只放行一个探测请求：成功回到 closed，失败重新 open。
+    """
+    def __init__(self, fails, slow_s, cooldown_s):
+        self.fails, self.slow_s, self.cooldown_s = fails, slow_s, cooldown_s
+        self._lock = threading.Lock()
+        self.state = "closed"
+        self.streak = 0
+        self.opened_at = None
+        self._probing = False
+        self.trips = self.short_circuited = 0
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown_s:
+                self.state, self._probing = "half_open", False
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            self.short_circuited += 1
+            return False
+
+    def cancel(self):
+        """调用被任务预算提前截断：不算成功也不算失败，半开时把探测名额让出来。"""
+        with self._lock:
+            self._probing = False
+
+    def record(self, ok, latency_s=0.0):
+        bad = not ok or latency_s > self.slow_s
+        with self._lock:
+            if not bad:
+                self.state, self.streak, self._probing = "closed", 0, False
+                return
+            self.streak += 1
+            if self.state == "half_open" or self.streak >= self.fails:
+                if self.state != "open": self.trips += 1
+                self.state, self.opened_at, self._probing = "open", time.monotonic(), False
+
+    def stats(self):
+        with self._lock:
+            retry_in = None
+            if self.state == "open":
+                retry_in = round(max(0.0, self.cooldown_s - (time.monotonic() - self.opened_at)), 1)
+            return {"state": self.state, "streak": self.streak, "trips": self.trips,
+                    "short_circuited": self.short_circuited, "retry_in_s": retry_in,
+                    "fails": self.fails, "slow_s": self.slow_s, "cooldown_s": self.cooldown_s}
+
+LLM_BREAKER = CircuitBreaker(BREAKER_FAILS, BREAKER_SLOW_S, BREAKER_COOLDOWN_S)
+
+def _spr_band(spr_val):
+    if spr_val is None: return None
+    return "low" if spr_val <= 3 else ("mid" if spr_val < 6 else "high")
+
+_ADVICE_FEATURES = ("flush_draw", "two_tone", "mono", "paired", "straight_draw")  # 只按原有的布尔特征分桶
+
+def advice_cache_key(ctx):
+    """
+    建议只依赖分桶后的局面：胜率取两位、牌面特征、SPR 区间、是否面对下注（及所需赔率）。
+    具体手牌/公共牌不进 key，同类局面直接复用，不再走网络。
+    """
+    po = ctx.get("pot_odds")
+    return (ctx.get("street"), round(ctx["equity"], 2), ctx.get("hand_class"), ctx.get("villains"),
+            tuple((k, (ctx.get("features") or {}).get(k)) for k in _ADVICE_FEATURES), _spr_band(ctx.get("spr")),
+            bool(ctx.get("facing_bet")), None if po is None else round(po, 2))
+
+def _advice_text(data):
+    tips = "；".join(data.get("tips") or [])
+    body = [
+        f"建议：{data['summary']}",
+        f"行动：{data['action']} / 尺寸：{data['sizing']}",
+        f"对手相对强弱：{data['opponent_compare']}",
+        f"要点：{tips}" if tips else ""
+    ]
+    return clean_model_text("\n".join([b for b in body if b]))
+
+class BudgetExceeded(TimeoutError):
+    """任务的建议预算用完而中止的调用；与服务端超时不同，不计入熔断。"""
+
+def _stream_completion(client, messages, on_token, timeout, deadline=None):
+    """流式补全：每段内容交给 on_token；顶层 JSON 对象一闭合就停止读取，立刻进入护栏校验。"""
+    stream = client.chat.completions.create(
+        model=DEFAULT_MODEL,
+        messages=messages,
+        temperature=DEFAULT_TEMP,
+        response_format={"type":"json_object"},
+        stream=True,
+        timeout=timeout,
+    )
+    buf, depth, in_str, esc, opened = [], 0, False, False, False
+    try:
+        for chunk in stream:
+            if deadline is not None and time.monotonic() > deadline:
+                raise BudgetExceeded("超出建议时间预算")
+            piece = chunk.choices[0].delta.content if chunk.choices else None
+            if not piece: continue
+            for i, ch in enumerate(piece):
+                if in_str:
+                    if esc: esc = False
+                    elif ch == "\\": esc = True
+                    elif ch == '"': in_str = False
+                elif ch == '"': in_str = True
+                elif ch == "{": depth += 1; opened = True
+                elif ch == "}":
+                    depth -= 1
+                    if opened and depth == 0:
+                        piece = piece[:i+1]
+                        break
+            buf.append(piece)
+            on_token(piece)
+            if opened and depth == 0: break
+    finally:
+        stream.close()
+    return "".join(buf)
+
+_SUMMARY_START = re.compile(r'"summary"\s*:\s*"')
+
+def partial_summary(raw):
+    """
+    从还没收完的 JSON 文本里取出 summary 字段已到达的部分（已解码）；字段还没出现时返回空串。
+    末尾不完整的转义序列先不算，等下一段到了再解。
+    """
+    m = _SUMMARY_START.search(raw)
+    if not m:
+        return ""
+    start = i = m.end()
+    while i < len(raw):
+        ch = raw[i]
+        if ch == '"': break
+        if ch == "\\":
+            step = 6 if raw[i+1:i+2] == "u" else 2
+            if i + step > len(raw): break
+            i += step
+        else:
+            i += 1
+    try:
+        return json.loads('"' + raw[start:i] + '"')
+    except ValueError:
+        return ""
+
+def _fallback_reason(reason):
+    """把回退原因归成少数几类，作为指标标签（原文里可能带异常信息，不能直接当标签）。"""
+    if not reason: return "invalid"
+    for key, label in (("OPENAI_API_KEY", "no_key"), ("熔断", "breaker_open"), ("预算", "budget"), ("调用异常", "error")):
+        if key in reason: return label
+    return "invalid"
+
+def try_llm_guarded(ctx: dict, on_token=None, deadline=None) -> dict:
+    t0 = time.perf_counter()
+    adv = _try_llm_guarded(ctx, on_token, deadline)
+    source = "cached" if adv.get("cached") else adv.get("source", "rule")
+    M_LLM_SECONDS.observe(time.perf_counter() - t0, source)
+    if source == "rule":
+        M_LLM_FALLBACK.inc(1, _fallback_reason(adv.get("reason")))
+    return adv
+
+def _try_llm_guarded(ctx, on_token=None, deadline=None):
+    """
+    on_token 不为空且开启 LLM_STREAM 时走流式：内容片段实时回调，JSON 闭合后再过护栏；
+    流式只尝试一次，不合规直接退回规则建议（草稿已经推出去了，重试会让前端内容来回跳）。
+    deadline（time.monotonic）是任务的建议预算，每次调用的超时不超过剩余时间；熔断时不发请求。
+    """
     api = os.environ.get("OPENAI_API_KEY")
     if not api:
         return {"text": fallback_text(ctx), "source": "rule", "reason": "未配置 OPENAI_API_KEY"}
+    ckey = advice_cache_key(ctx)
+    data = ADVICE_CACHE.get(ckey)
+    if data is not None and business_rules_check(ctx, data) is None:  # 分桶内胜率略有差别，护栏按当前 ctx 再过一遍
+        return {"text": _advice_text(data), "source": "llm", "cached": True}
     try:
-        from openai import OpenAI
-        client = OpenAI(api_key=api)
+        client = llm_client(api)
         system = (
             "你是德州扑克教练。严格遵循："
             "1) 只基于我提供的 JSON 字段给建议；不得自行计算或编造任何数值；"
@@ -243,17 +1655,40 @@ def try_llm_guarded(ctx: dict) -> dict:
         )
         user = "当前牌局 JSON：\n" + json.dumps(ctx, ensure_ascii=False, indent=2)
         last_err = None
-        for _ in range(2):
+        streaming = on_token is not None and LLM_STREAM
+        for _ in range(1 if streaming else 2):
             messages=[{"role":"system","content":system}]
             if last_err: messages.append({"role":"system","content":"上次失败原因："+last_err})
             messages.append({"role":"user","content":user})
-            resp = client.chat.completions.create(
-                model=DEFAULT_MODEL,
-                messages=messages,
-                temperature=DEFAULT_TEMP,
-                response_format={"type":"json_object"},
-            )
-            raw = resp.choices[0].message.content
+            timeout = LLM_TIMEOUT_S if deadline is None else min(LLM_TIMEOUT_S, deadline - time.monotonic())
+            if timeout <= 0.2:
+                last_err = last_err or "超出建议时间预算"
+                break
+            if not LLM_BREAKER.allow():
+                return {"text": fallback_text(ctx), "source": "rule", "reason": "LLM 熔断中"}
+            t0 = time.monotonic()
+            try:
+                if streaming:
+                    raw = _stream_completion(client, messages, on_token, timeout, deadline)
+                else:
+                    resp = client.chat.completions.create(
+                        model=DEFAULT_MODEL,
+                        messages=messages,
+                        temperature=DEFAULT_TEMP,
+                        response_format={"type":"json_object"},
+                        timeout=timeout,
+                    )
+                    raw = resp.choices[0].message.content
+            except Exception as e:
+                # 超时被预算压短、且确实耗到了预算尽头：是任务没时间了，不是服务端故障
+                cut = isinstance(e, BudgetExceeded) or (
+                    timeout < LLM_TIMEOUT_S and deadline is not None and deadline - time.monotonic() <= 0.2)
+                if cut:
+                    LLM_BREAKER.cancel()
+                    return {"text": fallback_text(ctx), "source": "rule", "reason": "超出建议时间预算"}
+                LLM_BREAKER.record(False)
+                raise
+            LLM_BREAKER.record(True, time.monotonic() - t0)
             try:
                 data = json.loads(raw)
             except Exception as e:
@@ -267,15 +1702,8 @@ def try_llm_guarded(ctx: dict) -> dict:
             if rule_err:
                 last_err = rule_err
                 continue
-            tips = "；".join(data.get("tips") or [])
-            body = [
-                f"建议：{data['summary']}",
-                f"行动：{data['action']} / 尺寸：{data['sizing']}",
-                f"对手相对强弱：{data['opponent_compare']}",
-                f"要点：{tips}" if tips else ""
-            ]
-            text = "\n".join([b for b in body if b])
-            return {"text": clean_model_text(text), "source": "llm"}
+            ADVICE_CACHE.put(ckey, data)
+            return {"text": _advice_text(data), "source": "llm"}
         return {"text": fallback_text(ctx), "source": "rule", "reason": last_err or "LLM返回不合规"}
     except Exception as e:
         return {"text": fallback_text(ctx), "source": "rule", "reason": f"调用异常：{e}"}
@@ -287,31 +1715,448 @@ def llm_runtime_config():
         "enabled": key_ok,
         "model": DEFAULT_MODEL,
         "temperature": DEFAULT_TEMP,
+        "base_url": LLM_BASE_URL,
+        "timeout_s": LLM_TIMEOUT_S,
+        "stream": LLM_STREAM,
+        "task_budget_s": LLM_TASK_BUDGET_S,
+        "breaker": LLM_BREAKER.stats(),
+        "advice_cache": ADVICE_CACHE.stats(),
         "reason": None if key_ok else "未配置 OPENAI_API_KEY",
         "guardrails": ["JSON限定", "白名单动作/尺寸", "赔率/SPR校验", "中文分隔清理", "早停+时间预算"]
     }
 
 # ========= 进度/任务（SSE） =========
-PROGRESS = {}   # task_id -> state
+PROGRESS = {}   # task_id -> state（MemoryStore 使用）
 LOCK = threading.Lock()
 TASK_TTL = int(os.getenv("TASK_TTL_SECONDS", "900"))  # 任务结果在内存中保留秒数（默认15分钟）
+TASK_MAX_RETAINED = int(os.getenv("TASK_MAX_RETAINED", "1000"))  # 最多保留的任务数，超出先淘汰最早完成的
+TASK_RESULTS_MAX_BYTES = int(float(os.getenv("TASK_RESULTS_MAX_MB", "64")) * 1024 * 1024)  # results 总大小上限
+TASK_REAP_S = float(os.getenv("TASK_REAP_S", "30"))  # 后台清理线程的扫描间隔
+
+class _Channel:
+    """单个任务的通知通道：状态每变一次 version+1，并只唤醒等待该任务的 SSE 订阅者。"""
+    __slots__ = ("cond", "version", "subscribers")
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.version = 0
+        self.subscribers = 0
+
+CHANNELS = {}   # task_id -> _Channel
+
+def _channel(task_id):
+    ch = CHANNELS.get(task_id)
+    if ch is None:
+        with LOCK:
+            ch = CHANNELS.setdefault(task_id, _Channel())
+    return ch
 
-def set_progress(task_id, **fields):
+def _release_channel(task_id, ch):
+    """任务已结束且最后一个订阅者离开时收掉通道；之后若还有通知会按需重建。"""
     with LOCK:
-        state = PROGRESS.setdefault(task_id, {"pct":0,"stage":"Queued","eta":None,"done":False,"cancel":False,"results":[],"detail":{}, "ts": time.time()})
-        state.update({k:v for k,v in fields.items() if v is not None})
-        state["ts"] = time.time()
+        with ch.cond:
+            if ch.subscribers == 0 and CHANNELS.get(task_id) is ch:
+                del CHANNELS[task_id]
+
+def _notify(task_id):
+    ch = _channel(task_id)
+    with ch.cond:
+        ch.version += 1
+        ch.cond.notify_all()
+
+# ---- 任务状态存储：memory（单进程，默认）/ sqlite（WAL，多个 gunicorn worker 共享） ----
+TASK_STORE = os.getenv("TASK_STORE", "memory")
+TASK_STORE_PATH = os.getenv("TASK_STORE_PATH", "/tmp/poker_tasks.db")
+TASK_STORE_POLL_S = float(os.getenv("TASK_STORE_POLL_S", "0.25"))  # 共享存储下 SSE 检查其他进程更新的间隔
+
+def _new_state(**fields):
+    state = {"pct":0,"stage":"Queued","eta":None,"done":False,"cancel":False,"results":[],"detail":{}, "ts": time.time()}
+    state.update(fields)
+    return state
+
+def _results_bytes(results):
+    return len(json.dumps(results, ensure_ascii=False, default=str)) if results else 0
+
+class MemoryStore:
+    """
+    进程内字典（即 PROGRESS），只适合单 worker 部署。
+    过期用小顶堆（按最后活动时间）惰性判断，清理只碰到期的任务；
+    数量/results 大小超上限时按完成先后淘汰已完成任务，进行中的任务不动。
+    update/create 返回被淘汰的 task_id，由调用方收掉对应的通知通道。
+    """
+    poll_s = None   # 所有更新都发生在本进程，靠 _Channel 推送即可
+
+    def __init__(self, max_tasks=TASK_MAX_RETAINED, max_bytes=TASK_RESULTS_MAX_BYTES):
+        from collections import OrderedDict
+        self.max_tasks, self.max_bytes = max_tasks, max_bytes
+        self._heap = []                 # (入堆时的 ts, task_id)；ts 之后又变过的出堆时重新入堆
+        self._finished = OrderedDict()  # 已完成任务，按完成顺序
+        self._sizes = {}                # task_id -> results 字节数
+        self.bytes = 0
+
+    def _drop(self, task_id):
+        PROGRESS.pop(task_id, None)
+        self._finished.pop(task_id, None)
+        self.bytes -= self._sizes.pop(task_id, 0)
+
+    def _evict(self):
+        dead = []
+        while self._finished and (len(PROGRESS) > self.max_tasks or self.bytes > self.max_bytes):
+            task_id, _ = self._finished.popitem(last=False)
+            self._drop(task_id)
+            dead.append(task_id)
+        return dead
+
+    def update(self, task_id, fields):
+        import heapq
+        with LOCK:
+            state = PROGRESS.get(task_id)
+            if state is None:
+                state = PROGRESS[task_id] = _new_state()
+                heapq.heappush(self._heap, (state["ts"], task_id))
+            state.update(fields)
+            state["ts"] = time.time()
+            if "results" in fields:
+                size = _results_bytes(fields["results"])
+                self.bytes += size - self._sizes.get(task_id, 0)
+                self._sizes[task_id] = size
+            if fields.get("done"):
+                self._finished[task_id] = True
+            return self._evict()
+
+    def create(self, task_id, state):
+        import heapq
+        with LOCK:
+            self._drop(task_id)
+            PROGRESS[task_id] = state
+            heapq.heappush(self._heap, (state["ts"], task_id))
+            return self._evict()
+
+    def get(self, task_id):
+        with LOCK:
+            return PROGRESS.get(task_id)
+
+    def delete(self, task_id):
+        with LOCK:
+            self._drop(task_id)
+
+    def cancel(self, task_id):
+        with LOCK:
+            if task_id not in PROGRESS: return False
+            PROGRESS[task_id]["cancel"] = True
+            PROGRESS[task_id]["ts"] = time.time()
+            return True
+
+    def touch(self, task_id):
+        with LOCK:
+            if task_id in PROGRESS:
+                PROGRESS[task_id]["ts"] = time.time()
+
+    def version(self, task_id):
+        return None
+
+    def size(self):
+        return len(PROGRESS)
+
+    def expire(self, ttl):
+        import heapq
+        cutoff = time.time() - ttl
+        dead = []
+        with LOCK:
+            while self._heap and self._heap[0][0] < cutoff:
+                _, task_id = heapq.heappop(self._heap)
+                state = PROGRESS.get(task_id)
+                if state is None:
+                    continue                    # 已被删除/淘汰
+                if state["ts"] >= cutoff:       # 之后还活动过：按最新时间重新入堆
+                    heapq.heappush(self._heap, (state["ts"], task_id))
+                    continue
+                self._drop(task_id)
+                dead.append(task_id)
+        return dead
+
+class SQLiteStore:
+    """
+    SQLite（WAL）文件，所有 worker 进程读写同一份任务状态：/start 落在 A、/stream 或 /cancel 落在 B 也能找到任务。
+    其他进程的更新无法推送，SSE 订阅者按 poll_s 轮询该行的 version（单行主键查询，很便宜）。
+    """
+    def __init__(self, path, poll_s):
+        self.path, self.poll_s = path, poll_s
+        self._local = threading.local()
+        with self._tx() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS tasks (task_id TEXT PRIMARY KEY, state TEXT NOT NULL, "
+                       "ts REAL NOT NULL, version INTEGER NOT NULL DEFAULT 0)")
+            db.execute("CREATE INDEX IF NOT EXISTS tasks_ts ON tasks(ts)")
+
+    def _db(self):
+        """每个线程一条连接（sqlite3 连接不能跨线程共用）。"""
+        db = getattr(self._local, "db", None)
+        if db is None:
+            import sqlite3
+            db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def _tx(self):
+        import contextlib
+        @contextlib.contextmanager
+        def tx():
+            db = self._db()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+        return tx()
+
+    def _write(self, task_id, fn):
+        """读-改-写放在一个 IMMEDIATE 事务里，两个进程同时更新同一任务也不会互相覆盖。"""
+        with self._tx() as db:
+            row = db.execute("SELECT state FROM tasks WHERE task_id=?", (task_id,)).fetchone()
+            state = fn(json.loads(row[0]) if row else None)
+            if state is None: return False
+            state["ts"] = time.time()
+            db.execute("INSERT INTO tasks(task_id, state, ts, version) VALUES(?,?,?,1) "
+                       "ON CONFLICT(task_id) DO UPDATE SET state=excluded.state, ts=excluded.ts, version=version+1",
+                       (task_id, json.dumps(state, ensure_ascii=False), state["ts"]))
+            return True
+
+    def update(self, task_id, fields):
+        def merge(state):
+            state = state or _new_state()
+            state.update(fields)
+            return state
+        self._write(task_id, merge)
+        return []
+
+    def create(self, task_id, state):
+        self._write(task_id, lambda _: dict(state))
+        return []
+
+    def get(self, task_id):
+        row = self._db().execute("SELECT state FROM tasks WHERE task_id=?", (task_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def delete(self, task_id):
+        with self._tx() as db:
+            db.execute("DELETE FROM tasks WHERE task_id=?", (task_id,))
+
+    def cancel(self, task_id):
+        def mark(state):
+            if state is None: return None
+            state["cancel"] = True
+            return state
+        return self._write(task_id, mark)
+
+    def touch(self, task_id):
+        with self._tx() as db:
+            db.execute("UPDATE tasks SET ts=? WHERE task_id=?", (time.time(), task_id))
+
+    def version(self, task_id):
+        row = self._db().execute("SELECT version FROM tasks WHERE task_id=?", (task_id,)).fetchone()
+        return row[0] if row else None
+
+    def size(self):
+        return self._db().execute("SELECT COUNT(*) FROM tasks").fetchone()[0]
+
+    def expire(self, ttl, max_tasks=TASK_MAX_RETAINED, max_bytes=TASK_RESULTS_MAX_BYTES):
+        """按 ts 索引删过期任务；再从最新往旧累计条数/大小，超上限的已完成任务一并删掉。"""
+        cutoff = time.time() - ttl
+        with self._tx() as db:
+            dead = [r[0] for r in db.execute("SELECT task_id FROM tasks WHERE ts < ?", (cutoff,))]
+            db.execute("DELETE FROM tasks WHERE ts < ?", (cutoff,))
+            over = [r[0] for r in db.execute(
+                "SELECT task_id FROM (SELECT task_id, json_extract(state, '$.done') AS done, "
+                "COUNT(*) OVER w AS n, SUM(length(state)) OVER w AS b FROM tasks WINDOW w AS (ORDER BY ts DESC)) "
+                "WHERE done AND (n > ? OR b > ?)", (max_tasks, max_bytes))]
+            db.executemany("DELETE FROM tasks WHERE task_id=?", [(k,) for k in over])
+        return dead + over
+
+def make_store(kind=TASK_STORE):
+    if kind == "memory": return MemoryStore()
+    if kind == "sqlite": return SQLiteStore(TASK_STORE_PATH, TASK_STORE_POLL_S)
+    raise ValueError(f"未知的 TASK_STORE：{kind}")
+
+STORE = make_store()
+
+def set_progress(task_id, **fields):
+    dead = STORE.update(task_id, {k:v for k,v in fields.items() if v is not None})
+    _notify(task_id)
+    if dead:
+        _forget(dead)
 
 def get_progress(task_id):
+    return STORE.get(task_id)
+
+def _forget(dead):
+    """收掉已删除任务的通知通道。"""
     with LOCK:
-        return PROGRESS.get(task_id)
+        chans = [CHANNELS.pop(k) for k in dead if k in CHANNELS]
+    for ch in chans:  # 叫醒还挂着的订阅者，让它们发现任务已不存在
+        with ch.cond:
+            ch.version += 1
+            ch.cond.notify_all()
 
 def cleanup_old_tasks():
-    now = time.time()
+    dead = STORE.expire(TASK_TTL)
+    if dead:
+        _forget(dead)
+    return dead
+
+_REAPER = {"pid": None}
+
+def _reaper_loop():
+    while True:
+        time.sleep(TASK_REAP_S)
+        try:
+            cleanup_old_tasks()
+        except Exception:
+            pass  # 清理失败（如 sqlite 暂时被锁）下一轮再来
+
+def ensure_reaper():
+    """后台定时清理线程（每个进程一个，fork 之后按 pid 重建）；请求路径上不再做清理扫描。"""
+    if _REAPER["pid"] == os.getpid():
+        return
     with LOCK:
-        dead = [k for k,v in PROGRESS.items() if now - v.get("ts", now) > TASK_TTL]
-        for k in dead:
-            PROGRESS.pop(k, None)
+        if _REAPER["pid"] != os.getpid():
+            threading.Thread(target=_reaper_loop, daemon=True).start()
+            _REAPER["pid"] = os.getpid()
+
+_STREAM_FIELDS = ("pct", "stage", "eta", "detail", "done", "cancel")
+
+def progress_delta(state, sent):
+    """
+    与该订阅者上次发出的内容比较，只返回变化的字段；新完成的街以 results_new 追加。
+    建议草稿（draft）同理：同一街只发新增的文字 draft_new，换街或清空时才发整个 draft。
+    sent 为订阅者自己的视图（首次为空 dict → 返回完整快照，结果放在 results 里）。
+    """
+    results = state.get("results") or []
+    draft = state.get("draft") or {}
+    text = draft.get("text") or ""
+    if not sent:
+        delta = {k: state.get(k) for k in _STREAM_FIELDS}
+        delta["results"] = list(results)
+        delta["draft"] = draft
+    else:
+        delta = {k: state.get(k) for k in _STREAM_FIELDS if state.get(k) != sent.get(k)}
+        if len(results) > sent["n_results"]:
+            delta["results_new"] = results[sent["n_results"]:]
+        if draft.get("street") != sent["draft_street"] or len(text) < sent["draft_len"]:
+            delta["draft"] = draft
+        elif len(text) > sent["draft_len"]:
+            delta["draft_new"] = text[sent["draft_len"]:]
+    sent.update({k: state.get(k) for k in _STREAM_FIELDS})
+    sent["n_results"] = len(results)
+    sent["draft_street"], sent["draft_len"] = draft.get("street"), len(text)
+    return delta
+
+# ========= 任务调度（有界线程池 + 有界队列 + 按客户端轮转） =========
+TASK_WORKERS = int(os.getenv("TASK_WORKERS", "2"))            # 同时模拟的任务数
+TASK_QUEUE_MAX = int(os.getenv("TASK_QUEUE_MAX", "32"))       # 排队上限，满了 /start 直接 429
+TASK_PER_CLIENT_MAX = int(os.getenv("TASK_PER_CLIENT_MAX", "4"))  # 单个客户端最多排队数
+
+class QueueFull(Exception):
+    pass
+
+class TaskScheduler:
+    """
+    固定数量的工作线程从各客户端的队列里轮流取任务（一个客户端刷再多请求也只占一格轮次），
+    每次入队/出队后把排队位置与预计开始时间写回各任务的 stage/eta。
+    """
+    def __init__(self, workers, max_queue, per_client_max):
+        from collections import OrderedDict, deque
+        self.workers, self.max_queue, self.per_client_max = workers, max_queue, per_client_max
+        self._deque = deque
+        self._queues = OrderedDict()   # client -> deque[(task_id, fn, args)]，顺序即轮转顺序
+        self._cond = threading.Condition()
+        self._threads = []
+        self._pid = None
+        self.queued = self.running = self.rejected = 0
+        self.avg_task_s = 1.0          # 任务耗时的指数滑动平均，用来估算等待时间
+
+    def submit(self, client, task_id, fn, args):
+        with self._cond:
+            q = self._queues.get(client)
+            if self.queued >= self.max_queue or (q is not None and len(q) >= self.per_client_max):
+                self.rejected += 1
+                raise QueueFull("排队已满，请稍后再试")
+            self._ensure_threads()
+            if q is None:
+                q = self._queues[client] = self._deque()
+            q.append((task_id, fn, args, time.monotonic()))
+            self.queued += 1
+            positions = self._positions()
+            self._announce(positions)
+            self._cond.notify()
+        return dict(positions).get(task_id, 1)
+
+    def _ensure_threads(self):
+        if self._pid != os.getpid():  # gunicorn fork 之后线程不会跟过来，按进程重建
+            self._threads = []
+            self._pid = os.getpid()
+        self._threads = [th for th in self._threads if th.is_alive()]  # 兜底：万一有线程意外退出，按缺额补上
+        while len(self._threads) < self.workers:
+            th = threading.Thread(target=self._loop, daemon=True)
+            th.start()
+            self._threads.append(th)
+
+    def _positions(self):
+        """按轮转顺序模拟出队，得到每个排队任务的位置（从 1 开始）。"""
+        lanes = [list(q) for q in self._queues.values()]
+        out, pos, depth = [], 0, 0
+        while any(depth < len(l) for l in lanes):
+            for l in lanes:
+                if depth < len(l):
+                    pos += 1
+                    out.append((l[depth][0], pos))
+            depth += 1
+        return out
+
+    def _announce(self, positions):
+        # 在 _cond 内调用：任务出队前一定已写完它的排队信息，不会盖掉开始模拟后的 stage
+        for task_id, pos in positions:
+            eta = int(self.avg_task_s * ((pos - 1) // max(self.workers, 1) + 1))
+            set_progress(task_id, stage=f"排队中（第 {pos} 位）", eta=eta)
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self.queued:
+                    self._cond.wait()
+                client, q = next(iter(self._queues.items()))
+                task_id, fn, args, t_enq = q.popleft()
+                if q: self._queues.move_to_end(client)
+                else: del self._queues[client]
+                self.queued -= 1
+                self.running += 1
+                self._announce(self._positions())
+            t0 = time.monotonic()
+            M_QUEUE_WAIT.observe(t0 - t_enq)
+            try:
+                fn(*args)
+            except Exception:  # 任务自己的异常不能带走工作线程，记日志后继续取下一个
+                app.logger.exception("任务 %s 执行出错", task_id)
+            finally:
+                M_TASK_SECONDS.observe(time.monotonic() - t0)
+                with self._cond:
+                    self.running -= 1
+                    self.avg_task_s = 0.8 * self.avg_task_s + 0.2 * (time.monotonic() - t0)
+
+    def stats(self):
+        with self._cond:
+            return {"workers": self.workers, "running": self.running, "queued": self.queued,
+                    "max_queue": self.max_queue, "rejected": self.rejected,
+                    "avg_task_s": round(self.avg_task_s, 3)}
+
+SCHEDULER = TaskScheduler(TASK_WORKERS, TASK_QUEUE_MAX, TASK_PER_CLIENT_MAX)
+
+def client_id():
+    """按来源 IP 区分客户端（经 Render/Vercel 代理时取 X-Forwarded-For 的第一跳）。"""
+    fwd = request.headers.get("X-Forwarded-For", "")
+    return fwd.split(",")[0].strip() or request.remote_addr or "-"
 
 # ========= 模板（保留你原来的 UI，便于单体调试） =========
 TPL = """<!doctype html>
@@ -356,11 +2201,15 @@ body{background:linear-gradient(120deg,var(--bg1),var(--bg2));color:var(--txt)}
       <input name="river" class="form-control" placeholder="K♦ / 方片K" value="{{form.river or ''}}"></div>
     <div class="col-6 col-md-3"><label class="form-label">对手人数</label>
       <input name="villains" type="number" min="1" class="form-control" value="{{form.villains or 1}}"></div>
+    <div class="col-12 col-md-9"><label class="form-label">对手范围（可空=随机；多名对手用 ; 分隔）</label>
+      <input name="ranges" class="form-control" placeholder="22+,ATs+,KQo ; 55+,AJo+" value="{{form.ranges or ''}}"></div>
     <div class="col-6 col-md-3"><label class="form-label">有效筹码（bb，可空）</label>
       <input name="stack_bb" type="number" step="0.1" class="form-control" value="{{form.stack_bb or ''}}"></div>
     <div class="col-6 col-md-3"><label class="form-label">当前底池（bb，可空）</label>
       <input name="pot_bb" type="number" step="0.1" class="form-control" value="{{form.pot_bb or ''}}"></div>
-    <div class="col-12"><strong>若“面对下注”，填写下面两项（当街）</strong></div>
+    <div class="col-12"><strong>若“面对下注”，填写当街跟注额</strong></div>
+    <div class="col-6 col-md-3"><label class="form-label">Preflop 跟注额（bb）</label>
+      <input name="call_preflop" type="number" step="0.1" class="form-control" value="{{form.call_preflop or ''}}"></div>
     <div class="col-6 col-md-3"><label class="form-label">Flop 跟注额（bb）</label>
       <input name="call_flop" type="number" step="0.1" class="form-control" value="{{form.call_flop or ''}}"></div>
     <div class="col-6 col-md-3"><label class="form-label">Turn 跟注额（bb）</label>
@@ -381,6 +2230,7 @@ body{background:linear-gradient(120deg,var(--bg1),var(--bg2));color:var(--txt)}
 
   <div id="errBox" class="alert alert-danger mt-3" style="display:none;"></div>
   <div id="resultsHook"></div>
+  <div id="draftBox" class="advice-box mt-3" style="display:none;min-height:0"></div>
 
   {% if error %}<div class="alert alert-danger mt-3">{{error}}</div>{% endif %}
 </div>
@@ -391,12 +2241,13 @@ const $ = s=>document.querySelector(s);
 const startBtn=$('#startBtn'), cancelBtn=$('#cancelBtn');
 const progressPanel=$('#progressPanel'), bar=$('#bar'), pctText=$('#pctText');
 const stageText=$('#stageText'), etaText=$('#etaText'), streetText=$('#streetText');
-const errBox=$('#errBox'), resultsHook=$('#resultsHook');
+const errBox=$('#errBox'), resultsHook=$('#resultsHook'), draftBox=$('#draftBox');
 
 function secsToHHMMSS(s){ if(s==null) return ""; s=Math.max(0, s|0); const h=(s/3600)|0, m=((s%3600)/60)|0, sec=s%60; if(h>0) return `${h}h ${m}m ${sec}s`; if(m>0) return `${m}m ${sec}s`; return `${sec}s`; }
 
 function renderResultCard(block){
   const delta = (block.delta==null) ? "" : `（${block.delta>=0?'↑':'↓'}${(Math.abs(block.delta)*100).toFixed(2)}% 相比上一街）`;
+  const ci = block.equity_ci ? ` <span class="text-secondary">±${(block.equity_ci*100).toFixed(2)}%（${block.equity_trials} 局）</span>` : '';
   const src = (block.advice_source==='llm') ? 'LLM' : '规则引擎';
   const reason = block.advice_reason ? ` <span class="ms-2">(回退：${block.advice_reason})</span>` : '';
   const html = `
@@ -407,8 +2258,8 @@ function renderResultCard(block){
       </div>
       <p class="card-text mt-2 mb-1"><b>手牌：</b>${block.hero}</p>
       <p class="card-text mb-1"><b>公共牌：</b>${block.board}</p>
-      <p class="card-text mb-1"><b>牌型：</b>${block.hand_name}（score=${block.score}，越小越强）</p>
-      <p class="card-text mb-1"><b>胜率：</b>${(block.equity*100).toFixed(2)}% ${delta}</p>
+      <p class="card-text mb-1"><b>牌型：</b>${block.hand_name}${block.score==null ? '' : `（score=${block.score}，越小越强）`}</p>
+      <p class="card-text mb-1"><b>胜率：</b>${(block.equity*100).toFixed(2)}%${ci} ${delta}</p>
       <hr/>
       <div class="advice-box">${(block.advice_text||'').replaceAll('\\n','<br/>')}</div>
     </div></div>`;
@@ -429,12 +2280,20 @@ async function startTask(e){
   if(es) es.close();
   // 同上，Vercel 代理时把 `/stream/` 改成 `/api/stream/`
   es = new EventSource(`/stream/${currentTask}`);
+  const state = {};  // 首条为完整快照，之后是增量，合并到本地视图
+  let draft = '', draftStreet = '';  // 正在生成的建议（流式草稿）
   es.onmessage = (evt)=>{
-    const state = JSON.parse(evt.data);
+    const d = JSON.parse(evt.data);
+    Object.assign(state, d);
     bar.style.width = (state.pct||0) + '%'; pctText.textContent = (state.pct||0) + '%';
     stageText.textContent = state.stage || ''; etaText.textContent = state.eta!=null ? ('ETA ' + secsToHHMMSS(state.eta)) : '';
     streetText.textContent = state.detail && state.detail.street ? ('当前街：' + state.detail.street) : '';
-    if(state.results && state.results.length){ resultsHook.innerHTML=''; state.results.forEach(renderResultCard); }
+    if(d.results){ resultsHook.innerHTML=''; d.results.forEach(renderResultCard); }
+    if(d.results_new){ d.results_new.forEach(renderResultCard); }
+    if(d.draft){ draft = d.draft.text || ''; draftStreet = d.draft.street || ''; }
+    if(d.draft_new){ draft += d.draft_new; }
+    draftBox.style.display = draft ? 'block' : 'none';
+    draftBox.textContent = draft ? (draftStreet + ' 建议生成中…\n' + draft) : '';
     if(state.done){ es.close(); startBtn.disabled=false; cancelBtn.disabled=true; stageText.textContent='完成'; etaText.textContent=''; bar.style.width='100%'; pctText.textContent='100%'; }
   };
   es.addEventListener('error', ()=>{ startBtn.disabled=false; cancelBtn.disabled=true; });
@@ -461,12 +2320,157 @@ def float_or_none(s):
     except:
         return None
 
+SPOT_FIELDS = ["hero","pos","flop","turn","river","villains","ranges","stack_bb","pot_bb",
+               "call_preflop","call_flop","call_turn","call_river"]
+
+def _field(v):
+    if v is None: return ""
+    if isinstance(v, (list, tuple)): return " ".join(str(x) for x in v)
+    return str(v)
+
+def parse_spot(src):
+    """把表单或一条 JSONL 牌局（字段同表单；公共牌也可写成列表）解析成逐街计算所需的参数。"""
+    form = {k: _field(src.get(k)) for k in SPOT_FIELDS}
+    villains = int(form["villains"] or DEFAULT_VILLAINS)
+    if not 1 <= villains <= MAX_VILLAINS:
+        raise ValueError(f"对手人数应在 1–{MAX_VILLAINS} 人，当前 {villains} 人。")
+    hero_cards, hero_std = parse_cards(form["hero"], 2, 2)
+    ranges = parse_ranges(form["ranges"], villains)
+
+    streets = [("Preflop", [], [], TRIALS_PREFLOP, float_or_none(form["call_preflop"]))]
+    if form["flop"]:
+        flop_cards, flop_std = parse_cards(form["flop"], 3, 3)
+        streets.append(("Flop", flop_cards, flop_std, TRIALS_FLOP, float_or_none(form["call_flop"])))
+    if form["turn"] and len(streets)>=2:
+        turn_cards, turn_std = parse_cards(form["turn"], 1, 1)
+        board_t = streets[1][1] + turn_cards
+        board_t_std = streets[1][2] + turn_std
+        streets.append(("Turn", board_t, board_t_std, TRIALS_TURN, float_or_none(form["call_turn"])))
+    if form["river"] and len(streets)>=3:
+        river_cards, river_std = parse_cards(form["river"], 1, 1)
+        board_r = streets[2][1] + river_cards
+        board_r_std = streets[2][2] + river_std
+        streets.append(("River", board_r, board_r_std, TRIALS_RIVER, float_or_none(form["call_river"])))
+
+    return {"hero_cards": hero_cards, "hero_std": hero_std, "villains": villains, "streets": streets,
+            "stack_bb": float_or_none(form["stack_bb"]), "pot_bb": float_or_none(form["pot_bb"]),
+            "pos": form["pos"] or None, "ranges": ranges, "ranges_text": form["ranges"].strip() or None}
+
+# ========= 冷启动预热（/health 立即可用，/ready 报告预热是否完成） =========
+WARMUP = os.getenv("WARMUP", "1") == "1"  # 进程启动后在后台线程里建好各张表、拉起 LLM 客户端
+_WARM = {"pid": None, "state": "cold", "started": None, "elapsed_s": None, "steps": {}}
+_WARM_LOCK = threading.Lock()
+
+def _warm_preflop():
+    if _preflop_table() is None:
+        return "翻前表文件不存在，翻前改走模拟"
+
+def _warm_equity():
+    """跑一小段模拟，把 mmap 的表页读进内存、走一遍热路径；直接调引擎，不计入指标。"""
+    hero, board = _FULL_DECK[48:50], _FULL_DECK[:3]
+    if np is not None: _equity_mc_numpy(hero, board, 2, 2000, 1, 0.0, 5.0, None)
+    else: _equity_mc_python(hero, board, 2, 2000, 1, 0.0, 5.0, None)
+
+def _warm_llm():
+    """import openai 与建客户端（连接池）放到后台，首个用户不再付这笔开销。"""
+    llm_executor()
+    api = os.environ.get("OPENAI_API_KEY")
+    if not api:
+        return "未配置 OPENAI_API_KEY"
+    llm_client(api)
+
+def _warm_steps():
+    """(名称, 函数, 是否必需)；函数返回字符串时作为备注记下。LLM 失败不影响就绪（有规则建议兜底）。"""
+    steps = [("rank_table", rank_table, True), ("preflop_table", _warm_preflop, True), ("texture_table", texture_table, True)]
+    if np is not None: steps.append(("np_tables", _np_tables, True))
+    steps.append(("equity", _warm_equity, True))
+    if EQUITY_ENGINE == "pool": steps.append(("equity_pool", equity_pool, True))
+    steps.append(("llm", _warm_llm, False))
+    return steps
+
+def _warmup():
+    failed = False
+    for name, fn, required in _warm_steps():
+        t0 = time.monotonic()
+        try:
+            note = fn()
+            step = {"ok": True}
+            if isinstance(note, str): step["note"] = note
+        except Exception as e:
+            step = {"ok": False, "error": str(e)}
+            failed = failed or required
+        step["s"] = round(time.monotonic() - t0, 3)
+        _WARM["steps"][name] = step
+    _WARM["elapsed_s"] = round(time.monotonic() - _WARM["started"], 3)
+    _WARM["state"] = "failed" if failed else "ready"
+
+def _start_os_thread(fn):
+    """gevent worker 打过猴子补丁后 threading.Thread 只是 greenlet，CPU 密集的预热会卡住 /health；
+    这时取补丁前的 start_new_thread 起真正的系统线程。"""
+    if "gevent" in sys.modules:
+        from gevent import monkey
+        if monkey.is_module_patched("threading"):
+            monkey.get_original("_thread", "start_new_thread")(fn, ())
+            return
+    threading.Thread(target=fn, name="warmup", daemon=True).start()
+
+def ensure_warmup():
+    """
+    每个 worker 进程只起一次预热线程；fork 出的 worker 里 pid 变了会重新起。
+    由 __main__、gunicorn 的 post_worker_init 钩子或首个请求触发，不在 import 时启动；
+    进程池的子进程（spawn 会重新 import 本模块）里直接跳过。
+    """
+    if not WARMUP or _WARM["pid"] == os.getpid() or multiprocessing.parent_process() is not None:
+        return
+    with _WARM_LOCK:
+        if _WARM["pid"] == os.getpid():
+            return
+        _WARM.update(pid=os.getpid(), state="warming", started=time.monotonic(), elapsed_s=None, steps={})
+        _start_os_thread(_warmup)
+
+@app.before_request
+def _kick_warmup():
+    ensure_warmup()
+
+def _ready_payload():
+    if not WARMUP:
+        return {"ready": True, "state": "disabled", "elapsed_s": None, "steps": {}}
+    state = _WARM["state"]
+    elapsed = _WARM["elapsed_s"]
+    if elapsed is None and _WARM["started"] is not None:
+        elapsed = round(time.monotonic() - _WARM["started"], 3)
+    return {"ready": state == "ready", "state": state, "elapsed_s": elapsed, "steps": dict(_WARM["steps"])}
+
 # ========= 公共：返回健康与配置 =========
 def _health_payload():
     return {"ok": True, "ts": datetime.utcnow().isoformat()+"Z"}
 
 def _config_payload():
-    return llm_runtime_config()
+    payload = llm_runtime_config()
+    payload["equity_cache"] = EQUITY_CACHE.stats()
+    payload["scheduler"] = SCHEDULER.stats()
+    payload["task_store"] = TASK_STORE
+    return payload
+
+def _metrics_gauges():
+    sched = SCHEDULER.stats()
+    with LOCK:
+        chans = list(CHANNELS.values())
+    caches = {"equity": EQUITY_CACHE.stats(), "advice": ADVICE_CACHE.stats()}
+    breaker = LLM_BREAKER.stats()["state"]
+    return [
+        ("poker_tasks_running", "正在计算的任务数", "gauge", [({}, sched["running"])]),
+        ("poker_tasks_queued", "排队中的任务数", "gauge", [({}, sched["queued"])]),
+        ("poker_tasks_rejected_total", "因排队已满被拒绝的任务数", "counter", [({}, sched["rejected"])]),
+        ("poker_tasks_stored", "任务状态存储中的任务数（PROGRESS 大小）", "gauge", [({}, STORE.size())]),
+        ("poker_sse_subscribers", "当前 SSE 订阅连接数", "gauge", [({}, sum(ch.subscribers for ch in chans))]),
+        ("poker_cache_hits_total", "缓存命中次数", "counter", [({"cache": k}, s["hits"]) for k, s in caches.items()]),
+        ("poker_cache_misses_total", "缓存未命中次数", "counter", [({"cache": k}, s["misses"]) for k, s in caches.items()]),
+        ("poker_cache_hit_ratio", "缓存命中率", "gauge", [({"cache": k}, s["hit_rate"] or 0) for k, s in caches.items()]),
+        ("poker_llm_breaker_state", "LLM 熔断器状态（当前状态为 1）", "gauge",
+         [({"state": s}, int(s == breaker)) for s in ("closed", "open", "half_open")]),
+        ("poker_ready", "冷启动预热已完成为 1", "gauge", [({}, int(_ready_payload()["ready"]))]),
+    ]
 
 # ========= 路由工具：注册 /path 与 /api/path 双路径 =========
 def dual_route(rule, **options):
@@ -486,7 +2490,7 @@ def dual_route(rule, **options):
 # ========= 页面（可用于单体调试；Vercel 前端时基本不用） =========
 @dual_route("/", methods=["GET"])
 def index():
-    form = {k: "" for k in ["hero","pos","flop","turn","river","villains","stack_bb","pot_bb","call_flop","call_turn","call_river"]}
+    form = {k: "" for k in ["hero","pos","flop","turn","river","villains","ranges","stack_bb","pot_bb","call_preflop","call_flop","call_turn","call_river"]}
     llm = llm_runtime_config()
     return render_template_string(TPL, form=form, error=None, results=[], llm=llm)
 
@@ -495,87 +2499,98 @@ def index():
 def health():
     return jsonify(_health_payload())
 
+@dual_route("/ready", methods=["GET"])
+def ready():
+    """就绪检查：预热完成前返回 503，平台可据此推迟切流量；/health 只表示进程活着。"""
+    payload = _ready_payload()
+    return jsonify(payload), (200 if payload["ready"] else 503)
+
 @dual_route("/config", methods=["GET"])
 def config():
     return jsonify(_config_payload())
 
+# ========= 指标导出 =========
+@dual_route("/metrics", methods=["GET"])
+def metrics():
+    return Response(render_metrics(_metrics_gauges()), mimetype="text/plain; version=0.0.4")
+
 # ========= 启动任务 =========
 @dual_route("/start", methods=["POST"])
 def start_task():
-    form = {k: (request.form.get(k) or "") for k in
-            ["hero","pos","flop","turn","river","villains","stack_bb","pot_bb","call_flop","call_turn","call_river"]}
     try:
-        villains = int(form["villains"] or DEFAULT_VILLAINS)
-        hero_cards, hero_std = parse_cards(form["hero"], 2, 2)
-
-        streets = []
-        if form["flop"]:
-            flop_cards, flop_std = parse_cards(form["flop"], 3, 3)
-            streets.append(("Flop", flop_cards, flop_std, TRIALS_FLOP, float_or_none(form["call_flop"])))
-        if form["turn"] and streets:
-            turn_cards, turn_std = parse_cards(form["turn"], 1, 1)
-            board_t = streets[0][1] + turn_cards
-            board_t_std = streets[0][2] + turn_std
-            streets.append(("Turn", board_t, board_t_std, TRIALS_TURN, float_or_none(form["call_turn"])))
-        if form["river"] and len(streets)>=2:
-            river_cards, river_std = parse_cards(form["river"], 1, 1)
-            board_r = streets[1][1] + river_cards
-            board_r_std = streets[1][2] + river_std
-            streets.append(("River", board_r, board_r_std, TRIALS_RIVER, float_or_none(form["call_river"])))
-
-        if not streets:
-            return jsonify({"error":"请至少填写 Flop（三张）以开始逐街评估。"}), 400
-
-        stack_bb = float_or_none(form["stack_bb"])
-        pot_bb   = float_or_none(form["pot_bb"])
+        spot = parse_spot(request.form)
 
         task_id = uuid.uuid4().hex
-        PROGRESS[task_id] = {"pct":0,"stage":"排队中…","eta":None,"done":False,"cancel":False,"results":[],"detail":{},"ts":time.time()}
-
-        th = threading.Thread(
-            target=_worker_run,
-            args=(task_id, hero_cards, hero_std, villains, streets, stack_bb, pot_bb, form.get("pos") or None),
-            daemon=True
-        )
-        th.start()
-        return jsonify({"task_id": task_id})
+        ensure_reaper()
+        dead = STORE.create(task_id, _new_state(stage="排队中…"))
+        if dead:
+            _forget(dead)
+
+        args = (task_id, spot["hero_cards"], spot["hero_std"], spot["villains"], spot["streets"],
+                spot["stack_bb"], spot["pot_bb"], spot["pos"], spot["ranges"], spot["ranges_text"])
+        try:
+            position = SCHEDULER.submit(client_id(), task_id, _worker_run, args)
+        except QueueFull as e:
+            STORE.delete(task_id)
+            return jsonify({"error": str(e)}), 429, {"Retry-After": str(max(1, int(SCHEDULER.avg_task_s)))}
+        return jsonify({"task_id": task_id, "queue_position": position})
     except Exception as e:
         return jsonify({"error": f"输入错误：{e}"}), 400
 
 # ========= 取消 =========
 @dual_route("/cancel/<task_id>", methods=["POST"])
 def cancel_task(task_id):
-    with LOCK:
-        if task_id in PROGRESS:
-            PROGRESS[task_id]["cancel"] = True
-            PROGRESS[task_id]["ts"] = time.time()
-            return jsonify({"ok": True})
+    if STORE.cancel(task_id):
+        _notify(task_id)
+        return jsonify({"ok": True})
     return jsonify({"ok": False}), 404
 
 # ========= SSE 进度流（禁用缓冲/缓存 + keepalive） =========
+# 推送式：订阅者阻塞在该任务自己的条件变量上，set_progress 时才被唤醒；
+# 首条消息是完整快照，之后只发变化的字段与新增的结果块（results_new）。
+SSE_PING_S = 15
+
 @dual_route("/stream/<task_id>", methods=["GET"])
 def stream_progress(task_id):
+    if not get_progress(task_id):  # 先查任务再建通道，随便拼的 task_id 不会在 CHANNELS 里留下条目
+        return jsonify({"error": "task not found"}), 404
+
     def event_stream():
-        prev = None
-        last_ping = time.monotonic()
-        while True:
-            state = get_progress(task_id)
-            if not state:
-                yield "event: error\ndata: {\"error\":\"task not found\"}\n\n"
-                break
-            snapshot = (state["pct"], state["stage"], state["eta"], state["done"], len(state.get("results",[])))
-            if snapshot != prev:
-                payload = json.dumps(state, ensure_ascii=False)
-                yield f"data: {payload}\n\n"
-                prev = snapshot
-            # keepalive：每 15s 发一条 ping，防止代理断流
-            now = time.monotonic()
-            if now - last_ping > 15:
-                yield ": ping\n\n"
-                last_ping = now
-            if state.get("done") or state.get("cancel"):
-                break
-            time.sleep(0.2)
+        ch = _channel(task_id)
+        with ch.cond: ch.subscribers += 1
+        try:
+            seen = None
+            sent = {}
+            last_out = time.monotonic()
+            while True:
+                with ch.cond:
+                    if seen == ch.version:
+                        ch.cond.wait(timeout=STORE.poll_s or SSE_PING_S)
+                    ver = ch.version
+                if STORE.poll_s:  # 共享存储：别的进程的更新只能从 version 看出来
+                    ver = (ver, STORE.version(task_id))
+                if ver == seen:
+                    # keepalive：空闲 15s 发一条 ping，防止代理断流
+                    if time.monotonic() - last_out >= SSE_PING_S:
+                        yield ": ping\n\n"
+                        last_out = time.monotonic()
+                    continue
+                seen = ver
+                last_out = time.monotonic()
+                state = get_progress(task_id)
+                if not state:
+                    yield "event: error\ndata: {\"error\":\"task not found\"}\n\n"
+                    break
+                delta = progress_delta(state, sent)
+                if delta:
+                    yield f"data: {json.dumps(delta, ensure_ascii=False)}\n\n"
+                if state.get("done") or state.get("cancel"):
+                    break
+        finally:
+            with ch.cond: ch.subscribers -= 1
+            state = get_progress(task_id)  # 客户端中途断开时任务可能还在跑，通道要留给后续通知
+            if not state or state.get("done") or state.get("cancel"):
+                _release_channel(task_id, ch)
 
     headers = {
         "Content-Type": "text/event-stream; charset=utf-8",
@@ -585,12 +2600,172 @@ def stream_progress(task_id):
     }
     return Response(event_stream(), headers=headers)
 
+# ========= 单街计算（任务与批处理共用） =========
+def street_equity(hero_cards, board_cards, villains, trials, seed, ranges=None, carry=None, progress_cb=None):
+    """
+    单街胜率：翻前查表 → 缓存 → 穷举 → 蒙特卡洛（可复用上一街的分桶样本）。
+    返回 (equity, method, cached, reused, carry, stats)，carry 交给下一街；
+    stats 为 {"trials", "ci", "dist"}：蒙特卡洛的实际局数与 95% 置信半宽，穷举的 ci 为 0，查表为 None；
+    dist 是同一遍模拟/穷举里顺带记下的牌型分布（new_dist）；
+    翻牌/转牌另有 "next"：下一张牌的逐张胜率（next_card_rates），穷举时与本街同一网格算出；
+    蒙特卡洛时另跑 next_card_sweep，与本街模拟共用 TIME_BUDGET_S，模拟已用完预算时不附带。
+    """
+    cb = progress_cb or (lambda pct: None)
+    reused, buckets, stats, nxt = 0, None, None, None
+    sweep = NEXT_CARD_SWEEP and np is not None and 3 <= len(board_cards) <= 4
+    pre = preflop_equity(hero_cards, villains) if not board_cards and ranges is None else None
+    ckey = equity_cache_key(hero_cards, board_cards, villains, ranges)
+    cached = EQUITY_CACHE.get(ckey) if pre is None else None
+    # 缓存按花色同构归一，逐张胜率存成归一后的牌序，取用时再换回本局花色
+    perm = _canonical(hero_cards, board_cards)[1] if ranges is None else (0, 1, 2, 3)
+    combos = exact_combos(len(board_cards), villains)
+    if pre is not None:
+        equity, method = pre, "table"
+        cb(100)
+    elif cached is not None:
+        equity, method, stats, canon = cached
+        nxt = _permute_cards(canon, perm, inverse=True) if canon else None
+        cb(100)
+    elif np is not None and combos is not None and combos <= (ENUM_SWEEP_MAX_COMBOS if sweep else ENUM_MAX_COMBOS):
+        nb = new_buckets() if sweep else None
+        dist = new_dist()
+        equity = equity_exact(hero_cards, board_cards, villains, ranges, buckets=nb, dist=dist)
+        nxt = next_card_rates(nb) if nb else None
+        method = "exact"
+        stats = {"trials": combos, "ci": 0.0, "dist": dist}
+        cb(100)
+    else:
+        prior = None
+        if carry and carry[0] == len(board_cards) - 1:
+            prior = bucket_prior(carry[1], board_cards[-1])
+        buckets = new_buckets() if len(board_cards) < 5 else None
+        stats = {}
+        t0 = time.monotonic()
+        equity = equity_mc_fast(hero_cards, board_cards, villains, trials,
+                                seed=seed, eps=EARLYSTOP_EPS, t_budget_s=TIME_BUDGET_S,
+                                progress_cb=progress_cb, ranges=ranges, prior=prior, buckets=buckets, info=stats, hist=True)
+        method = "mc"
+        reused = prior[1] if prior else 0
+        left = TIME_BUDGET_S - (time.monotonic() - t0)
+        if sweep and left > 0:
+            nxt = next_card_rates(next_card_sweep(hero_cards, board_cards, villains, seed=seed, ranges=ranges,
+                                                  t_budget_s=left))
+    if pre is None and cached is None:
+        EQUITY_CACHE.put(ckey, (equity, method, stats, _permute_cards(nxt, perm) if nxt else None))
+    if nxt:
+        stats = dict(stats, next=nxt)
+    return (equity, method, cached is not None, reused,
+            ((len(board_cards), buckets) if method == "mc" else None), stats)
+
+def street_ctx(name, hero_cards, hero_std, board_cards, board_std, villains, equity, prev_eq,
+               stack_bb, pot_bb, call_amt, pos, ranges_text=None, dist=None):
+    """组装给建议引擎（LLM/规则）的上下文；dist 为 street_equity 顺带记下的牌型分布。"""
+    if board_cards:
+        hand_name, score = hand_class_zh(hero_cards, board_cards)
+    else:
+        hand_name, score = preflop_class(hero_cards)[0], None
+    return {
+        "street": name,
+        "hero_hand": hero_std,
+        "board": board_std,
+        "villains": villains,
+        "villain_ranges": ranges_text,
+        "equity": equity,
+        "hand_class": hand_name,
+        "score": score,
+        "features": board_features(board_std),
+        "position": pos,
+        "stack_bb": stack_bb,
+        "pot_bb": pot_bb,
+        "spr": spr(stack_bb, pot_bb),
+        "facing_bet": True if call_amt and pot_bb else False,
+        "call_bb": call_amt,
+        "pot_odds": pot_odds(call_amt, pot_bb) if (call_amt and pot_bb) else None,
+        "prev_equity": prev_eq,
+        "delta": (None if prev_eq is None else equity - prev_eq),
+        "hand_dist": hand_dist_view(dist),
+    }
+
+def result_block(ctx, method, cached, reused, stats=None):
+    return {
+        "title": ctx["street"],
+        "hero": " ".join(ctx["hero_hand"]),
+        "board": " ".join(ctx["board"]) if ctx["board"] else "(无)",
+        "hand_name": ctx["hand_class"],
+        "score": ctx["score"],
+        "equity": ctx["equity"],
+        "equity_method": method,
+        "equity_cached": cached,
+        "equity_reused": reused,
+        "equity_trials": stats["trials"] if stats else None,
+        "equity_ci": stats["ci"] if stats else None,
+        "next_cards": next_card_view(stats.get("next"), ctx["equity"]) if stats else None,
+        "hand_dist": ctx["hand_dist"],
+        "villain_ranges": ctx["villain_ranges"],
+        "delta": ctx["delta"],
+    }
+
+def advice_fields(adv):
+    return {
+        "advice_text": adv["text"],
+        "advice_source": adv.get("source","rule"),
+        "advice_reason": adv.get("reason"),
+        "advice_cached": bool(adv.get("cached")),
+    }
+
 # ========= 后台任务 =========
-def _worker_run(task_id, hero_cards, hero_std, villains, streets, stack_bb, pot_bb, pos):
+def _worker_run(task_id, hero_cards, hero_std, villains, streets, stack_bb, pot_bb, pos, ranges=None, ranges_text=None):
     try:
         total_streets = len(streets)
         prev_eq = None
         results_acc = []
+        carry = None  # 上一街按下一张公共牌分桶的样本：(上一街公共牌张数, buckets)
+        pending = None  # 上一街还在生成中的建议：(block, future, 该街进度终点, ctx, drafter)
+        llm_deadline = time.monotonic() + LLM_TASK_BUDGET_S  # 本任务所有建议共用的时间预算
+
+        def finish(p, last):
+            """等上一街的建议回来，补进结果；后面的街已经开始模拟时不回退进度条。"""
+            block, fut, llm_end, ctx, on_token = p
+            if not fut.done():
+                set_progress(task_id, stage=f"{block['title']}：生成建议…", eta=None)
+            from concurrent.futures import TimeoutError as FutureTimeout
+            try:
+                adv = fut.result(timeout=max(0.0, llm_deadline - time.monotonic()) + 0.5)
+            except FutureTimeout:  # 预算用完：不再等，LLM 线程自己会在 deadline 后放弃
+                adv = {"text": fallback_text(ctx), "source": "rule", "reason": "超出建议时间预算"}
+            on_token.flush()
+            block.update(advice_fields(adv))
+            results_acc.append(block)
+            set_progress(task_id, pct=int(llm_end) if last else None, results=list(results_acc),
+                         draft={}, detail={"street": block["title"]})
+
+        def drafter(name):
+            """
+            LLM 线程里收流式片段，只把 summary 字段的文字按 LLM_STREAM_FLUSH_S 节流写进 state.draft；
+            flush() 在发布该街结果前补发节流中没推出去的尾巴，之后再到的片段一律丢弃（超时后 LLM 线程可能还在读）。
+            """
+            buf, state = [], {"last": 0.0, "sent": "", "closed": False}
+            lock = threading.Lock()
+            def publish():
+                text = partial_summary("".join(buf))
+                if text != state["sent"]:
+                    state["sent"] = text
+                    set_progress(task_id, draft={"street": name, "text": text})
+            def on_token(piece):
+                with lock:
+                    if state["closed"]: return
+                    buf.append(piece)
+                    now = time.monotonic()
+                    if now - state["last"] >= LLM_STREAM_FLUSH_S:
+                        state["last"] = now
+                        publish()
+            def flush():
+                with lock:
+                    if not state["closed"]:
+                        state["closed"] = True
+                        publish()
+            on_token.flush = flush
+            return on_token
 
         def street_weight(i):
             return 1.0/total_streets
@@ -617,69 +2792,152 @@ def _worker_run(task_id, hero_cards, hero_std, villains, streets, stack_bb, pot_
                     set_progress(task_id, pct=mapped, eta=eta, detail={"street": name})
                     last_pct_report = mapped
 
-            equity = equity_mc_fast(hero_cards, board_cards, villains, trials,
-                                    seed=123+idx, eps=EARLYSTOP_EPS, t_budget_s=TIME_BUDGET_S,
-                                    progress_cb=cb)
+            equity, method, cached, reused, carry, stats = street_equity(
+                hero_cards, board_cards, villains, trials, 123+idx, ranges, carry, cb)
+            M_SIM_SECONDS.observe(time.monotonic() - t0, name, "cache" if cached else method)
+            if pending:
+                finish(pending, last=False)
+                pending = None
             if get_progress(task_id).get("cancel"): break
 
             # 组上下文求建议
-            hand_name, score = hand_class_zh(hero_cards, board_cards)
-            feats = board_features(board_std)
-            spr_val = spr(stack_bb, pot_bb)
-            ctx = {
-                "street": name,
-                "hero_hand": hero_std,
-                "board": board_std,
-                "villains": villains,
-                "equity": equity,
-                "hand_class": hand_name,
-                "score": score,
-                "features": feats,
-                "position": pos,
-                "stack_bb": stack_bb,
-                "pot_bb": pot_bb,
-                "spr": spr_val,
-                "facing_bet": True if call_amt and pot_bb else False,
-                "call_bb": call_amt,
-                "pot_odds": pot_odds(call_amt, pot_bb) if (call_amt and pot_bb) else None,
-                "prev_equity": prev_eq,
-                "delta": (None if prev_eq is None else equity - prev_eq),
-            }
-
-            # LLM 阶段
-            set_progress(task_id, stage=f"{name}：生成建议…", eta=None, detail={"street": name})
-            adv = try_llm_guarded(ctx)
-
-            block = {
-                "title": f"{name}",
-                "hero": " ".join(hero_std),
-                "board": " ".join(board_std) if board_std else "(无)",
-                "hand_name": hand_name,
-                "score": score,
-                "equity": equity,
-                "delta": ctx["delta"],
-                "advice_text": adv["text"],
-                "advice_source": adv.get("source","rule"),
-                "advice_reason": adv.get("reason"),
-            }
-            results_acc.append(block)
-
-            llm_end = base + share
-            set_progress(task_id, pct=int(llm_end), results=list(results_acc), detail={"street": name})
+            ctx = street_ctx(name, hero_cards, hero_std, board_cards, board_std, villains, equity, prev_eq,
+                             stack_bb, pot_bb, call_amt, pos, ranges_text, stats and stats.get("dist"))
 
+            # LLM 阶段：交给后台线程，本线程直接去模拟下一街
+            on_token = drafter(name)
+            fut = llm_executor().submit(try_llm_guarded, ctx, on_token, llm_deadline)
+            pending = (result_block(ctx, method, cached, reused, stats), fut, base + share, ctx, on_token)
             prev_eq = equity
 
+        if pending and not get_progress(task_id).get("cancel"):
+            finish(pending, last=True)
+
         # 结束
         set_progress(task_id, stage="完成", pct=100, eta=None, done=True, detail={"street": streets[-1][0] if streets else ""})
     except Exception as e:
         set_progress(task_id, stage=f"出错：{e}", done=True)
     finally:
         # 轻量清理：给该任务再保留 TASK_TTL 秒
-        with LOCK:
-            if task_id in PROGRESS:
-                PROGRESS[task_id]["ts"] = time.time()
+        STORE.touch(task_id)
+
+# ========= 批量分析（JSONL 牌谱） =========
+BATCH_MAX_HANDS = int(os.getenv("BATCH_MAX_HANDS", "10000"))    # 单批最多手数
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", str(TASK_WORKERS)))  # 批内并行的手数
+BATCH_MAX_CONCURRENT = int(os.getenv("BATCH_MAX_CONCURRENT", "1"))  # 同时进行的批次数，满了 /batch 返回 429
+_BATCH_SLOTS = threading.BoundedSemaphore(BATCH_MAX_CONCURRENT)
+
+def _spot_key(spot):
+    """同一局面（手牌/每街公共牌按集合，其余参数原样）只算一次。"""
+    return (tuple(sorted(spot["hero_std"])), tuple(tuple(sorted(s[2])) for s in spot["streets"]),
+            tuple(s[4] for s in spot["streets"]), spot["villains"], spot["ranges_text"],
+            spot["stack_bb"], spot["pot_bb"], spot["pos"])
+
+def analyze_spot(spot, advice="rule"):
+    """同步跑完一手牌的所有街；advice="rule" 只用规则引擎，"llm" 走 try_llm_guarded（共享熔断与缓存）。"""
+    results, prev_eq, carry = [], None, None
+    deadline = time.monotonic() + LLM_TASK_BUDGET_S
+    for idx, (name, board_cards, board_std, trials, call_amt) in enumerate(spot["streets"]):
+        equity, method, cached, reused, carry, stats = street_equity(
+            spot["hero_cards"], board_cards, spot["villains"], trials, 123+idx, spot["ranges"], carry)
+        ctx = street_ctx(name, spot["hero_cards"], spot["hero_std"], board_cards, board_std, spot["villains"],
+                         equity, prev_eq, spot["stack_bb"], spot["pot_bb"], call_amt, spot["pos"], spot["ranges_text"],
+                         stats and stats.get("dist"))
+        if advice == "llm":
+            adv = try_llm_guarded(ctx, deadline=deadline)
+        else:
+            adv = {"text": fallback_text(ctx), "source": "rule"}
+        block = result_block(ctx, method, cached, reused, stats)
+        block.update(advice_fields(adv))
+        results.append(block)
+        prev_eq = equity
+    return results
+
+def run_batch(lines, advice="rule", workers=BATCH_WORKERS):
+    """
+    逐行解析 JSONL 牌局，相同局面去重后交给一个线程池（牌力表/进程池/各缓存全批共享），
+    哪手先算完先产出 {"index","id","results"}；解析失败的行产出 {"index","error"}；最后一条是 {"summary"}。
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    t0 = time.monotonic()
+    waiters = {}   # future -> [(index, id)]
+    by_key = {}    # spot key -> future
+    hands = errors = 0
+    ex = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="batch")
+    try:
+        for i, line in enumerate(lines):
+            line = line.strip()
+            if not line: continue
+            if hands >= BATCH_MAX_HANDS:
+                yield {"index": i, "error": f"超过单批上限 {BATCH_MAX_HANDS} 手，其余未处理"}
+                break
+            hands += 1
+            try:
+                hand = json.loads(line)
+                spot = parse_spot(hand)
+            except Exception as e:
+                errors += 1
+                yield {"index": i, "error": f"输入错误：{e}"}
+                continue
+            key = _spot_key(spot)
+            fut = by_key.get(key)
+            if fut is None:
+                fut = by_key[key] = ex.submit(analyze_spot, spot, advice)
+                waiters[fut] = []
+            waiters[fut].append((i, hand.get("id")))
+        for fut in as_completed(waiters):
+            try:
+                results, err = fut.result(), None
+            except Exception as e:
+                results, err = None, f"计算出错：{e}"
+            for n, (i, hand_id) in enumerate(waiters[fut]):
+                if err:
+                    errors += 1
+                    yield {"index": i, "id": hand_id, "error": err}
+                else:
+                    yield {"index": i, "id": hand_id, "results": results, "dedup": n > 0}
+    finally:
+        ex.shutdown(wait=False, cancel_futures=True)  # 客户端断开时不再继续算剩下的
+    elapsed = time.monotonic() - t0
+    yield {"summary": {"hands": hands, "unique": len(by_key), "errors": errors, "advice": advice,
+                       "elapsed_s": round(elapsed, 3), "hands_per_s": round(hands / elapsed, 2) if elapsed > 0 else None}}
+
+# 请求体为 JSONL（每行一手，字段同 /start 表单，可加 id）；?advice=llm 时走 LLM，默认只用规则引擎
+@dual_route("/batch", methods=["POST"])
+def batch():
+    advice = request.args.get("advice", "rule")
+    if advice not in ("rule", "llm"):
+        return jsonify({"error": "advice 只能是 rule 或 llm"}), 400
+    if not _BATCH_SLOTS.acquire(blocking=False):
+        return jsonify({"error": "已有批量任务在运行，请稍后再试"}), 429, {"Retry-After": "30"}
+    try:  # 交给 call_on_close 之前任何一步出错都要把名额还回去
+        lines = request.get_data(as_text=True).splitlines()
+        resp = Response((json.dumps(r, ensure_ascii=False) + "\n" for r in run_batch(lines, advice)),
+                        mimetype="application/x-ndjson", headers={"X-Accel-Buffering": "no"})
+        resp.call_on_close(_BATCH_SLOTS.release)
+    except BaseException:
+        _BATCH_SLOTS.release()
+        raise
+    return resp
+
+def batch_cli(argv):
+    """python app.py batch <hands.jsonl|-> [--llm] [-o out.jsonl]：结果逐行写出，汇总打印到 stderr。"""
+    path = argv[0] if argv else "-"
+    advice = "llm" if "--llm" in argv else "rule"
+    out_path = argv[argv.index("-o") + 1] if "-o" in argv else None
+    src = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    out = open(out_path, "w", encoding="utf-8") if out_path else sys.stdout
+    try:
+        for r in run_batch(src, advice):
+            out.write(json.dumps(r, ensure_ascii=False) + "\n")
+            out.flush()
+            if "summary" in r:
+                print(json.dumps(r["summary"], ensure_ascii=False), file=sys.stderr)
+    finally:
+        if src is not sys.stdin: src.close()
+        if out is not sys.stdout: out.close()
 
-# ========= 错误处理 & 定期清理 =========
+# ========= 错误处理 =========
 @app.errorhandler(404)
 def not_found(_):
     return jsonify({"error": "not found"}), 404
@@ -690,11 +2948,13 @@ def add_common_headers(resp):
     resp.headers.setdefault("Cache-Control", "no-store")
     return resp
 
-# 定时清理陈旧任务（简单做法：每次请求后尝试一次）
-@app.before_request
-def _cleanup_hook():
-    cleanup_old_tasks()
-
 # ========= 本地开发入口（生产用 gunicorn -k gthread -w 2 -b 0.0.0.0:$PORT app:app） =========
-if __name__ == "__main__":
+# 离线生成翻前表：python app.py build-preflop [每格试验数]
+if __name__ == "__main__" and sys.argv[1:2] == ["build-preflop"]:
+    build_preflop_table(trials=int(sys.argv[2]) if len(sys.argv) > 2 else 200000)
+# 批量分析牌谱：python app.py batch hands.jsonl [--llm] [-o out.jsonl]
+elif __name__ == "__main__" and sys.argv[1:2] == ["batch"]:
+    batch_cli(sys.argv[2:])
+elif __name__ == "__main__":
+    ensure_warmup()
     app.run(host="0.0.0.0", port=int(os.getenv("PORT", 5000)), debug=False, threaded=True)
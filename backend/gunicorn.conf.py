@@ -0,0 +1,6 @@
+# gunicorn.conf.py — gunicorn 启动时自动读取（工作目录为 backend/）
+# 预热不在 import app 时启动：worker 加载完应用后由这里触发，/health 不等它。
+
+def post_worker_init(worker):
+    from app import ensure_warmup
+    ensure_warmup()
@@ -0,0 +1,14 @@
+# backend 不是包：把 backend/ 放进 sys.path，测试里直接 import app
+import os, sys
+
+os.environ.setdefault("WARMUP", "0")  # 测试里不起后台预热线程
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from treys import Card
+
+
+@pytest.fixture
+def cards():
+    """"As Ks" → treys 整数列表。"""
+    return lambda text: [Card.new(t) for t in text.split()]
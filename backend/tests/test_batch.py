@@ -0,0 +1,36 @@
+# /batch：同时进行的批次数上限（429），出错或结束后名额都要还回去
+import app
+
+
+def _post(client, body):
+    resp = client.post("/batch", data=body)
+    resp.get_data()
+    resp.close()  # 响应关闭时才归还名额
+    return resp
+
+
+def test_batch_streams_results_and_summary():
+    client = app.app.test_client()
+    resp = client.post("/batch", data='{"hero": "As Ks", "flop": "Qs Js 2h"}\nnot json\n')
+    rows = [line for line in resp.get_data(as_text=True).splitlines() if line]
+    resp.close()
+    assert resp.status_code == 200
+    assert '"summary"' in rows[-1] and '"errors": 1' in rows[-1]
+
+
+def test_busy_slot_returns_429(monkeypatch):
+    monkeypatch.setattr(app, "_BATCH_SLOTS", app.threading.BoundedSemaphore(1))
+    app._BATCH_SLOTS.acquire()
+    assert app.app.test_client().post("/batch", data="").status_code == 429
+    app._BATCH_SLOTS.release()
+
+
+def test_slot_released_when_setup_fails(monkeypatch):
+    monkeypatch.setattr(app, "_BATCH_SLOTS", app.threading.BoundedSemaphore(1))
+    def broken(lines, advice):
+        raise RuntimeError("boom")
+    monkeypatch.setattr(app, "run_batch", broken)
+    client = app.app.test_client()
+    assert _post(client, "x").status_code == 500
+    assert app._BATCH_SLOTS.acquire(blocking=False)
+    app._BATCH_SLOTS.release()
@@ -0,0 +1,71 @@
+# 牌面特征：原有五个布尔键与改表之前的判定逐一一致；新增信息只在新键里
+import itertools
+import random
+
+import pytest
+
+import app
+
+DECK = [r + s for r in "23456789TJQKA" for s in "shdc"]
+BASE_KEYS = ("flush_draw", "two_tone", "mono", "paired", "straight_draw")
+
+
+def baseline_features(board_std):
+    """改表之前的 board_features，原样保留作对照。"""
+    feats = {"flush_draw": False, "two_tone": False, "mono": False, "paired": False, "straight_draw": False}
+    if not board_std: return feats
+    suits = [b[1] for b in board_std]
+    cnt = {s: suits.count(s) for s in "shdc"}
+    if max(cnt.values()) >= 3: feats["mono"] = True
+    elif max(cnt.values()) == 2: feats["two_tone"] = True
+    ranks = [b[0] for b in board_std]
+    feats["paired"] = any(ranks.count(r) >= 2 for r in set(ranks))
+    order = "A23456789TJQKA"
+    idxs = sorted(set(order.index(r) for r in ranks if r in order))
+    if len(idxs) >= 3 and any(idxs[i+2] - idxs[i] <= 3 for i in range(len(idxs) - 2)): feats["straight_draw"] = True
+    if len(idxs) == 2 and idxs[1] - idxs[0] == 1: feats["straight_draw"] = True
+    return feats
+
+
+def _base_part(feats):
+    return {k: feats[k] for k in BASE_KEYS}
+
+
+def test_every_flop_matches_baseline():
+    for board in itertools.combinations(DECK, 3):
+        assert _base_part(app.board_features(list(board))) == baseline_features(list(board)), board
+
+
+@pytest.mark.parametrize("n", [4, 5])
+def test_random_turns_and_rivers_match_baseline(n):
+    rng = random.Random(n)
+    for _ in range(20000):
+        board = rng.sample(DECK, n)
+        assert _base_part(app.board_features(board)) == baseline_features(board), board
+
+
+def test_preflop_is_empty():
+    feats = app.board_features([])
+    assert _base_part(feats) == baseline_features([])
+    assert feats["nut_class"] is None
+
+
+def test_live_draw_keys():
+    flop = app.board_features(["9h", "8h", "2c"])
+    assert flop["flush_draw"] is False and flop["flush_draw_live"] is True
+    assert flop["straight_draw_live"] is True
+    river = app.board_features(["9h", "8h", "2c", "Kd", "3s"])
+    assert river["flush_draw_live"] is False and river["straight_draw_live"] is False
+
+
+def test_suit_isomorphic_boards_share_features():
+    a = app.board_features(["Ah", "Kh", "7c", "7d"])
+    b = app.board_features(["As", "Ks", "7h", "7c"])
+    assert a == b
+
+
+def test_advice_key_ignores_new_features():
+    ctx = {"street": "Flop", "equity": 0.61, "hand_class": "一对", "villains": 2, "spr": 4.0,
+           "facing_bet": False, "pot_odds": None, "features": app.board_features(["9h", "8h", "2c"])}
+    other = dict(ctx, features=dict(ctx["features"], nut_class="x", straight_combos=999, flush_draw_live=False))
+    assert app.advice_cache_key(ctx) == app.advice_cache_key(other)
@@ -0,0 +1,94 @@
+# LLM 熔断器：closed → open → half_open 状态机，以及预算截断不计入失败
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import app
+
+
+def test_opens_after_consecutive_failures():
+    b = app.CircuitBreaker(fails=3, slow_s=5.0, cooldown_s=30.0)
+    b.record(False); b.record(False)
+    assert b.state == "closed" and b.allow()
+    b.record(True)  # 成功清零连续失败数
+    b.record(False); b.record(False)
+    assert b.state == "closed"
+    b.record(False)
+    assert b.state == "open" and b.stats()["trips"] == 1
+    assert not b.allow() and b.stats()["short_circuited"] == 1
+
+
+def test_slow_call_counts_as_failure():
+    b = app.CircuitBreaker(fails=1, slow_s=0.5, cooldown_s=30.0)
+    b.record(True, latency_s=0.6)
+    assert b.state == "open"
+
+
+def test_half_open_allows_one_probe():
+    b = app.CircuitBreaker(fails=1, slow_s=5.0, cooldown_s=0.01)
+    b.record(False)
+    time.sleep(0.02)
+    assert b.allow() and b.state == "half_open"
+    assert not b.allow()  # 探测还没回来时其余请求仍被短路
+    b.record(False)
+    assert b.state == "open" and b.stats()["trips"] == 2
+    time.sleep(0.02)
+    assert b.allow()
+    b.record(True)
+    assert b.state == "closed" and b.allow()
+
+
+def test_cancel_frees_probe_without_counting():
+    b = app.CircuitBreaker(fails=1, slow_s=5.0, cooldown_s=0.01)
+    b.record(False)
+    time.sleep(0.02)
+    assert b.allow()
+    b.cancel()
+    assert b.state == "half_open" and b.allow()
+    closed = app.CircuitBreaker(fails=1, slow_s=5.0, cooldown_s=30.0)
+    closed.cancel()
+    assert closed.state == "closed" and closed.streak == 0
+
+
+class _SlowStream:
+    """每段内容之间睡一会儿，读到一半就超过任务的建议预算。"""
+    def __iter__(self):
+        for piece in ('{"action":', '"check"'):
+            time.sleep(0.15)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))])
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def slow_llm(monkeypatch):
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=lambda **kw: _SlowStream())))
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setattr(app, "llm_client", lambda api: client)
+    monkeypatch.setattr(app, "LLM_STREAM", True)
+    monkeypatch.setattr(app, "ADVICE_CACHE", app.TTLCache(16, 60))
+    breaker = app.CircuitBreaker(fails=1, slow_s=5.0, cooldown_s=30.0)
+    monkeypatch.setattr(app, "LLM_BREAKER", breaker)
+    return breaker
+
+
+def test_budget_cancel_is_not_a_failure(slow_llm, cards):
+    ctx = app.street_ctx("Flop", cards("As Ks"), ["As", "Ks"], cards("Qs Js 2h"), ["Qs", "Js", "2h"],
+                         1, 0.7, None, 50.0, 10.0, 0.0, None)
+    adv = app._try_llm_guarded(ctx, lambda piece: None, time.monotonic() + 0.25)
+    assert adv["source"] == "rule" and adv["reason"] == "超出建议时间预算"
+    assert slow_llm.state == "closed" and slow_llm.streak == 0
+
+
+def test_provider_error_is_a_failure(slow_llm, monkeypatch, cards):
+    def boom(**kw):
+        raise ConnectionError("upstream down")
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=boom)))
+    monkeypatch.setattr(app, "llm_client", lambda api: client)
+    ctx = app.street_ctx("Flop", cards("As Ks"), ["As", "Ks"], cards("Qs Js 2h"), ["Qs", "Js", "2h"],
+                         1, 0.7, None, 50.0, 10.0, 0.0, None)
+    adv = app._try_llm_guarded(ctx, lambda piece: None, time.monotonic() + 5.0)
+    assert adv["source"] == "rule" and adv["reason"].startswith("调用异常")
+    assert slow_llm.state == "open"
@@ -0,0 +1,56 @@
+# 上一街按下一张公共牌分桶的样本作为下一街的 prior：桶的口径、桶内胜率，以及合并后的结果与重新模拟一致
+import pytest
+from treys import Card
+
+import app
+
+HERO, FLOP, TURN = "Ah Kh", "Qh 7s 2h", "9c"
+ENGINES = ["python"] + (["numpy"] if app.np is not None else [])
+
+
+def _run(hero, board, trials, seed, **kw):
+    info = {}
+    p = app.equity_mc_fast(hero, board, 2, trials, seed=seed, eps=0.0, t_budget_s=float("inf"), info=info, **kw)
+    return p, info
+
+
+@pytest.fixture(params=ENGINES)
+def engine(request):
+    return request.param
+
+
+def test_buckets_cover_every_flop_trial(cards, engine):
+    hero, flop = cards(HERO), cards(FLOP)
+    b = app.new_buckets()
+    p, info = _run(hero, flop, 20000, 1, engine=engine, buckets=b)
+    assert sum(b["n"]) == info["trials"]
+    assert abs(sum(b["wins"]) / sum(b["n"]) - p) < info["ci"]  # 翻牌按转牌分层估计，与桶的简单平均只差分层权重
+    for c in hero + flop:  # 已知的牌不可能是下一张
+        assert app.bucket_prior(b, c) is None
+
+
+def test_turn_bucket_seeds_turn_estimate(cards, engine):
+    hero, flop, turn = cards(HERO), cards(FLOP), cards(TURN)
+    b = app.new_buckets()
+    _run(hero, flop, 40000, 2, engine=engine, buckets=b)
+    prior = app.bucket_prior(b, turn[0])
+    assert prior is not None and prior[1] > 0
+    fresh, fresh_info = _run(hero, flop + turn, 40000, 3, engine=engine)
+    seeded = prior[0] / prior[1]
+    assert abs(seeded - fresh) < 5 * (fresh * (1 - fresh) / prior[1]) ** 0.5  # 这一桶就是转牌为 9c 的样本
+
+    blended, info = _run(hero, flop + turn, 5000, 4, engine=engine, prior=prior)
+    assert info["trials"] == 5000  # prior 计入总数，只补差额
+    assert abs(blended - fresh) < info["ci"] + fresh_info["ci"]
+
+
+def test_street_equity_reuses_carry(cards, monkeypatch):
+    monkeypatch.setattr(app, "EQUITY_CACHE", app.TTLCache(16, 60))
+    monkeypatch.setattr(app, "NEXT_CARD_SWEEP", False)
+    monkeypatch.setattr(app, "ENUM_MAX_COMBOS", 0)  # 强制走蒙特卡洛
+    hero, flop, turn = cards(HERO), cards(FLOP), cards(TURN)
+    eq_f, method, _, reused, carry, _ = app.street_equity(hero, flop, 2, 20000, 5)
+    assert method == "mc" and reused == 0 and carry[0] == 3
+    prior = app.bucket_prior(carry[1], turn[0])
+    eq_t, method, _, reused, carry, _ = app.street_equity(hero, flop + turn, 2, 20000, 6, carry=carry)
+    assert method == "mc" and reused == prior[1] and carry[0] == 4
@@ -0,0 +1,86 @@
+# 各蒙特卡洛引擎对照单挑穷举：不早停跑满，误差应落在 95% 置信半宽的几倍以内
+import pytest
+
+import app
+
+SPOTS = [
+    ("As Ks", "Qs Js 2h 3d 9c"),  # 河牌：同花/顺子都没成
+    ("7h 7d", "2c 9s Kh Td"),     # 转牌：口袋对
+    ("Ah 5h", "6h 7c Kh 2d"),     # 转牌：同花听牌
+    ("Qc Jc", "Tc 9d 2s"),        # 翻牌：两头顺 + 后门同花
+]
+
+
+def _check(tally, exact):
+    p, half_width = tally.estimate()
+    assert tally.n > 0
+    assert abs(p - exact) <= max(3 * half_width, 0.005), (p, half_width, exact)
+
+
+@pytest.mark.parametrize("hero,board", SPOTS)
+def test_numpy_engine_matches_exact(cards, hero, board):
+    hero, board = cards(hero), cards(board)
+    exact = app.equity_exact(hero, board)
+    _check(app._equity_mc_numpy(hero, board, 1, 20000, 7, 0.0, 30.0, None), exact)
+
+
+@pytest.mark.parametrize("hero,board", SPOTS)
+def test_python_engine_matches_exact(cards, hero, board):
+    hero, board = cards(hero), cards(board)
+    exact = app.equity_exact(hero, board)
+    _check(app._equity_mc_python(hero, board, 1, 20000, 7, 0.0, 30.0, None), exact)
+
+
+def test_numpy_and_python_engines_agree_multiway(cards):
+    hero, board = cards("Ad Kd"), cards("Qd 7s 2c")
+    a = app._equity_mc_numpy(hero, board, 3, 20000, 1, 0.0, 30.0, None).estimate()
+    b = app._equity_mc_python(hero, board, 3, 20000, 2, 0.0, 30.0, None).estimate()
+    assert abs(a[0] - b[0]) <= 3 * (a[1] ** 2 + b[1] ** 2) ** 0.5
+
+
+def test_equity_mc_fast_reports_trials_and_ci(cards):
+    info = {}
+    p = app.equity_mc_fast(cards("As Ks"), cards("Qs Js 2h"), 2, 4000, seed=3, eps=0.0, t_budget_s=30.0,
+                           engine="numpy", info=info)
+    assert 0.0 <= p <= 1.0
+    assert info["trials"] == 4000 and info["ci"] > 0
+
+
+@pytest.fixture(scope="module")
+def pool():
+    """两个 spawn 子进程的进程池，整个模块共用一次。"""
+    old = app.EQUITY_PROCS
+    app.EQUITY_PROCS = 2
+    yield app.equity_pool()
+    app._POOL.shutdown(wait=True, cancel_futures=True)
+    app._POOL = app._POOL_PID = None
+    app.EQUITY_PROCS = old
+
+
+@pytest.mark.parametrize("hero,board", SPOTS[:2])
+def test_pool_engine_matches_exact(pool, cards, hero, board):
+    hero, board = cards(hero), cards(board)
+    exact = app.equity_exact(hero, board)
+    tally = app._equity_mc_pool(hero, board, 1, 20000, 7, 0.0, 30.0, None)
+    assert tally.n == 20000
+    _check(tally, exact)
+
+
+def test_pool_engine_stops_early_and_reports_progress(pool, cards):
+    seen = []
+    tally = app._equity_mc_pool(cards("As Ks"), cards("Qs Js 2h"), 2, 20000, 1, 0.012, 30.0, seen.append)
+    assert tally.n < 20000 and tally.estimate()[1] < 0.012
+    assert len(seen) > 1 and seen == sorted(seen)
+
+
+def test_no_villains_is_a_sure_win(cards):
+    info = {}
+    for engine in ("numpy", "python"):
+        assert app.equity_mc_fast(cards("7c 2d"), cards("Qs Js 2h"), 0, 1000, seed=1, engine=engine, info=info) == 1.0
+    assert info == {"trials": 0, "ci": 0.0}
+
+
+@pytest.mark.parametrize("villains", ["0", "-1", "23"])
+def test_parse_spot_rejects_villain_count(villains):
+    with pytest.raises(ValueError, match="对手人数"):
+        app.parse_spot({"hero": "As Ks", "villains": villains})
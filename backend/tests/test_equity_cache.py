@@ -0,0 +1,77 @@
+# 胜率缓存的花色同构 key 与逐张胜率的花色换回
+import itertools
+import random
+
+import pytest
+from treys import Card
+
+import app
+
+
+def _swap_suits(text, perm):
+    """把 "As Kd" 里的花色按 perm（"shdc" 里的下标 → 新下标）换掉。"""
+    suits = "shdc"
+    return " ".join(t[0] + suits[perm[suits.index(t[1])]] for t in text.split())
+
+
+def test_canonical_spot_is_suit_and_order_invariant(cards):
+    hero, board = "As Ks", "Qs Js 2h"
+    key = app.canonical_spot(cards(hero), cards(board))
+    for perm in itertools.permutations(range(4)):
+        h, b = _swap_suits(hero, perm), _swap_suits(board, perm)
+        assert app.canonical_spot(cards(h), cards(b)) == key
+        assert app.canonical_spot(cards(h)[::-1], cards(b)[::-1]) == key
+
+
+def test_canonical_spot_keeps_distinct_spots_apart(cards):
+    suited = app.canonical_spot(cards("As Ks"), cards("Qs Js 2h"))
+    assert suited != app.canonical_spot(cards("As Ks"), cards("Qh Jh 2s"))
+    assert suited != app.canonical_spot(cards("As Kh"), cards("Qs Js 2h"))
+
+
+def test_equity_cache_key_hits_across_suits(cards):
+    a = app.equity_cache_key(cards("Ah Kh"), cards("Qh Jh 2c"), 2)
+    b = app.equity_cache_key(cards("Ad Kd"), cards("Jd 2s Qd"), 2)
+    assert a == b
+    assert a != app.equity_cache_key(cards("Ad Kd"), cards("Jd 2s Qd"), 3)
+
+
+def test_permute_cards_round_trip():
+    rng = random.Random(3)
+    vec = [rng.random() for _ in range(52)]
+    for perm in app._SUIT_PERMS:
+        moved = app._permute_cards(vec, perm)
+        assert app._permute_cards(moved, perm, inverse=True) == vec
+
+
+def test_permute_cards_follows_canonical_perm(cards):
+    hero, board = cards("Ac Kc"), cards("Qc Jd 2h")
+    key, perm = app._canonical(hero, board)
+    vec = list(range(52))
+    moved = app._permute_cards(vec, perm)
+    # 原牌面的每张牌搬到归一后的位置，正好得到 canonical_spot 里的牌
+    hero_idx = sorted(moved.index(app._CARD_INDEX[c]) for c in hero)
+    board_idx = sorted(moved.index(app._CARD_INDEX[c]) for c in board)
+    assert (tuple(hero_idx), tuple(board_idx)) == key
+
+
+def test_cached_next_card_rates_are_mapped_back(cards, monkeypatch):
+    """同构的另一手牌命中缓存时，逐张胜率要换回它自己的花色，与直接算的结果一致。"""
+    monkeypatch.setattr(app, "NEXT_CARD_SWEEP", True)
+    hero, board = "As Kd", "Qs Js 2h 7c"
+    perm = (2, 0, 3, 1)
+    hero2, board2 = _swap_suits(hero, perm), _swap_suits(board, perm)
+
+    monkeypatch.setattr(app, "EQUITY_CACHE", app.TTLCache(16, 60))
+    app.street_equity(cards(hero), cards(board), 1, 12000, 1)
+    eq, method, cached, _, _, stats = app.street_equity(cards(hero2), cards(board2), 1, 12000, 1)
+    assert cached
+
+    monkeypatch.setattr(app, "EQUITY_CACHE", app.TTLCache(16, 60))
+    fresh = app.street_equity(cards(hero2), cards(board2), 1, 12000, 1)
+    assert not fresh[2]
+    assert eq == pytest.approx(fresh[0])
+    assert stats["next"] == pytest.approx(fresh[5]["next"])
+    # 已知牌不可能是下一张
+    for c in (hero2 + " " + board2).split():
+        assert stats["next"][app._CARD_INDEX[Card.new(c)]] is None
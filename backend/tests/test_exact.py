@@ -0,0 +1,64 @@
+# 单挑穷举：对照 treys 逐手比牌的暴力枚举，以及 street_equity 的穷举/蒙特卡洛分流
+import itertools
+
+import pytest
+from treys import Evaluator
+
+import app
+
+
+def brute_force(hero, board):
+    ev = Evaluator()
+    rest = [c for c in app._FULL_DECK if c not in hero and c not in board]
+    score = n = 0
+    for runout in itertools.combinations(rest, 5 - len(board)):
+        public = list(board) + list(runout)
+        mine = ev.evaluate(hero, public)
+        left = [c for c in rest if c not in runout]
+        for opp in itertools.combinations(left, 2):
+            theirs = ev.evaluate(list(opp), public)
+            score += 2 if mine < theirs else 1 if mine == theirs else 0
+            n += 1
+    return score / (2 * n), n
+
+
+@pytest.mark.parametrize("hero,board", [
+    ("As Ks", "Qs Js 2h 3d 9c"),
+    ("2c 2d", "Ah Kh Qh Jh 3s"),  # 公共牌同花：大量平分
+    ("9h 8h", "7h 6c 2h Kd"),
+])
+def test_exact_matches_brute_force(cards, hero, board):
+    hero, board = cards(hero), cards(board)
+    expected, n = brute_force(hero, board)
+    assert n == app.exact_combos(len(board), 1)
+    assert app.equity_exact(hero, board) == pytest.approx(expected, abs=1e-12)
+
+
+def test_exact_combos():
+    assert app.exact_combos(5, 1) == 990
+    assert app.exact_combos(4, 1) == 45540
+    assert app.exact_combos(4, 2) is None
+    assert app.exact_combos(0, 1) is None
+
+
+def test_exact_buckets_average_to_equity(cards):
+    hero, board = cards("Ah 5h"), cards("6h 7c Kh 2d")
+    buckets = app.new_buckets()
+    eq = app.equity_exact(hero, board, buckets=buckets)
+    rates = [w / n for w, n in zip(buckets["wins"], buckets["n"]) if n]
+    assert len(rates) == 46
+    assert sum(rates) / len(rates) == pytest.approx(eq)
+
+
+def test_street_routing(cards, monkeypatch):
+    """河牌单挑穷举；转牌单挑只在要附带逐张胜率时穷举，否则走蒙特卡洛。"""
+    monkeypatch.setattr(app, "EQUITY_CACHE", app.TTLCache(16, 60))
+    hero = cards("As Ks")
+    river, turn = cards("Qs Js 2h 3d 9c"), cards("Qs Js 2h 3d")
+    assert app.street_equity(hero, river, 1, 16000, 1)[1] == "exact"
+    monkeypatch.setattr(app, "NEXT_CARD_SWEEP", False)
+    assert app.street_equity(hero, turn, 1, 12000, 1)[1] == "mc"
+    monkeypatch.setattr(app, "NEXT_CARD_SWEEP", True)
+    monkeypatch.setattr(app, "EQUITY_CACHE", app.TTLCache(16, 60))
+    eq, method, _, _, _, stats = app.street_equity(hero, turn, 1, 12000, 1)
+    assert method == "exact" and stats["ci"] == 0.0 and len(stats["next"]) == 52
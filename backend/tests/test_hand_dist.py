@@ -0,0 +1,62 @@
+# 牌型分布：模拟/穷举顺带记下的计数、hand_dist_view 的比例，以及两种方法在小局面上一致
+import pytest
+
+import app
+
+HERO, TURN = "Ah Kd", "Qh Jh 7s 2c"
+ENGINES = ["python"] + (["numpy"] if app.np is not None else [])
+
+
+def _mc_dist(hero, board, villains, engine, trials=20000):
+    info = {}
+    app.equity_mc_fast(hero, board, villains, trials, seed=3, eps=0.0, t_budget_s=float("inf"),
+                       engine=engine, info=info, hist=True)
+    return info
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_counters_cover_every_trial(cards, engine):
+    info = _mc_dist(cards(HERO), cards("Qh Jh 7s"), 3, engine)
+    dist = info["dist"]
+    assert sum(dist["hero"]) == sum(dist["villain"]) == sum(dist["outcome"]) == info["trials"]
+
+
+def test_river_hero_class_is_fixed(cards):
+    info = _mc_dist(cards(HERO), cards(TURN + " Tc"), 2, ENGINES[0], trials=2000)
+    view = app.hand_dist_view(info["dist"])
+    assert view["hero"] == {"顺子": 1.0}
+
+
+def test_exact_counts_every_combo(cards):
+    hero, board = cards(HERO), cards(TURN)
+    dist = app.new_dist()
+    eq = app.equity_exact(hero, board, 1, dist=dist)
+    n = app.exact_combos(len(board), 1)
+    assert sum(dist["outcome"]) == sum(dist["hero"]) == sum(dist["villain"]) == n
+    win, tie, _ = dist["outcome"]
+    assert (win + tie / 2) / n == pytest.approx(eq)
+
+
+def test_view_shares_sum_to_one(cards):
+    dist = app.new_dist()
+    app.equity_exact(cards(HERO), cards(TURN), 1, dist=dist)
+    view = app.hand_dist_view(dist)
+    assert view["win"] + view["tie"] + view["loss"] == pytest.approx(1.0, abs=2e-4)
+    for side in ("hero", "villain"):
+        assert sum(view[side].values()) == pytest.approx(1.0, abs=1e-3)
+        assert all(v > 0 for v in view[side].values())  # 为 0 的类别略去
+    assert app.hand_dist_view(app.new_dist()) is None and app.hand_dist_view(None) is None
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_exact_and_mc_agree(cards, engine):
+    hero, board = cards(HERO), cards(TURN)
+    dist = app.new_dist()
+    app.equity_exact(hero, board, 1, dist=dist)
+    exact = app.hand_dist_view(dist)
+    mc = app.hand_dist_view(_mc_dist(hero, board, 1, engine, trials=40000)["dist"])
+    for key in ("win", "tie", "loss"):
+        assert mc[key] == pytest.approx(exact[key], abs=0.015)
+    for side in ("hero", "villain"):
+        for name in set(exact[side]) | set(mc[side]):
+            assert mc[side].get(name, 0.0) == pytest.approx(exact[side].get(name, 0.0), abs=0.015)
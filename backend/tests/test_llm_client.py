@@ -0,0 +1,122 @@
+# LLM 调用链（离线）：本地起一个兼容 OpenAI 的桩服务，验证客户端复用、建议缓存与“LLM 与下一街模拟并行”
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import app
+
+ADVICE = {"action": "check", "sizing": "check", "summary": "控制底池", "opponent_compare": "势均力敌", "tips": ["谨慎"]}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        t0 = time.monotonic()
+        req = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        time.sleep(self.server.delay_s)
+        text = json.dumps(ADVICE, ensure_ascii=False)
+        if req.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            def chunk(data):
+                self.wfile.write(b"%x\r\n" % len(data) + data + b"\r\n")
+            for i in range(0, len(text), 8):
+                ev = {"id": "t", "object": "chat.completion.chunk", "created": 0, "model": "stub",
+                      "choices": [{"index": 0, "delta": {"content": text[i:i+8]}, "finish_reason": None}]}
+                chunk(("data: " + json.dumps(ev, ensure_ascii=False) + "\n\n").encode())
+            chunk(b"data: [DONE]\n\n")
+            chunk(b"")
+        else:
+            body = json.dumps({"id": "t", "object": "chat.completion", "created": 0, "model": "stub",
+                               "choices": [{"index": 0, "finish_reason": "stop",
+                                            "message": {"role": "assistant", "content": text}}],
+                               "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        self.server.calls.append({"start": t0, "end": time.monotonic(), "peer": self.client_address[1]})
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    """桩服务 + 干净的 LLM 状态（新客户端、新缓存、闭合的熔断器）；server.calls 记下每次请求的起止时间与来源端口。"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.delay_s, server.calls = 0.0, []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setattr(app, "LLM_BASE_URL", f"http://127.0.0.1:{server.server_address[1]}/v1")
+    monkeypatch.setattr(app, "ADVICE_CACHE", app.TTLCache(64, 60))
+    monkeypatch.setattr(app, "LLM_BREAKER", app.CircuitBreaker(3, 30.0, 30.0))
+    monkeypatch.setitem(app._LLM, "key", None)
+    monkeypatch.setitem(app._LLM, "client", None)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _ctx(equity):
+    hero, hero_std = app.parse_cards("As Kd", 2, 2)
+    board, board_std = app.parse_cards("Qh 7s 2c", 3, 3)
+    return app.street_ctx("Flop", hero, hero_std, board, board_std, 1, equity, None, None, None, None, None)
+
+
+def test_client_is_reused_across_calls(stub):
+    first = app.llm_client("test")
+    assert app.llm_client("test") is first
+    assert app.llm_client("other") is not first  # key 变了要重建
+    for eq in (0.31, 0.52, 0.73):  # 胜率分桶不同：三次都走网络
+        assert app.try_llm_guarded(_ctx(eq))["source"] == "llm"
+    assert len(stub.calls) == 3
+    assert len({c["peer"] for c in stub.calls}) == 1  # 同一条 keep-alive 连接，没有重新握手
+
+
+def test_advice_cache_hit_and_miss(stub):
+    first = app.try_llm_guarded(_ctx(0.523))
+    assert first["source"] == "llm" and not first.get("cached")
+    again = app.try_llm_guarded(_ctx(0.518))  # 同一分桶（两位小数）
+    assert again["cached"] and again["text"] == first["text"]
+    assert len(stub.calls) == 1
+    other = app.try_llm_guarded(_ctx(0.61))
+    assert other["source"] == "llm" and not other.get("cached")
+    assert len(stub.calls) == 2
+    assert (app.ADVICE_CACHE.hits, app.ADVICE_CACHE.misses) == (1, 2)
+
+
+def test_llm_call_overlaps_next_street_simulation(stub, monkeypatch):
+    stub.delay_s = 0.4
+    sims, real = [], app.street_equity
+    def slow_street_equity(*args, **kwargs):
+        t0 = time.monotonic()
+        out = real(*args, **kwargs)
+        time.sleep(0.4)  # 模拟一条耗时的街
+        sims.append((t0, time.monotonic()))
+        return out
+    monkeypatch.setattr(app, "street_equity", slow_street_equity)
+
+    spot = app.parse_spot({"hero": "As Kd", "flop": "Qh 7s 2c", "villains": "1"})
+    task_id = uuid.uuid4().hex
+    app.STORE.create(task_id, app._new_state())
+    t0 = time.monotonic()
+    app._worker_run(task_id, spot["hero_cards"], spot["hero_std"], spot["villains"], spot["streets"],
+                    spot["stack_bb"], spot["pot_bb"], spot["pos"])
+    wall = time.monotonic() - t0
+    state = app.get_progress(task_id)
+    app.STORE.delete(task_id)
+
+    assert state["done"] and [r["advice_source"] for r in state["results"]] == ["llm", "llm"]
+    assert len(sims) == 2 and len(stub.calls) == 2
+    pre_call, flop_sim = stub.calls[0], sims[1]
+    assert pre_call["start"] < flop_sim[1] and flop_sim[0] < pre_call["end"]  # 翻前建议与翻牌模拟同时进行
+    assert wall < 4 * 0.4  # 串行是两街模拟 + 两次建议 ≥ 1.6s
@@ -0,0 +1,23 @@
+# 流式建议草稿：从未收完的 JSON 里只取 summary 的文字
+import json
+
+import app
+
+
+def test_partial_summary_grows_with_the_stream():
+    raw = json.dumps({"action": "bet", "sizing": "66%", "summary": "价值下注\n三分之二\"池\"", "tips": ["x"]},
+                     ensure_ascii=False)
+    seen = [app.partial_summary(raw[:k]) for k in range(len(raw) + 1)]
+    assert seen[0] == "" and seen[-1] == "价值下注\n三分之二\"池\""
+    for a, b in zip(seen, seen[1:]):
+        assert b.startswith(a)  # 只增不改：前端按增量拼接
+
+
+def test_partial_summary_waits_for_complete_escape():
+    assert app.partial_summary('{"summary": "ab\\') == "ab"
+    assert app.partial_summary('{"summary": "ab\\u4e') == "ab"
+    assert app.partial_summary('{"summary": "ab\\u4e2d') == "ab中"
+
+
+def test_partial_summary_before_field():
+    assert app.partial_summary('{"action": "check", "summ') == ""
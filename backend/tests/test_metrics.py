@@ -0,0 +1,78 @@
+# /metrics：render_metrics 的输出按 Prometheus 文本格式（0.0.4）严格解析
+import math
+import re
+
+import pytest
+
+import app
+
+_NAME = r"[a-zA-Z_:][a-zA-Z0-9_:]*"
+_SAMPLE = re.compile(rf"^({_NAME})(?:\{{(.*)\}})? (\S+)$")
+_LABEL = re.compile(rf'({_NAME})="((?:[^"\\\n]|\\[\\"n])*)"(,|$)')
+_TYPES = {"counter", "gauge", "histogram", "summary", "untyped"}
+
+
+def parse(text):
+    """→ {family: {"type", "help", "samples": [(name, {label: value}, float)]}}；格式不符直接断言失败。"""
+    assert text.endswith("\n")
+    families, current = {}, None
+    for line in text[:-1].split("\n"):
+        if line.startswith("# HELP "):
+            name, _, help_text = line[7:].partition(" ")
+            assert re.fullmatch(_NAME, name) and help_text
+            families.setdefault(name, {"type": "untyped", "help": None, "samples": []})["help"] = help_text
+            continue
+        if line.startswith("# TYPE "):
+            name, kind = line[7:].split(" ")
+            assert kind in _TYPES and name in families and not families[name]["samples"]
+            families[name]["type"], current = kind, name
+            continue
+        m = _SAMPLE.match(line)
+        assert m, line
+        name, raw_labels, value = m.groups()
+        labels, pos = {}, 0
+        while raw_labels and pos < len(raw_labels):
+            lm = _LABEL.match(raw_labels, pos)
+            assert lm, line
+            labels[lm.group(1)] = re.sub(r"\\(.)", lambda e: {"n": "\n"}.get(e.group(1), e.group(1)), lm.group(2))
+            pos = lm.end()
+        suffixes = ("_bucket", "_sum", "_count") if families[current]["type"] == "histogram" else ()
+        assert name == current or name in [current + s for s in suffixes], line
+        families[current]["samples"].append((name, labels, float(value)))
+    return families
+
+
+@pytest.fixture
+def fresh_metrics(monkeypatch):
+    c = app.Counter("t_events_total", "测试计数", ("reason",))
+    h = app.Histogram("t_seconds", "测试耗时", (0.1, 1.0), ("street",))
+    monkeypatch.setattr(app, "METRICS", [c, h])
+    return c, h
+
+
+def test_render_parses_as_prometheus_text(fresh_metrics):
+    c, h = fresh_metrics
+    c.inc(2, 'a "quoted"\\reason\nx')
+    for v in (0.05, 0.5, 3.0):
+        h.observe(v, "Flop")
+    fam = parse(app.render_metrics([("t_up", "测试量表", "gauge", [({}, 1), ({"kind": "x"}, 0.5)])]))
+    assert {k: f["type"] for k, f in fam.items()} == {"t_events_total": "counter", "t_seconds": "histogram",
+                                                       "t_up": "gauge"}
+    assert fam["t_events_total"]["samples"] == [("t_events_total", {"reason": 'a "quoted"\\reason\nx'}, 2.0)]
+    buckets = [(s[1]["le"], s[2]) for s in fam["t_seconds"]["samples"] if s[0] == "t_seconds_bucket"]
+    assert buckets == [("0.1", 1.0), ("1.0", 2.0), ("+Inf", 3.0)]  # 累积计数，以 +Inf 收尾
+    totals = {s[0]: s[2] for s in fam["t_seconds"]["samples"] if s[0] != "t_seconds_bucket"}
+    assert totals == {"t_seconds_sum": pytest.approx(3.55), "t_seconds_count": 3.0}
+    assert fam["t_up"]["samples"][1] == ("t_up", {"kind": "x"}, 0.5)
+
+
+def test_metrics_route_output_parses():
+    resp = app.app.test_client().get("/metrics")
+    assert resp.status_code == 200 and resp.mimetype == "text/plain"
+    fam = parse(resp.get_data(as_text=True))
+    assert {m.name for m in app.METRICS} <= set(fam)
+    for f in fam.values():
+        assert f["help"] and all(math.isfinite(v) for _, _, v in f["samples"])
+        if f["type"] == "histogram":
+            le = [s[1]["le"] for s in f["samples"] if s[0].endswith("_bucket")]
+            assert not le or le[-1] == "+Inf"
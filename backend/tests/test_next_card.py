@@ -0,0 +1,31 @@
+# 下一张牌逐张胜率：与穷举一致，且与本街模拟共用时间预算
+import pytest
+
+import app
+
+
+def test_sweep_matches_exact_buckets(cards, monkeypatch):
+    hero, board = cards("Ah 5h"), cards("6h 7c Kh 2d")
+    exact = app.next_card_rates(app.next_card_sweep(hero, board, 1))
+    monkeypatch.setattr(app, "ENUM_SWEEP_MAX_COMBOS", 0)  # 强制走蒙特卡洛
+    mc = app.next_card_rates(app.next_card_sweep(hero, board, 1, trials=3000, seed=1))
+    pairs = [(a, b) for a, b in zip(exact, mc) if a is not None]
+    assert len(pairs) == 46 and all(b is not None for _, b in pairs)
+    assert max(abs(a - b) for a, b in pairs) < 0.06
+
+
+def test_sweep_stops_at_budget(cards, monkeypatch):
+    monkeypatch.setattr(app, "ENUM_SWEEP_MAX_COMBOS", 0)
+    buckets = app.next_card_sweep(cards("As Ks"), cards("Qs Js 2h"), 2, trials=100000, seed=1, t_budget_s=0.0)
+    n = max(buckets["n"])
+    assert 0 < n < 1000  # 只跑了第一批
+
+
+def test_sweep_skipped_when_budget_spent(cards, monkeypatch):
+    monkeypatch.setattr(app, "EQUITY_CACHE", app.TTLCache(16, 60))
+    monkeypatch.setattr(app, "TIME_BUDGET_S", 0.0)
+    monkeypatch.setattr(app, "NEXT_CARD_SWEEP", True)
+    called = []
+    monkeypatch.setattr(app, "next_card_sweep", lambda *a, **kw: called.append(a))
+    eq, method, _, _, _, stats = app.street_equity(cards("As Ks"), cards("Qs Js 2h"), 2, 8000, 1)
+    assert method == "mc" and "next" not in stats and called == []
@@ -0,0 +1,119 @@
+# 牌面解析：查表的 normalize_token / parse_cards / parse_many 与改表之前的正则解析一致
+import itertools
+import random
+import re
+
+import pytest
+from treys import Card
+
+import app
+
+SEP_REGEX = re.compile(r'[,、/\s]+')
+
+
+def old_normalize_token(tok):
+    """改表之前的三段正则写法，原样保留作对照。"""
+    t = tok.strip()
+    if not t: raise ValueError("空牌面")
+    m = re.match(r'^(A|K|Q|J|10|T|[2-9]|１０|９|８|７|６|５|４|３|２)\s*(s|h|d|c|♠|♥|♦|♣|黑桃|红桃|方片|方块|梅花)$', t, re.IGNORECASE)
+    if m: r, s = m.group(1), m.group(2); return app.RANK_MAP[r] + app.SUIT_MAP[s]
+    m2 = re.match(r'^(黑桃|红桃|方片|方块|梅花|♠|♥|♦|♣|s|h|d|c)\s*(A|K|Q|J|10|T|[2-9]|１０|９|８|７|６|５|４|３|２)$', t, re.IGNORECASE)
+    if m2: s, r = m2.group(1), m2.group(2); return app.RANK_MAP[r] + app.SUIT_MAP[s]
+    t2 = t
+    for sym, letter in [('♠', 's'), ('♥', 'h'), ('♦', 'd'), ('♣', 'c')]: t2 = t2.replace(sym, letter)
+    t2 = t2.replace(' ', '')
+    m3 = re.match(r'^(A|K|Q|J|T|10|[2-9]|１０|９|８|７|６|５|４|３|２)(s|h|d|c)$', t2, re.IGNORECASE)
+    if m3: r, s = m3.group(1), m3.group(2); return app.RANK_MAP[r] + app.SUIT_MAP[s]
+    raise ValueError(f"无法识别的牌面：{tok}")
+
+
+def old_parse_cards(line, min_n, max_n):
+    tokens = [x for x in SEP_REGEX.split(line.strip()) if x] if line else []
+    if not (min_n <= len(tokens) <= max_n): raise ValueError(f"牌数量应在 {min_n}–{max_n} 张，当前 {len(tokens)} 张。")
+    std = [old_normalize_token(t) for t in tokens]
+    if len(set(std)) != len(std): raise ValueError(f"存在重复牌：{std}")
+    return [Card.new(s) for s in std], std
+
+
+def _outcome(fn, *args):
+    try:
+        return ("ok", fn(*args))
+    except ValueError as e:
+        return ("error", str(e))
+
+
+RANKS = list(app.RANK_MAP) + ["1", "0", "B", "11"]
+SUITS = list(app.SUIT_MAP) + ["x", "♤", "黑"]
+
+
+def _tokens():
+    for r, s in itertools.product(RANKS, SUITS):
+        for tok in (r + s, s + r, r + " " + s, s + " " + r):
+            yield tok
+    yield from ["", " ", "A", "s", "AsKs", "10", "♠♠", "ＡＳ"]
+
+
+def test_normalize_token_matches_regex_parser():
+    checked = 0
+    for tok in _tokens():
+        try:
+            expected = _outcome(old_normalize_token, tok)
+        except KeyError:
+            continue  # 旧写法在花色字母大写（如 "AS"）时直接 KeyError 崩掉，查表后按小写处理
+        got = _outcome(app.normalize_token, tok)
+        if expected[0] == "error":
+            assert got[0] == "error", tok
+        else:
+            assert got == expected, tok
+        checked += 1
+    assert checked > 1000
+
+
+def test_uppercase_suit_letters_are_accepted():
+    assert app.normalize_token("AS") == "As"
+    assert app.normalize_token("H10") == "Th"
+
+
+def _random_lines(count, seed):
+    rng = random.Random(seed)
+    seps = [" ", ",", "、", "/", " , ", "\t", "  "]
+    spell = {}
+    for r, rv in app.RANK_MAP.items():
+        for s, sv in app.SUIT_MAP.items():
+            if s.isascii() and s.isupper(): continue
+            spell.setdefault(rv + sv, []).extend([r + s, s + r])
+    keys = sorted(spell)
+    lines = []
+    for _ in range(count):
+        n = rng.randint(0, 8)
+        picks = [rng.choice(keys) for _ in range(n)]  # 可能重复，也可能张数越界
+        toks = [rng.choice(spell[k]) for k in picks]
+        if toks and rng.random() < 0.05: toks[rng.randrange(len(toks))] = "Zz"
+        line = toks[0] if toks else ""
+        for t in toks[1:]: line += rng.choice(seps) + t
+        lines.append(rng.choice(["", " "]) + line + rng.choice(["", " "]))
+    return lines
+
+
+def test_parse_cards_matches_regex_parser():
+    for line in _random_lines(3000, 1):
+        assert _outcome(app.parse_cards, line, 2, 5) == _outcome(old_parse_cards, line, 2, 5), line
+
+
+def test_parse_many_matches_parse_cards():
+    lines = _random_lines(3000, 2)
+    got = app.parse_many(lines, 2, 5, return_exceptions=True)
+    assert len(got) == len(lines)
+    for line, res in zip(lines, got):
+        expected = _outcome(app.parse_cards, line, 2, 5)
+        if isinstance(res, ValueError):
+            assert expected == ("error", str(res)), line
+        else:
+            assert expected == ("ok", res), line
+
+
+def test_parse_many_raises_first_error():
+    with pytest.raises(ValueError, match="重复"):
+        app.parse_many(["As Ks", "Qh Qh", "Zz"], 2, 2)
+    assert app.parse_many(["As Ks", "黑桃A、10h"], 2, 2) == [([Card.new("As"), Card.new("Ks")], ["As", "Ks"]),
+                                                          ([Card.new("As"), Card.new("Th")], ["As", "Th"])]
@@ -0,0 +1,52 @@
+# 翻前：起手牌归类（169 类）、花色对称，以及查表结果与模拟一致
+import itertools
+
+import pytest
+from treys import Card
+
+import app
+
+DECK = [r + s for r in app._PF_RANKS for s in "shdc"]
+
+
+def test_class_labels(cards):
+    assert app.preflop_class(cards("As Ks")) == ("AKs", 12*13 + 11)
+    assert app.preflop_class(cards("Kd Ah")) == ("AKo", 11*13 + 12)
+    assert app.preflop_class(cards("7c 7d")) == ("77", 5*13 + 5)
+    assert app.preflop_class(cards("2h 3h"))[0] == "32s"
+
+
+def test_classes_partition_all_combos():
+    counts = {}
+    for a, b in itertools.combinations(DECK, 2):
+        label, idx = app.preflop_class([Card.new(a), Card.new(b)])
+        counts.setdefault(idx, []).append(label)
+    assert sorted(counts) == list(range(169))
+    for labels in counts.values():
+        assert len(set(labels)) == 1
+        kind = labels[0][2:] or "pair"
+        assert len(labels) == {"s": 4, "o": 12, "pair": 6}[kind]
+
+
+@pytest.mark.parametrize("a, b", [("As Ks", "Kh Ah"), ("Qd Jc", "Jh Qs"), ("9c 9h", "9s 9d")])
+def test_suit_symmetry(cards, a, b):
+    assert app.preflop_class(cards(a)) == app.preflop_class(cards(b))
+    for v in (1, 4, 9):
+        assert app.preflop_equity(cards(a), v) == app.preflop_equity(cards(b), v)
+
+
+def test_out_of_range_or_missing_table(cards, monkeypatch):
+    assert app.preflop_equity(cards("As Ks"), 0) is None
+    assert app.preflop_equity(cards("As Ks"), app.PREFLOP_MAX_VILLAINS + 1) is None
+    monkeypatch.setattr(app, "PREFLOP_TABLE_PATH", "/nonexistent/preflop.bin")
+    monkeypatch.setattr(app, "_PF_TABLE", None)
+    assert app.preflop_equity(cards("As Ks"), 1) is None
+
+
+@pytest.mark.parametrize("hand, villains", [("As Ah", 1), ("Ks Qs", 3), ("7d 2c", 1), ("Th 9h", 6)])
+def test_table_agrees_with_simulation(cards, hand, villains):
+    hero = cards(hand)
+    table = app.preflop_equity(hero, villains)
+    assert table is not None
+    mc = app.equity_mc_fast(hero, [], villains, 40000, seed=7, eps=0.0, t_budget_s=float("inf"))
+    assert abs(table - mc) < 0.015
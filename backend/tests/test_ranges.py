@@ -0,0 +1,100 @@
+# 对手范围：解析、按范围发牌的联合分布，以及带范围的胜率对照穷举/拒绝采样
+import itertools
+import random
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+import app
+
+
+def test_parse_range_counts():
+    assert int((app.parse_range("AA") > 0).sum()) == 6
+    assert int((app.parse_range("AKs") > 0).sum()) == 4
+    assert int((app.parse_range("AKo") > 0).sum()) == 12
+    assert int((app.parse_range("22+") > 0).sum()) == 78
+    assert int((app.parse_range("A5s-A2s") > 0).sum()) == 16
+    assert app.parse_range("KQo:0.5").max() == 0.5
+    assert app.parse_range("random") is None
+    with pytest.raises(ValueError):
+        app.parse_range("XYz")
+
+
+def test_parse_ranges_assigns_in_order():
+    ranges = app.parse_ranges("AA;KK", 3)
+    assert len(ranges) == 3 and ranges[2] is None
+    assert app.parse_ranges("", 2) is None
+    with pytest.raises(ValueError):
+        app.parse_ranges("AA;KK;QQ", 2)
+
+
+def _joint_first_is_aa(ranges, known):
+    """精确联合分布 ∝ w1·w2（两手互不冲突、也不与已知牌冲突）下 P(对手 1 拿 AA)。"""
+    dead = set(known)
+    live = [[(k, w[k]) for k in np.nonzero(w)[0] if not set(app._COMBOS[k]) & dead] for w in ranges]
+    hit = total = 0.0
+    for (a, wa), (b, wb) in itertools.product(*live):
+        if set(app._COMBOS[a]) & set(app._COMBOS[b]): continue
+        total += wa * wb
+        if app._COMBOS[a][0] // 4 == 12: hit += wa * wb
+    return hit / total
+
+
+def test_deal_ranged_samples_the_joint_distribution(cards):
+    ranges = [app.parse_range("AA,KK"), app.parse_range("AA,AKs,AKo")]
+    known = sorted(app._CARD_INDEX[c] for c in cards("7h 8s 9c"))
+    expected = _joint_first_is_aa(ranges, known)
+    assert expected == pytest.approx(0.39, abs=0.01)
+    rng = np.random.default_rng(1)
+    v1, v2, _, ok = app._deal_ranged(rng, 200000, known, app._prepare_ranges(ranges, known), 0)
+    got = float((v1[ok, 0] // 4 == 12).mean())
+    assert got == pytest.approx(expected, abs=0.006)
+    hands = np.concatenate([v1[ok], v2[ok]], axis=1)
+    assert all(len(set(row)) == 4 for row in hands[:2000].tolist())  # 两名对手的牌互不重叠
+
+
+def test_heads_up_ranged_mc_matches_exact(cards):
+    hero, board = cards("Jh Jd"), cards("Qh 7s 2c 4d")
+    ranges = app.parse_ranges("KK,QQ,AQs,AQo,77", 1)
+    exact = app.equity_exact(hero, board, 1, ranges)
+    tally = app._equity_mc_numpy(hero, board, 1, 40000, 5, 0.0, 30.0, None, ranges)
+    p, half_width = tally.estimate()
+    assert abs(p - exact) <= max(3 * half_width, 0.005)
+
+
+def _rejection_reference(hero, board, ranges, samples, seed):
+    """独立按权重抽每名对手、冲突即整行重抽，公共牌从剩余牌里均匀补齐。"""
+    rng = random.Random(seed)
+    rt = app.rank_table()
+    known = set(hero) | set(board)
+    pools = []
+    for w in ranges:
+        ids = [k for k in np.nonzero(w)[0]]
+        pools.append(([[app._FULL_DECK[i] for i in app._COMBOS[k]] for k in ids], [float(w[k]) for k in ids]))
+    deck = [c for c in app._FULL_DECK if c not in known]
+    score = 0.0
+    n = 0
+    while n < samples:
+        hands = [rng.choices(combos, weights)[0] for combos, weights in pools]
+        used = [c for h in hands for c in h]
+        if len(set(used)) < len(used) or known & set(used): continue
+        rest = [c for c in deck if c not in used]
+        public = board + rng.sample(rest, 5 - len(board))
+        mine = rt.evaluate(hero, public)
+        theirs = [rt.evaluate(h, public) for h in hands]
+        best = min(theirs)
+        score += 1.0 if mine < best else (1.0 / (theirs.count(best) + 1) if mine == best else 0.0)
+        n += 1
+    return score / n
+
+
+@pytest.mark.parametrize("text", ["KK,QQ,AA;AA,AKs,AKo", "AA,AKs,AKo;KK,QQ,AA"])
+def test_multiway_ranged_mc_matches_rejection_reference(cards, text):
+    hero, board = cards("Jh Jd"), cards("Qh 7s 2c")
+    ranges = app.parse_ranges(text, 2)
+    ref = _rejection_reference(hero, board, ranges, 20000, 9)  # 标准误约 0.0016
+    tally = app._equity_mc_numpy(hero, board, 2, 60000, 3, 0.0, 30.0, None, ranges)
+    p, half_width = tally.estimate()
+    assert tally.n == 60000
+    assert abs(p - ref) <= 3 * ((half_width / 1.96) ** 2 + 0.0017 ** 2) ** 0.5
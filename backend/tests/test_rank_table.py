@@ -0,0 +1,49 @@
+# 7 张牌查表估值：与 treys.Evaluator 的名次、牌型逐手一致
+import random
+
+import numpy as np
+import pytest
+from treys import Evaluator
+
+import app
+
+
+def _hands(n_cards, count, seed):
+    rng = random.Random(seed)
+    return [rng.sample(app._FULL_DECK, n_cards) for _ in range(count)]
+
+
+@pytest.fixture(scope="module")
+def evaluator():
+    return Evaluator()
+
+
+@pytest.mark.parametrize("n_cards", [5, 6, 7])
+def test_rank_table_matches_treys(evaluator, n_cards):
+    rt = app.rank_table()
+    for cs in _hands(n_cards, 5000, n_cards):
+        expected = evaluator.evaluate(cs[:2], cs[2:])
+        got = rt.evaluate(cs[:2], cs[2:])
+        assert got == expected, cs
+        assert rt.get_rank_class(got) == evaluator.get_rank_class(expected)
+
+
+def test_rank_table_flush_heavy_hands(evaluator):
+    """同花/同花顺走单独的掩码表，专门多抽一些五张以上同色的牌。"""
+    rt = app.rank_table()
+    rng = random.Random(11)
+    for _ in range(3000):
+        suit = rng.randrange(4)
+        same = rng.sample([c for i, c in enumerate(app._FULL_DECK) if i % 4 == suit], rng.choice([5, 6, 7]))
+        others = [c for c in app._FULL_DECK if c not in same]
+        cs = same + rng.sample(others, 7 - len(same))
+        rng.shuffle(cs)
+        assert rt.evaluate(cs[:2], cs[2:]) == evaluator.evaluate(cs[:2], cs[2:])
+
+
+def test_numpy_rank_matches_treys(evaluator):
+    T = app._np_tables()
+    hands = _hands(7, 5000, 99)
+    idx = np.array([[app._CARD_INDEX[c] for c in cs] for cs in hands])
+    ranks = app._np_rank(T, T["card_key"][idx].sum(axis=1), T["card_sb"][idx].sum(axis=1))
+    assert ranks.tolist() == [evaluator.evaluate(cs[:2], cs[2:]) for cs in hands]
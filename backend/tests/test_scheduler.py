@@ -0,0 +1,103 @@
+# 任务调度：客户端之间轮转、排队上限与单客户端上限（/start 返回 429）
+import os
+import threading
+import time
+import uuid
+
+import pytest
+
+import app
+
+
+def _wait(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline: return False
+        time.sleep(0.01)
+    return True
+
+
+@pytest.fixture
+def gate():
+    """第一个任务占住唯一的工作线程，其余任务只能排队。"""
+    release, started = threading.Event(), threading.Event()
+    def blocker():
+        started.set()
+        release.wait(5)
+    yield blocker, started, release
+    release.set()
+
+
+def test_round_robin_between_clients(gate):
+    blocker, started, release = gate
+    sched = app.TaskScheduler(workers=1, max_queue=10, per_client_max=5)
+    order = []
+    sched.submit("busy", uuid.uuid4().hex, blocker, ())
+    assert started.wait(5)
+    for name in ("a1", "a2", "a3"):
+        sched.submit("A", name, order.append, (name,))
+    for name in ("b1", "b2"):
+        sched.submit("B", name, order.append, (name,))
+    sched.submit("C", "c1", order.append, ("c1",))
+    assert app.get_progress("c1")["stage"] == "排队中（第 3 位）"  # a1 → b1 → c1
+    release.set()
+    assert _wait(lambda: len(order) == 6)
+    assert order == ["a1", "b1", "c1", "a2", "b2", "a3"]
+
+
+def test_queue_limits_raise_queue_full(gate):
+    blocker, started, release = gate
+    sched = app.TaskScheduler(workers=1, max_queue=3, per_client_max=2)
+    sched.submit("busy", uuid.uuid4().hex, blocker, ())
+    assert started.wait(5)
+    sched.submit("A", uuid.uuid4().hex, lambda: None, ())
+    sched.submit("A", uuid.uuid4().hex, lambda: None, ())
+    with pytest.raises(app.QueueFull):  # 单客户端上限
+        sched.submit("A", uuid.uuid4().hex, lambda: None, ())
+    sched.submit("B", uuid.uuid4().hex, lambda: None, ())
+    with pytest.raises(app.QueueFull):  # 总排队上限
+        sched.submit("C", uuid.uuid4().hex, lambda: None, ())
+    assert sched.stats()["rejected"] == 2
+    release.set()
+    assert _wait(lambda: sched.stats()["queued"] == 0 and sched.stats()["running"] == 0)
+
+
+def test_start_returns_429_when_queue_is_full(monkeypatch, gate):
+    blocker, started, release = gate
+    sched = app.TaskScheduler(workers=1, max_queue=1, per_client_max=1)
+    monkeypatch.setattr(app, "SCHEDULER", sched)
+    sched.submit("busy", uuid.uuid4().hex, blocker, ())
+    assert started.wait(5)
+    client = app.app.test_client()
+    form = {"hero": "As Ks", "flop": "Qs Js 2h", "villains": "1"}
+    first = client.post("/start", data=form)
+    assert first.status_code == 200
+    second = client.post("/start", data=form)
+    assert second.status_code == 429
+    assert "Retry-After" in second.headers
+    assert "error" in second.get_json()
+
+
+def test_worker_survives_failing_task():
+    sched = app.TaskScheduler(workers=1, max_queue=10, per_client_max=5)
+    def boom():
+        raise RuntimeError("boom")
+    done = threading.Event()
+    sched.submit("A", uuid.uuid4().hex, boom, ())
+    sched.submit("A", uuid.uuid4().hex, done.set, ())
+    assert done.wait(5)  # 同一个工作线程接着跑下一个任务
+    assert _wait(lambda: sched.stats()["running"] == 0)
+    assert len(sched._threads) == 1 and sched._threads[0].is_alive()
+
+
+def test_dead_worker_is_respawned():
+    sched = app.TaskScheduler(workers=1, max_queue=10, per_client_max=5)
+    sched._pid = os.getpid()
+    dead = threading.Thread(target=lambda: None)
+    dead.start()
+    dead.join()
+    sched._threads = [dead]
+    done = threading.Event()
+    sched.submit("A", uuid.uuid4().hex, done.set, ())
+    assert done.wait(5)
+    assert dead not in sched._threads and len(sched._threads) == 1
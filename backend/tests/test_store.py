@@ -0,0 +1,121 @@
+# 任务状态存储：MemoryStore 与 SQLiteStore 行为一致
+import time
+
+import pytest
+
+import app
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "PROGRESS", {})
+    if request.param == "memory":
+        return app.MemoryStore(max_tasks=100, max_bytes=1 << 20)
+    return app.SQLiteStore(str(tmp_path / "tasks.db"), 0.05)
+
+
+def test_create_get_update(store):
+    store.create("t1", app._new_state(stage="排队中…"))
+    assert store.get("t1")["stage"] == "排队中…"
+    store.update("t1", {"pct": 40, "results": [{"title": "Flop"}]})
+    state = store.get("t1")
+    assert state["pct"] == 40 and state["stage"] == "排队中…"
+    assert state["results"] == [{"title": "Flop"}]
+    assert store.get("missing") is None
+    assert store.size() == 1
+
+
+def test_update_creates_missing_task(store):
+    store.update("t2", {"stage": "x"})
+    assert store.get("t2")["stage"] == "x" and store.get("t2")["done"] is False
+
+
+def test_cancel_delete_touch(store):
+    store.create("t1", app._new_state())
+    assert store.cancel("t1") is True
+    assert store.get("t1")["cancel"] is True
+    assert store.cancel("missing") is False
+    store.touch("t1")
+    store.delete("t1")
+    assert store.get("t1") is None and store.size() == 0
+
+
+def test_expire_returns_dead_ids(store):
+    store.create("old", app._new_state())
+    assert store.expire(3600) == []
+    assert store.expire(-1) == ["old"]  # 截止时间在未来：全部过期
+    assert store.get("old") is None
+
+
+def test_sqlite_version_and_sharing(tmp_path):
+    path = str(tmp_path / "shared.db")
+    a, b = app.SQLiteStore(path, 0.05), app.SQLiteStore(path, 0.05)
+    a.create("t1", app._new_state())
+    v0 = b.version("t1")
+    a.update("t1", {"pct": 10})
+    assert b.version("t1") == v0 + 1
+    assert b.get("t1")["pct"] == 10
+    assert b.cancel("t1") and a.get("t1")["cancel"] is True
+    assert a.version("missing") is None
+
+
+def test_sqlite_caps_finished_tasks(tmp_path):
+    s = app.SQLiteStore(str(tmp_path / "cap.db"), 0.05)
+    for k in range(4):
+        s.create(f"d{k}", app._new_state(done=True))
+    s.create("running", app._new_state())
+    dead = s.expire(3600, max_tasks=2)
+    assert sorted(dead) == ["d0", "d1", "d2"]
+    assert s.get("running") is not None and s.get("d3") is not None
+
+
+def test_memory_evicts_oldest_finished_first(monkeypatch):
+    monkeypatch.setattr(app, "PROGRESS", {})
+    s = app.MemoryStore(max_tasks=2, max_bytes=1 << 20)
+    s.create("running", app._new_state())
+    assert s.update("d1", {"done": True}) == []
+    assert s.update("d2", {"done": True}) == ["d1"]
+    assert s.get("running") is not None and s.get("d2") is not None
+
+
+def test_memory_caps_results_bytes(monkeypatch):
+    monkeypatch.setattr(app, "PROGRESS", {})
+    s = app.MemoryStore(max_tasks=100, max_bytes=200)
+    s.update("d1", {"results": ["x" * 150], "done": True})
+    dead = s.update("d2", {"results": ["y" * 150], "done": True})
+    assert dead == ["d1"] and s.bytes <= 200
+
+
+def test_memory_touch_survives_first_expiry(monkeypatch):
+    monkeypatch.setattr(app, "PROGRESS", {})
+    s = app.MemoryStore(max_tasks=100, max_bytes=1 << 20)
+    s.create("t1", app._new_state(ts=time.time() - 100))  # 入堆时已闲置 100 秒
+    s.touch("t1")
+    assert s.expire(50) == []  # 堆顶的旧时间已过期，但任务之后活动过：按新时间重新入堆
+    assert s.get("t1") is not None
+    assert [k for _, k in s._heap] == ["t1"] and s._heap[0][0] == s.get("t1")["ts"]
+    assert s.expire(-1) == ["t1"] and s._heap == []  # 重新入堆的那一项照常到期
+
+
+def test_reaper_thread_expires_tasks(monkeypatch):
+    monkeypatch.setattr(app, "PROGRESS", {})
+    monkeypatch.setattr(app, "STORE", app.MemoryStore(max_tasks=100, max_bytes=1 << 20))
+    monkeypatch.setattr(app, "TASK_TTL", 50)
+    monkeypatch.setattr(app, "TASK_REAP_S", 0.02)
+    monkeypatch.setitem(app._REAPER, "pid", None)
+    app.STORE.create("old", app._new_state(ts=time.time() - 100))
+    app.STORE.create("fresh", app._new_state())
+    app.set_progress("old", stage="x")  # 建一个通知通道，清理时应一并收掉
+    app.PROGRESS["old"]["ts"] = time.time() - 100
+    assert "old" in app.CHANNELS
+    before = {t.ident for t in app.threading.enumerate()}
+    app.ensure_reaper()
+    app.ensure_reaper()  # 同一进程只起一个
+    started = [t for t in app.threading.enumerate() if t.ident not in before]
+    assert len(started) == 1 and started[0].daemon
+    deadline = time.monotonic() + 5
+    while app.STORE.get("old") is not None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert app.STORE.get("old") is None and app.STORE.get("fresh") is not None
+    assert "old" not in app.CHANNELS
+    app.STORE.delete("fresh")
@@ -0,0 +1,58 @@
+# 分层抽样：等权分层估计的口径、与不分层相比无偏且方差更小；范围与 prior 下退回普通蒙特卡洛
+import statistics
+
+import pytest
+
+import app
+
+HERO, BOARD = "4h 3h", "Qh 7s 2h 9c"  # 小牌听同花/顺子：胜负几乎全看河牌，分层收益最明显
+ENGINES = {"python": lambda *a, **kw: app._equity_mc_python(*a, **kw)}
+if app.np is not None:
+    ENGINES["numpy"] = lambda *a, **kw: app._equity_mc_numpy(*a, **kw)
+
+
+def test_estimate_weights_strata_equally():
+    t = app._Tally(strata=2)
+    for k, shares in ((0, [1.0] * 10), (1, [0.0, 1.0] * 50)):  # 第 0 层 10 局全赢，第 1 层 100 局赢一半
+        for s in shares:
+            t.wins += s; t.sq += s * s; t.n += 1
+            t.s_w[k] += s; t.s_sq[k] += s * s; t.s_n[k] += 1
+    p, hw = t.estimate()
+    assert p == pytest.approx(0.75)  # 两层各占一半，而不是按样本数加权的 60/110
+    t.strata = 0
+    assert t.estimate()[0] == pytest.approx(60 / 110)
+    t.strata = 3  # 有层没有样本：退回整体估计
+    assert t.estimate()[0] == pytest.approx(60 / 110)
+
+
+@pytest.mark.parametrize("name", ENGINES)
+def test_stratified_is_unbiased_with_lower_variance(cards, name):
+    run = ENGINES[name]
+    hero, board = cards(HERO), cards(BOARD)
+    exact = app.equity_exact(hero, board, 1)
+    strat, plain = [], []
+    for seed in range(30):
+        ts = run(hero, board, 1, 2000, seed, 0.0, 30.0, None, stratify=True)
+        tp = run(hero, board, 1, 2000, seed + 1000, 0.0, 30.0, None, stratify=False)
+        assert ts.strata == 46 and tp.strata == 0
+        assert ts.estimate()[1] < tp.estimate()[1]  # 报告的置信半宽更窄
+        strat.append(ts.estimate()[0]); plain.append(tp.estimate()[0])
+    se = (exact * (1 - exact) / 2000 / 30) ** 0.5
+    assert abs(statistics.mean(strat) - exact) < 4 * se
+    assert abs(statistics.mean(plain) - exact) < 4 * se
+    assert statistics.variance(strat) < 0.5 * statistics.variance(plain)
+
+
+def test_prior_disables_stratification(cards):
+    hero, board = cards(HERO), cards(BOARD)
+    for run in ENGINES.values():
+        assert run(hero, board, 1, 2000, 1, 0.0, 30.0, None, prior=(300.0, 1000)).strata == 0
+
+
+@pytest.mark.skipif(app.np is None, reason="对手范围需要 numpy")
+def test_ranges_fall_back_to_plain_mc(cards):
+    hero, board = cards(HERO), cards(BOARD)
+    ranges = app.parse_ranges("QQ+,AQs", 1)
+    tally = app._equity_mc_numpy(hero, board, 1, 4000, 1, 0.0, 30.0, None, ranges, stratify=True)
+    assert tally.strata == 0 and tally.n == 4000
+    assert sum(tally.s_n) == 0
@@ -0,0 +1,23 @@
+# SSE 进度流：未知任务 404 且不留通道，任务结束后最后一个订阅者离开时收掉通道
+import uuid
+
+import app
+
+
+def test_unknown_task_is_404_without_channel():
+    task_id = uuid.uuid4().hex
+    resp = app.app.test_client().get(f"/stream/{task_id}")
+    assert resp.status_code == 404
+    assert task_id not in app.CHANNELS
+
+
+def test_finished_task_channel_is_dropped():
+    task_id = uuid.uuid4().hex
+    app.STORE.create(task_id, app._new_state())
+    app.set_progress(task_id, stage="完成", pct=100, done=True)
+    assert task_id in app.CHANNELS
+    resp = app.app.test_client().get(f"/stream/{task_id}")
+    body = resp.get_data(as_text=True)
+    assert resp.status_code == 200 and '"done": true' in body
+    assert task_id not in app.CHANNELS
+    app.STORE.delete(task_id)
@@ -0,0 +1,42 @@
+# 冷启动预热：不在 import 时启动，进程池子进程里不预热、不建池
+import pytest
+
+import app
+
+
+@pytest.fixture
+def started(monkeypatch):
+    calls = []
+    monkeypatch.setattr(app, "WARMUP", True)
+    monkeypatch.setattr(app, "_WARM", {"pid": None, "state": "cold", "started": None, "elapsed_s": None, "steps": {}})
+    monkeypatch.setattr(app, "_start_os_thread", calls.append)
+    return calls
+
+
+def test_import_does_not_start_warmup():
+    assert app._WARM["pid"] is None
+
+
+def test_ensure_warmup_starts_once_per_process(started):
+    app.ensure_warmup()
+    app.ensure_warmup()
+    assert started == [app._warmup]
+    assert app._ready_payload()["state"] == "warming"
+
+
+def test_no_warmup_or_pool_in_pool_children(started, monkeypatch):
+    monkeypatch.setattr(app.multiprocessing, "parent_process", lambda: object())
+    app.ensure_warmup()
+    assert started == [] and app._WARM["pid"] is None
+    monkeypatch.setattr(app, "_POOL", None)
+    with pytest.raises(RuntimeError):
+        app.equity_pool()
+
+
+def test_warmup_marks_ready(monkeypatch):
+    monkeypatch.setattr(app, "WARMUP", True)
+    monkeypatch.setattr(app, "_WARM", {"pid": 1, "state": "warming", "started": 0.0, "elapsed_s": None, "steps": {}})
+    monkeypatch.setattr(app, "_warm_steps", lambda: [("a", lambda: "备注", True), ("b", lambda: 1 / 0, False)])
+    app._warmup()
+    ready = app._ready_payload()
+    assert ready["ready"] and ready["steps"]["a"]["note"] == "备注" and not ready["steps"]["b"]["ok"]
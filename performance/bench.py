@@ -0,0 +1,282 @@
+"""
+Python 3 基准测试：牌力评估、蒙特卡洛胜率引擎、牌面解析，以及 /start → 完成 的端到端延迟（本地 LLM 桩服务）。
+
+    python performance/bench.py                          # 全部跑一遍，打印表格
+    python performance/bench.py --quick --json out.json  # 缩小规模，结果写成 JSON
+    python performance/bench.py --baseline base.json     # 与基线比较，退化超过 --tolerance 时退出码为 1
+    python performance/bench.py --only eval,equity       # 只跑部分分组：eval / equity / parse / e2e
+
+每项指标记为 {"value", "unit", "higher_is_better"}；吞吐类取多轮里最好的一轮，延迟类给 p50/p95。
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "backend")
+RANKS, SUITS = "23456789TJQKA", "shdc"
+DECK = [r + s for r in RANKS for s in SUITS]
+
+
+# ========= LLM 桩服务（兼容 OpenAI chat.completions，含流式） =========
+STUB_ADVICE = {"action": "check", "sizing": "check", "summary": "控制底池", "opponent_compare": "势均力敌", "tips": ["谨慎"]}
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    delay_s = 0.0
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        req = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        time.sleep(self.delay_s)
+        text = json.dumps(STUB_ADVICE, ensure_ascii=False)
+        if req.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            def chunk(data):
+                self.wfile.write(b"%x\r\n" % len(data) + data + b"\r\n")
+            for i in range(0, len(text), 8):
+                ev = {"id": "bench", "object": "chat.completion.chunk", "created": 0, "model": "stub",
+                      "choices": [{"index": 0, "delta": {"content": text[i:i+8]}, "finish_reason": None}]}
+                chunk(("data: " + json.dumps(ev, ensure_ascii=False) + "\n\n").encode())
+            chunk(b"data: [DONE]\n\n")
+            chunk(b"")
+            return
+        body = json.dumps({"id": "bench", "object": "chat.completion", "created": 0, "model": "stub",
+                           "choices": [{"index": 0, "finish_reason": "stop",
+                                        "message": {"role": "assistant", "content": text}}],
+                           "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def start_stub(delay_s):
+    _StubHandler.delay_s = delay_s
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+# ========= 工具 =========
+def best_rate(fn, count, repeat):
+    """fn() 完成 count 次操作；返回多轮里最高的 次/秒。"""
+    best = 0.0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = max(best, count / (time.perf_counter() - t0))
+    return best
+
+def rate(value, unit="ops/s"):
+    return {"value": round(value, 2), "unit": unit, "higher_is_better": True}
+
+def latency(value):
+    return {"value": round(value, 4), "unit": "s", "higher_is_better": False}
+
+def deal(rng, n):
+    return rng.sample(DECK, n)
+
+
+# ========= 分组 =========
+def bench_eval(app, scale, repeat):
+    from treys import Card, Evaluator
+    rng = random.Random(1)
+    ev, rt = Evaluator(), app.rank_table()
+    out = {}
+    n = int(20000 * scale)
+    for size in (5, 6, 7):
+        hands = [[Card.new(c) for c in deal(rng, size)] for _ in range(n)]
+        split = [(h[:2], h[2:]) for h in hands]
+        out[f"eval{size}.treys"] = rate(best_rate(lambda: [ev.evaluate(b, h) for h, b in split], n, repeat))
+        out[f"eval{size}.rank_table"] = rate(best_rate(lambda: [rt.evaluate(h, b) for h, b in split], n, repeat))
+    if app.np is not None:
+        np = app.np
+        tables = app._np_tables()
+        idx = np.array([rng.sample(range(52), 7) for _ in range(n)], dtype=np.int64)
+        def batch():
+            key = tables["card_key"][idx].sum(axis=1)
+            sb = tables["card_sb"][idx].sum(axis=1)
+            app._np_rank(tables, key, sb)
+        out["eval7.numpy_batch"] = rate(best_rate(batch, n, repeat))
+    return out
+
+def python_ref(app, hero, board, villains, trials, seed, *_):
+    """旧版纯 Python 热循环（每局 sample + 切片 + 元组 + evaluate），与 python 引擎同种子对照。"""
+    ev = app.rank_table()
+    rng = random.Random(seed)
+    known = set(hero) | set(board)
+    avail = [c for c in app._FULL_DECK if c not in known]
+    need_opp = villains * 2
+    need_total = 5 - len(board) + need_opp
+    wins = 0.0
+    for _ in range(trials):
+        draw = rng.sample(avail, need_total)
+        opp = draw[:need_opp]; pub = draw[need_opp:]
+        vill = [(opp[i], opp[i+1]) for i in range(0, need_opp, 2)]
+        b = tuple(board) + tuple(pub)
+        my = ev.evaluate(tuple(hero), b)
+        best = 7463; ties = 0
+        for v1, v2 in vill:
+            s = ev.evaluate((v1, v2), b)
+            if s < best: best = s; ties = 1
+            elif s == best: ties += 1
+        wins += 1.0 if my < best else (1.0/(ties+1) if my == best else 0.0)
+    return wins / trials
+
+def bench_equity(app, scale, repeat):
+    from treys import Card
+    rng = random.Random(2)
+    out = {}
+    engines = [("numpy", app._equity_mc_numpy)] if app.np is not None else []
+    engines.append(("python", lambda *a: app._equity_mc_python(*a[:8])))
+    engines.append(("python_ref", lambda *a: python_ref(app, *a)))
+    for street, n_board in (("preflop", 0), ("flop", 3), ("turn", 4)):
+        for villains in (1, 3):
+            cards = [Card.new(c) for c in deal(rng, 2 + n_board)]
+            hero, board = cards[:2], cards[2:]
+            for name, fn in engines:
+                trials = int((200000 if name == "numpy" else 5000) * scale)
+                def run():
+                    fn(hero, board, villains, trials, 7, 0.0, 1e9, None)
+                out[f"equity.{name}.{street}.v{villains}"] = rate(best_rate(run, trials, repeat), "trials/s")
+    if app.np is not None:
+        # 下一张牌逐张胜率（蒙特卡洛路径）：每局代入全部候选牌，按发牌局数计
+        cards = [Card.new(c) for c in deal(rng, 5)]
+        trials = int(2000 * scale)
+        def sweep():
+            app.next_card_sweep(cards[:2], cards[2:], 3, trials, seed=7)
+        out["equity.next_card_sweep.flop.v3"] = rate(best_rate(sweep, trials, repeat), "trials/s")
+    return out
+
+def bench_parse(app, scale, repeat):
+    rng = random.Random(3)
+    n = int(20000 * scale)
+    lines = []
+    for _ in range(n):
+        cards = deal(rng, rng.choice((1, 2, 3)))
+        lines.append(rng.choice((" ", ",", "、", "/")).join(cards))
+    def run():
+        for line in lines:
+            app.parse_cards(line, 1, 3)
+    return {"parse_cards": rate(best_rate(run, n, repeat), "lines/s"),
+            "parse_many": rate(best_rate(lambda: app.parse_many(lines, 1, 3), n, repeat), "lines/s")}
+
+def bench_e2e(app, scale, repeat):
+    rng = random.Random(4)
+    client = app.app.test_client()
+    runs = max(3, int(20 * scale))
+    samples = []
+    for _ in range(runs):
+        c = deal(rng, 7)
+        form = {"hero": " ".join(c[:2]), "flop": " ".join(c[2:5]), "turn": c[5], "river": c[6],
+                "villains": str(rng.choice((1, 2, 3))), "pot_bb": "10", "stack_bb": "60", "call_turn": "4"}
+        t0 = time.perf_counter()
+        resp = client.post("/start", data=form)
+        task_id = resp.get_json()["task_id"]
+        body = client.get(f"/stream/{task_id}").get_data(as_text=True)
+        samples.append(time.perf_counter() - t0)
+        if '"done": true' not in body:
+            raise RuntimeError(f"任务未完成：{body[-300:]}")
+    samples.sort()
+    return {"e2e.start_to_done.p50": latency(statistics.median(samples)),
+            "e2e.start_to_done.p95": latency(samples[min(len(samples) - 1, int(len(samples) * 0.95))])}
+
+GROUPS = {"eval": bench_eval, "equity": bench_equity, "parse": bench_parse, "e2e": bench_e2e}
+
+
+# ========= 基线比较 =========
+def compare(results, baseline, tolerance):
+    """返回退化项列表；tolerance=0.2 表示吞吐低于基线 80% 或延迟高于基线 120% 记为退化。"""
+    regressions = []
+    for name, base in baseline.get("results", {}).items():
+        cur = results.get(name)
+        if cur is None or not base.get("value"):
+            continue
+        ratio = cur["value"] / base["value"]
+        worse = ratio < 1 - tolerance if base.get("higher_is_better", True) else ratio > 1 + tolerance
+        if worse:
+            regressions.append((name, base["value"], cur["value"], ratio))
+    return regressions
+
+def git_rev():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=BACKEND, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    p.add_argument("--quick", action="store_true", help="规模缩小到 1/10，适合 CI")
+    p.add_argument("--repeat", type=int, default=3, help="吞吐类每项跑几轮取最好")
+    p.add_argument("--only", default=",".join(GROUPS), help="逗号分隔的分组")
+    p.add_argument("--json", dest="json_out", help="结果写到该文件（- 为标准输出）")
+    p.add_argument("--baseline", help="与之比较的历史结果 JSON")
+    p.add_argument("--tolerance", type=float, default=0.2)
+    p.add_argument("--llm-delay", type=float, default=0.05, help="LLM 桩服务每次响应前的延迟（秒）")
+    args = p.parse_args(argv)
+
+    groups = [g.strip() for g in args.only.split(",") if g.strip()]
+    unknown = set(groups) - set(GROUPS)
+    if unknown:
+        p.error(f"未知分组：{', '.join(sorted(unknown))}")
+
+    # 端到端测的是真实路径：关掉缓存、LLM 指向本地桩服务；须在导入 app 之前设好环境变量。
+    # 关掉后台预热，免得它和第一组测量抢 CPU
+    os.environ.setdefault("WARMUP", "0")
+    stub = None
+    if "e2e" in groups:
+        stub, base_url = start_stub(args.llm_delay)
+        os.environ.update({"OPENAI_API_KEY": "bench", "OPENAI_BASE_URL": base_url,
+                           "EQUITY_CACHE_SIZE": "0", "ADVICE_CACHE_SIZE": "0"})
+    sys.path.insert(0, os.path.abspath(BACKEND))
+    import app
+
+    scale = 0.1 if args.quick else 1.0
+    results = {}
+    for g in groups:
+        t0 = time.perf_counter()
+        results.update(GROUPS[g](app, scale, 1 if g == "e2e" else args.repeat))
+        print(f"[{g}] {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+    if stub is not None:
+        stub.shutdown()
+
+    report = {
+        "meta": {"python": platform.python_version(), "platform": platform.platform(),
+                 "numpy": getattr(app.np, "__version__", None), "engine": app.EQUITY_ENGINE,
+                 "git": git_rev(), "quick": args.quick, "ts": time.strftime("%Y-%m-%dT%H:%M:%S%z")},
+        "results": results,
+    }
+    width = max(len(k) for k in results) if results else 10
+    for name, r in results.items():
+        print(f"{name:<{width}}  {r['value']:>14,.2f} {r['unit']}", file=sys.stderr)
+    if args.json_out == "-":
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    elif args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for name, base, cur, ratio in regressions:
+            print(f"REGRESSION {name}: {base} -> {cur} ({ratio:.2f}x)", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())